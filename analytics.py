@@ -5,8 +5,7 @@ Cálculo de métricas, tendencias y gráficos
 import logging
 import statistics
 from typing import List, Dict, Optional, Tuple
-from datetime import datetime, timedelta
-from collections import defaultdict
+from datetime import date
 from database import Database
 
 logger = logging.getLogger(__name__)
@@ -17,7 +16,7 @@ class Analytics:
 
     def __init__(self):
         """Inicializar analytics"""
-        self.db = Database()
+        self.db = Database(read_only=True)
 
     def calculate_kpis(self) -> Dict:
         """
@@ -60,15 +59,7 @@ class Analytics:
         """
         logger.info("⏰ Calculando distribución por hora...")
 
-        transactions = self.db.get_transactions(limit=10000)
-        hourly = defaultdict(int)
-
-        for t in transactions:
-            hour = datetime.fromisoformat(t['created_at']).hour
-            sms_count = int(t['sms_count'])
-            hourly[hour] += sms_count
-
-        return dict(sorted(hourly.items()))
+        return self.db.get_hourly_sms()
 
     def get_daily_distribution(self, days: int = 30) -> Dict:
         """
@@ -82,15 +73,10 @@ class Analytics:
         """
         logger.info(f"📅 Calculando distribución diaria (últimos {days} días)...")
 
-        transactions = self.db.get_transactions(limit=10000)
-        daily = defaultdict(int)
-
-        for t in transactions:
-            date = datetime.fromisoformat(t['created_at']).date()
-            sms_count = int(t['sms_count'])
-            daily[date] += sms_count
-
-        return dict(sorted(daily.items(), reverse=True)[:days])
+        return {
+            date.fromisoformat(row["day"]): row["sms"]
+            for row in self.db.get_daily_sms(days)
+        }
 
     def get_top_operations(self, limit: int = 10) -> List[Dict]:
         """
@@ -104,31 +90,14 @@ class Analytics:
         """
         logger.info(f"🏆 Obteniendo top {limit} operaciones...")
 
-        transactions = self.db.get_transactions(limit=10000)
-
-        # Agrupar por operación
-        by_operation = defaultdict(lambda: {"count": 0, "total_sms": 0})
-
-        for t in transactions:
-            op = t['operation']
-            by_operation[op]["count"] += 1
-            by_operation[op]["total_sms"] += int(t['sms_count'])
-
-        # Ordenar por total de SMS
-        sorted_ops = sorted(
-            by_operation.items(),
-            key=lambda x: x[1]["total_sms"],
-            reverse=True
-        )
-
         return [
             {
-                "operation": op,
-                "count": data["count"],
-                "total_sms": data["total_sms"],
-                "avg_sms_per_operation": data["total_sms"] / data["count"] if data["count"] > 0 else 0
+                "operation": row["operation"],
+                "count": row["count"],
+                "total_sms": row["total_sms"],
+                "avg_sms_per_operation": row["total_sms"] / row["count"] if row["count"] > 0 else 0
             }
-            for op, data in sorted_ops[:limit]
+            for row in self.db.get_operation_totals(limit)
         ]
 
     def calculate_statistics(self, values: List[float]) -> Dict:
@@ -163,8 +132,8 @@ class Analytics:
         """
         logger.info("⚡ Calculando métricas de desempeño...")
 
-        transactions = self.db.get_transactions(limit=10000)
-        sms_counts = [int(t['sms_count']) for t in transactions if t['sms_count']]
+        transactions = self.db.get_transaction_records(limit=10000)
+        sms_counts = [int(t.sms_count) for t in transactions if t.sms_count]
 
         stats = {
             "kpis": self.calculate_kpis(),
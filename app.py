@@ -2,8 +2,10 @@
 Aplicación web Flask para Goleador SMS Marketing
 Dashboard y panel de control
 """
+import json
 import logging
-from flask import Flask, render_template, request, jsonify, redirect, url_for
+import multiprocessing
+from flask import Flask, Response, render_template, request, jsonify, redirect, url_for, stream_with_context
 from flask_cors import CORS
 from datetime import datetime, timedelta
 from auth import SessionManager
@@ -13,6 +15,7 @@ from task_manager import TaskManager
 from sms_sender import SMSSender
 from cache import BalanceCache
 from mock_data import mock_provider
+from config import CAMPAIGN_RESUME_ON_STARTUP, UPLOAD_MAX_MB
 
 # Configurar logging
 logging.basicConfig(
@@ -24,6 +27,8 @@ logger = logging.getLogger(__name__)
 # Crear aplicación Flask
 app = Flask(__name__)
 app.secret_key = "goleador_sms_marketing_secret_key"
+# Rechazar archivos de contactos demasiado grandes antes de escribirlos en disco
+app.config["MAX_CONTENT_LENGTH"] = UPLOAD_MAX_MB * 1024 * 1024
 CORS(app)
 
 # Inicializar componentes
@@ -34,6 +39,12 @@ task_manager = TaskManager()
 sms_sender = SMSSender()
 balance_cache = BalanceCache(ttl=300)
 
+# Reanudar campañas que quedaron a medias por una caída o un redeploy (no en
+# los procesos emisores, que reimportan este módulo al arrancar con spawn)
+if CAMPAIGN_RESUME_ON_STARTUP and multiprocessing.parent_process() is None:
+    from campaign_processor import campaign_processor
+    campaign_processor.start_resume_thread()
+
 logger.info("🚀 Aplicación Flask inicializada")
 
 
@@ -220,10 +231,15 @@ def api_sms_send():
     try:
         data = request.get_json()
 
+        # Clave de idempotencia del cliente (cabecera o cuerpo); si no llega
+        # el sender la deriva del contenido del envío
+        idempotency_key = request.headers.get("Idempotency-Key") or data.get("idempotency_key")
+
         result = sms_sender.send_sms(
             numbers=data.get("numbers", []),
             content=data.get("content", ""),
-            sender=data.get("sender")
+            sender=data.get("sender"),
+            idempotency_key=idempotency_key
         )
 
         return jsonify(result)
@@ -244,10 +260,13 @@ def api_sms_history():
     logger.info("📋 GET /api/sms/history")
 
     try:
-        limit = request.args.get("limit", 100, type=int)
-        sms_list = report_gen.db.get_all_sms(limit=limit)
+        limit = max(1, min(request.args.get("limit", 100, type=int), 1000))
+        cursor = request.args.get("cursor")
+        sms_list, next_cursor = report_gen.db.get_sms_page(limit=limit, cursor=cursor)
 
-        return jsonify({"code": 0, "data": sms_list})
+        return jsonify({"code": 0, "data": sms_list, "next_cursor": next_cursor})
+    except ValueError as e:
+        return jsonify({"code": -1, "error": str(e)}), 400
     except Exception as e:
         logger.error(f"❌ Error: {str(e)}")
         return jsonify({"code": -1, "error": str(e)}), 500
@@ -261,7 +280,10 @@ def api_reports_sms():
     logger.info("📊 GET /api/reports/sms")
 
     try:
-        report = report_gen.generate_sms_report()
+        report = report_gen.generate_sms_report(
+            details_limit=request.args.get("details", type=int),
+            offset=request.args.get("offset", 0, type=int)
+        )
         return jsonify({"code": 0, "data": report})
     except Exception as e:
         logger.error(f"❌ Error: {str(e)}")
@@ -274,7 +296,10 @@ def api_reports_delivery():
     logger.info("📋 GET /api/reports/delivery")
 
     try:
-        report = report_gen.generate_delivery_report()
+        report = report_gen.generate_delivery_report(
+            details_limit=request.args.get("details", type=int),
+            offset=request.args.get("offset", 0, type=int)
+        )
         return jsonify({"code": 0, "data": report})
     except Exception as e:
         logger.error(f"❌ Error: {str(e)}")
@@ -391,18 +416,27 @@ def api_campaigns_upload():
         if file.filename == '':
             return jsonify({"code": -1, "error": "Archivo vacío"}), 400
 
-        # Importar excel_loader
-        from excel_loader import excel_loader
-
-        # Guardar temporalmente
-        import tempfile
         import os
+        import campaign_pipeline
 
-        with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1]) as tmp:
-            file.save(tmp.name)
-            result = excel_loader.read_excel(tmp.name)
+        # Guardar el archivo; solo el resumen viaja en la respuesta
+        upload = campaign_pipeline.store_upload(file, file.filename)
+        try:
+            report = campaign_pipeline.scan_file(upload["path"])
+        except Exception as e:
+            os.remove(upload["path"])
+            return jsonify({"status": "error", "message": str(e), "errors": [str(e)]})
 
-        return jsonify(result)
+        summary = report.to_dict()
+
+        from campaign_processor import campaign_processor
+        campaign_processor.register_import(upload["excel_import_id"], upload["path"], summary, file.filename)
+
+        return jsonify({
+            "status": "success",
+            "excel_import_id": upload["excel_import_id"],
+            **summary
+        })
 
     except Exception as e:
         logger.error(f"❌ Error: {str(e)}")
@@ -452,14 +486,22 @@ def api_campaigns_process(campaign_id):
     logger.info(f"⚙️ POST /api/campaigns/{campaign_id}/process")
 
     try:
-        data = request.get_json()
+        data = request.get_json(silent=True) or {}
         from campaign_processor import campaign_processor
 
-        result = campaign_processor.process_contacts(
-            campaign_id=campaign_id,
-            contacts=data.get('contacts', []),
-            template=data.get('template', '')
-        )
+        if 'contacts' not in data:
+            # El archivo ya está en el servidor: se procesa en streaming
+            result = campaign_processor.process_import(
+                campaign_id=campaign_id,
+                excel_import_id=data.get('excel_import_id'),
+                template=data.get('template')
+            )
+        else:
+            result = campaign_processor.process_contacts(
+                campaign_id=campaign_id,
+                contacts=data.get('contacts', []),
+                template=data.get('template', '')
+            )
 
         return jsonify({
             "code": 0 if result['success'] else -1,
@@ -491,6 +533,26 @@ def api_campaigns_send(campaign_id):
         return jsonify({"code": -1, "error": str(e)}), 500
 
 
+@app.route("/api/campaigns/<campaign_id>/resume", methods=["POST"])
+def api_campaigns_resume(campaign_id):
+    """Reanudar campaña interrumpida desde su último checkpoint"""
+    logger.info(f"🔁 POST /api/campaigns/{campaign_id}/resume")
+
+    try:
+        from campaign_processor import campaign_processor
+
+        result = campaign_processor.resume_campaign(campaign_id)
+
+        return jsonify({
+            "code": 0 if result['success'] else -1,
+            "data": result
+        })
+
+    except Exception as e:
+        logger.error(f"❌ Error: {str(e)}")
+        return jsonify({"code": -1, "error": str(e)}), 500
+
+
 @app.route("/api/campaigns/<campaign_id>/progress", methods=["GET"])
 def api_campaigns_progress(campaign_id):
     """Obtener progreso de campaña"""
@@ -511,6 +573,86 @@ def api_campaigns_progress(campaign_id):
         return jsonify({"code": -1, "error": str(e)}), 500
 
 
+@app.route("/api/campaigns/<campaign_id>/progress/stream", methods=["GET"])
+def api_campaigns_progress_stream(campaign_id):
+    """Progreso de campaña por Server-Sent Events (solo se envían los cambios)"""
+    logger.info(f"📡 GET /api/campaigns/{campaign_id}/progress/stream")
+
+    from campaign_processor import campaign_processor, FINAL_STATUSES
+
+    def events():
+        # El navegador reintenta a los 2 s cuando el stream se cierra por tiempo
+        yield "retry: 2000\n\n"
+        status = None
+        idle = 0
+        for delta in campaign_processor.watch_progress(campaign_id):
+            if delta:
+                status = delta.get("status", status)
+                idle = 0
+                yield f"data: {json.dumps(delta)}\n\n"
+            else:
+                # Comentario periódico para que los proxies no corten la conexión
+                idle += 1
+                if idle % 15 == 0:
+                    yield ": keepalive\n\n"
+
+        # Campaña terminada: el cliente cierra en lugar de reconectar
+        if status in FINAL_STATUSES:
+            yield "event: end\ndata: {}\n\n"
+
+    return Response(stream_with_context(events()), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+
+
+# ==================== API: DIAGNÓSTICO DE CONSULTAS ====================
+
+@app.route("/api/debug/queries")
+def api_debug_queries():
+    """Estadísticas del perfilador de consultas SQL (requiere DB_PROFILE=true)"""
+    logger.info("🐢 GET /api/debug/queries")
+
+    from query_profiler import profiler
+
+    if not profiler.enabled:
+        return jsonify({"code": -1, "error": "Perfilador desactivado (DB_PROFILE=false)"}), 404
+
+    sort_by = request.args.get("sort", "total_ms")
+    limit = request.args.get("limit", 50, type=int)
+    return jsonify({"code": 0, "data": profiler.get_report(sort_by=sort_by, limit=limit)})
+
+
+@app.route("/api/debug/queries/dump", methods=["POST"])
+def api_debug_queries_dump():
+    """Volcar las estadísticas del perfilador a un archivo JSON"""
+    logger.info("💾 POST /api/debug/queries/dump")
+
+    from query_profiler import profiler
+
+    if not profiler.enabled:
+        return jsonify({"code": -1, "error": "Perfilador desactivado (DB_PROFILE=false)"}), 404
+
+    # La ruta la fija la configuración, nunca el cliente
+    from config import DB_PROFILE_DUMP
+    path = profiler.dump(DB_PROFILE_DUMP or f"query_profile_{datetime.now():%Y%m%d_%H%M%S}.json")
+    return jsonify({"code": 0, "data": {"dump": path}})
+
+
+@app.route("/api/debug/queries/reset", methods=["POST"])
+def api_debug_queries_reset():
+    """Reiniciar las estadísticas del perfilador"""
+    logger.info("🔄 POST /api/debug/queries/reset")
+
+    from query_profiler import profiler
+
+    if not profiler.enabled:
+        return jsonify({"code": -1, "error": "Perfilador desactivado (DB_PROFILE=false)"}), 404
+
+    profiler.reset()
+    return jsonify({"code": 0, "message": "Estadísticas reiniciadas"})
+
+
 # ==================== MANEJO DE ERRORES ====================
 
 @app.errorhandler(404)
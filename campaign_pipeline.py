@@ -0,0 +1,470 @@
+"""
+CAMPAIGN PIPELINE - Pipeline en streaming de archivo a campaña
+Etapas parse → validate → dedupe → render → persist conectadas con
+generadores; solo los lotes en vuelo viven en memoria
+"""
+
+import logging
+import os
+import queue
+import re
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime
+from itertools import islice
+from typing import Callable, Dict, Iterable, Iterator, List, Mapping, Optional, Sequence
+
+from config import (UPLOAD_DIR, UPLOAD_TTL_HOURS, CAMPAIGN_BATCH_SIZE, CAMPAIGN_BUFFER_BATCHES,
+                    CAMPAIGN_MAX_REPORTED_ERRORS)
+from excel_loader import ExcelLoader, excel_loader
+from template_engine import compile_template
+
+logger = logging.getLogger(__name__)
+
+# Longitud máxima de un mensaje renderizado
+MAX_MESSAGE_LENGTH = 1000
+
+# Contactos de muestra que se devuelven al subir el archivo
+PREVIEW_ROWS = 5
+
+_IMPORT_ID_PATTERN = re.compile(r"^[0-9a-f\-]{36}$")
+
+
+class ErrorLog:
+    """Errores por fila: se cuentan todos y se conservan los primeros"""
+
+    def __init__(self, limit: int = CAMPAIGN_MAX_REPORTED_ERRORS):
+        """
+        Inicializar registro
+
+        Args:
+            limit: Errores que se conservan con su mensaje
+        """
+        self.limit = limit
+        self.count = 0
+        self.sample: List[str] = []
+
+    def append(self, error: str):
+        """Registrar un error (compatible con List.append)"""
+        self.count += 1
+        if len(self.sample) < self.limit:
+            self.sample.append(error)
+
+    def __len__(self):
+        return self.count
+
+
+@dataclass
+class PipelineReport:
+    """Resumen de una pasada del pipeline (lo único que viaja por HTTP)"""
+    total_rows: int = 0
+    valid_rows: int = 0
+    duplicate_rows: int = 0
+    rendered: int = 0
+    persisted: int = 0
+    errors: ErrorLog = field(default_factory=ErrorLog)
+    detected_variables: List[str] = field(default_factory=list)
+    missing_variables: List[str] = field(default_factory=list)
+    preview: List[Dict] = field(default_factory=list)
+    sample_message: str = ""
+
+    def to_dict(self) -> Dict:
+        """Convertir a diccionario"""
+        errors = list(self.errors.sample)
+        if self.duplicate_rows:
+            errors.append(f"⚠️ {self.duplicate_rows} números duplicados detectados")
+
+        return {
+            "total_rows": self.total_rows,
+            "valid_rows": self.valid_rows,
+            "invalid_rows": self.errors.count,
+            "duplicate_rows": self.duplicate_rows,
+            "rendered": self.rendered,
+            "persisted": self.persisted,
+            "errors": errors,
+            "detected_variables": self.detected_variables,
+            "missing_variables": self.missing_variables,
+            "preview": self.preview,
+            "sample_message": self.sample_message,
+            "timestamp": datetime.now().isoformat()
+        }
+
+
+# ============= ETAPAS =============
+
+def parse(file_path: str, sheet_name: str = 'Contactos',
+          loader: ExcelLoader = excel_loader) -> Iterator[Sequence]:
+    """
+    Etapa parse: filas crudas del archivo (la primera es el encabezado)
+
+    Args:
+        file_path: Ruta del archivo de contactos
+        sheet_name: Hoja a leer
+        loader: Cargador de Excel
+
+    Returns:
+        Iterador de filas
+    """
+    return loader.iter_rows(file_path, sheet_name)
+
+
+def validate(rows: Iterator[Sequence], report: PipelineReport,
+             loader: ExcelLoader = excel_loader) -> Iterator[Dict]:
+    """
+    Etapa validate: encabezados, número válido y variables por fila
+
+    Args:
+        rows: Filas crudas (encabezado primero)
+        report: Resumen a actualizar
+        loader: Cargador de Excel
+
+    Returns:
+        Iterador de contactos válidos
+    """
+    rows = iter(rows)
+    headers, phone_col = loader.parse_header(next(rows, None))
+    report.detected_variables = sorted(h for idx, h in enumerate(headers) if idx != phone_col)
+
+    for row_idx, row in enumerate(rows, start=2):
+        if loader.is_blank(row):
+            continue
+        report.total_rows += 1
+        contact = loader._parse_row(row, headers, phone_col, row_idx, report.errors)
+        if contact:
+            yield contact
+
+
+def dedupe(contacts: Iterable[Dict], report: PipelineReport) -> Iterator[Dict]:
+    """
+    Etapa dedupe: descartar números repetidos
+
+    Los números ya normalizados son solo dígitos; se guardan como int
+    (con un 1 delante para conservar los ceros iniciales) para que el
+    conjunto de vistos ocupe lo mínimo.
+
+    Args:
+        contacts: Contactos validados
+        report: Resumen a actualizar
+
+    Returns:
+        Iterador de contactos únicos
+    """
+    seen = set()
+    for contact in contacts:
+        number = contact['numero']
+        key = int("1" + number) if number.isdigit() else number
+        if key in seen:
+            report.duplicate_rows += 1
+            continue
+        seen.add(key)
+        report.valid_rows += 1
+        if len(report.preview) < PREVIEW_ROWS:
+            report.preview.append(contact)
+        yield contact
+
+
+def render(contacts: Iterable[Mapping], campaign_id: str, template: str,
+           report: PipelineReport) -> Iterator[Dict]:
+    """
+    Etapa render: sustituir variables y armar la fila del contacto
+
+    Args:
+        contacts: Contactos con 'numero' y 'variables'
+        campaign_id: ID de la campaña
+        template: Plantilla con {{variables}}
+        report: Resumen a actualizar
+
+    Returns:
+        Iterador de contactos procesados (listos para persistir)
+    """
+    compiled = compile_template(template)
+    render_message = compiled.render
+    known = set(compiled.variables)
+    missing = set()
+    created_at = datetime.now().isoformat()
+
+    try:
+        for idx, contact in enumerate(contacts):
+            try:
+                variables = contact.get('variables', {})
+                message = render_message(variables)
+
+                if len(missing) < len(known):
+                    missing.update(known.difference(variables))
+
+                # Verificar longitud del mensaje
+                if len(message) > MAX_MESSAGE_LENGTH:
+                    report.errors.append(f"Contacto {idx + 1}: Mensaje muy largo ({len(message)} chars)")
+                    continue
+
+                report.rendered += 1
+                if not report.sample_message:
+                    report.sample_message = message
+
+                yield {
+                    "id": str(uuid.uuid4()),
+                    "campaign_id": campaign_id,
+                    "seq": report.rendered,
+                    "numero": contact['numero'],
+                    "nombre": contact.get('nombre', ''),
+                    "variables": variables,
+                    "processed_message": message,
+                    "status": "pending",
+                    "created_at": created_at
+                }
+
+            except Exception as e:
+                report.errors.append(f"Contacto {idx + 1}: Error: {str(e)}")
+    finally:
+        report.missing_variables = sorted(missing)
+
+
+def batched(items: Iterable, size: int = CAMPAIGN_BATCH_SIZE) -> Iterator[List]:
+    """
+    Agrupar un iterador en listas de tamaño fijo
+
+    Args:
+        items: Elementos
+        size: Tamaño del lote
+
+    Returns:
+        Iterador de lotes (el último puede ser menor)
+    """
+    items = iter(items)
+    while True:
+        batch = list(islice(items, size))
+        if not batch:
+            return
+        yield batch
+
+
+class _Failure:
+    """Excepción del hilo productor, reenviada al consumidor"""
+
+    __slots__ = ("error",)
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+_DONE = object()
+
+
+def buffered(items: Iterable, maxsize: int = CAMPAIGN_BUFFER_BATCHES) -> Iterator:
+    """
+    Producir en un hilo aparte a través de una cola acotada
+
+    Permite que la lectura del archivo avance mientras la etapa siguiente
+    escribe en la base; la cola limita los elementos en vuelo.
+
+    Args:
+        items: Iterador productor (se consume en el hilo auxiliar)
+        maxsize: Elementos máximos en la cola
+
+    Returns:
+        Iterador con los mismos elementos en el mismo orden
+    """
+    buffer = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                if not put(item):
+                    return
+            put(_DONE)
+        except BaseException as e:
+            put(_Failure(e))
+        finally:
+            close = getattr(items, "close", None)
+            if close:
+                close()
+
+    producer = threading.Thread(target=produce, name="campaign-pipeline", daemon=True)
+    producer.start()
+
+    try:
+        while True:
+            item = buffer.get()
+            if item is _DONE:
+                return
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+    finally:
+        stop.set()
+        producer.join(timeout=5)
+
+
+def persist(batches: Iterable[List[Dict]], sink: Callable[[List[Dict]], None],
+            report: PipelineReport):
+    """
+    Etapa persist/enqueue: entregar cada lote al destino
+
+    Args:
+        batches: Lotes de contactos procesados
+        sink: Función que guarda o encola un lote
+        report: Resumen a actualizar
+    """
+    for batch in batches:
+        sink(batch)
+        report.persisted += len(batch)
+
+
+# ============= PIPELINES =============
+
+def scan_file(file_path: str, sheet_name: str = 'Contactos') -> PipelineReport:
+    """
+    Recorrer un archivo de contactos sin guardarlo (resumen de importación)
+
+    Args:
+        file_path: Ruta del archivo
+        sheet_name: Hoja a leer
+
+    Returns:
+        Resumen con conteos, variables detectadas y muestra
+    """
+    report = PipelineReport()
+    for _ in dedupe(validate(parse(file_path, sheet_name), report), report):
+        pass
+    logger.info(f"📊 Archivo analizado: {report.valid_rows} válidos, "
+                f"{report.errors.count} inválidos, {report.duplicate_rows} duplicados")
+    return report
+
+
+def run_campaign(file_path: str, campaign_id: str, template: str,
+                 sink: Callable[[List[Dict]], None], sheet_name: str = 'Contactos',
+                 batch_size: int = CAMPAIGN_BATCH_SIZE) -> PipelineReport:
+    """
+    Pipeline completo: archivo → contactos renderizados guardados por lotes
+
+    Args:
+        file_path: Ruta del archivo de contactos
+        campaign_id: ID de la campaña
+        template: Plantilla con {{variables}}
+        sink: Función que guarda o encola cada lote
+        sheet_name: Hoja a leer
+        batch_size: Contactos por lote
+
+    Returns:
+        Resumen de la pasada
+    """
+    report = PipelineReport()
+    contacts = dedupe(validate(parse(file_path, sheet_name), report), report)
+    batches = batched(render(contacts, campaign_id, template, report), batch_size)
+    persist(buffered(batches), sink, report)
+    logger.info(f"✅ Campaña {campaign_id}: {report.persisted} contactos procesados")
+    return report
+
+
+def run_contacts(contacts: Iterable[Mapping], campaign_id: str, template: str,
+                 sink: Callable[[List[Dict]], None],
+                 batch_size: int = CAMPAIGN_BATCH_SIZE) -> PipelineReport:
+    """
+    Pipeline desde contactos ya parseados (render → persist)
+
+    Args:
+        contacts: Contactos con 'numero' y 'variables'
+        campaign_id: ID de la campaña
+        template: Plantilla con {{variables}}
+        sink: Función que guarda o encola cada lote
+        batch_size: Contactos por lote
+
+    Returns:
+        Resumen de la pasada
+    """
+    report = PipelineReport()
+    persist(batched(render(contacts, campaign_id, template, report), batch_size), sink, report)
+    return report
+
+
+# ============= ARCHIVOS SUBIDOS =============
+
+def store_upload(file, filename: str, upload_dir: Optional[str] = None) -> Dict:
+    """
+    Guardar un archivo subido para procesarlo después en streaming
+
+    De paso borra los archivos que superaron UPLOAD_TTL_HOURS.
+
+    Args:
+        file: Objeto con save(path) (FileStorage de Flask)
+        filename: Nombre original (se conserva la extensión)
+        upload_dir: Directorio de destino (por defecto UPLOAD_DIR)
+
+    Returns:
+        Dict con excel_import_id y path
+    """
+    upload_dir = upload_dir or UPLOAD_DIR
+    os.makedirs(upload_dir, exist_ok=True)
+    purge_uploads(upload_dir=upload_dir)
+    import_id = str(uuid.uuid4())
+    path = os.path.join(upload_dir, import_id + os.path.splitext(filename)[1].lower())
+    file.save(path)
+    return {"excel_import_id": import_id, "path": path}
+
+
+def find_upload(import_id: Optional[str], upload_dir: Optional[str] = None) -> Optional[str]:
+    """
+    Ubicar el archivo de una importación
+
+    Args:
+        import_id: ID devuelto por store_upload
+        upload_dir: Directorio de archivos subidos (por defecto UPLOAD_DIR)
+
+    Returns:
+        Ruta del archivo o None
+    """
+    upload_dir = upload_dir or UPLOAD_DIR
+    if not import_id or not _IMPORT_ID_PATTERN.match(import_id) or not os.path.isdir(upload_dir):
+        return None
+
+    for ext in sorted(ExcelLoader.ALLOWED_EXTENSIONS):
+        path = os.path.join(upload_dir, import_id + ext)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def purge_uploads(max_age_hours: float = UPLOAD_TTL_HOURS, upload_dir: Optional[str] = None) -> int:
+    """
+    Borrar los archivos subidos más antiguos que max_age_hours
+
+    Args:
+        max_age_hours: Antigüedad máxima según la fecha de modificación
+        upload_dir: Directorio de archivos subidos (por defecto UPLOAD_DIR)
+
+    Returns:
+        Archivos borrados
+    """
+    upload_dir = upload_dir or UPLOAD_DIR
+    if not os.path.isdir(upload_dir):
+        return 0
+
+    cutoff = time.time() - max_age_hours * 3600
+    removed = 0
+    for entry in os.scandir(upload_dir):
+        # Solo archivos de store_upload (<uuid>.<ext>)
+        import_id, _ = os.path.splitext(entry.name)
+        if not entry.is_file() or not _IMPORT_ID_PATTERN.match(import_id):
+            continue
+        try:
+            if entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+                removed += 1
+        except FileNotFoundError:
+            continue
+
+    if removed:
+        logger.info(f"🧹 Archivos subidos borrados por antigüedad: {removed}")
+    return removed
@@ -4,19 +4,30 @@ Goleador SMS Marketing - Manejo de Campañas Dinámicas
 """
 
 import logging
+import os
+import socket
 import uuid
 import threading
 import time
 from datetime import datetime
-from typing import Dict, List, Optional
+from concurrent.futures import as_completed
+from typing import Dict, Iterable, Iterator, List, Optional
 from dataclasses import dataclass, asdict
 
 from database import Database
 from sms_sender import SMSSender
+from write_behind import WriteBehindError, get_writer
+from config import (CAMPAIGN_LEASE_SECONDS, CAMPAIGN_PROGRESS_INTERVAL, CAMPAIGN_SSE_MAX_SECONDS,
+                    CAMPAIGN_SENDER_PROCESSES)
 from message_processor import MessageProcessor
+from campaign_shards import SenderPool, SharedRateLimiter, ShardResult, ShardTask, send_shard
+import campaign_pipeline
 
 logger = logging.getLogger(__name__)
 
+# Estados en los que una campaña ya no avanza
+FINAL_STATUSES = ("completed", "failed", "unknown")
+
 @dataclass
 class CampaignStatus:
     """Estado de una campaña"""
@@ -39,10 +50,34 @@ class CampaignProcessor:
     Procesador de campañas SMS con sustitución de variables dinámicas
     """
 
-    def __init__(self):
-        """Inicializar procesador"""
-        self.db = Database()
-        self.sms_sender = SMSSender()
+    def __init__(self, db: Optional[Database] = None, sms_sender: Optional[SMSSender] = None,
+                 sender_pool: Optional[SenderPool] = None):
+        """
+        Inicializar procesador
+
+        Args:
+            db: Base de datos de campañas (por defecto la del proyecto)
+            sms_sender: Emisor de SMS (por defecto uno nuevo); si se indica,
+                las campañas se envían con él en un hilo de este proceso
+            sender_pool: Pool de procesos emisores (por defecto uno con
+                CAMPAIGN_SENDER_PROCESSES procesos)
+        """
+        self.db = db or Database()
+        # Lecturas de progreso por el pool de solo lectura
+        self.read_db = Database(self.db.db_path, read_only=True)
+        if sender_pool is None and sms_sender is None and CAMPAIGN_SENDER_PROCESSES > 0:
+            sender_pool = SenderPool(self.db.db_path, CAMPAIGN_SENDER_PROCESSES)
+        self.sender_pool = sender_pool
+        self.sms_sender = sms_sender or SMSSender()
+        # Rate limit del envío en hilo (el mismo turno que usan todos los pools)
+        self.limiter = SharedRateLimiter(self.db.db_path)
+        # Los cambios de estado por contacto se confirman en lotes
+        self.writer = get_writer(self.db.db_path)
+        # Dueño del lease de las campañas que envía este proceso
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        # Campañas con un worker de envío en este proceso (varios hilos del servidor)
+        self.active_campaigns = set()
+        self.active_lock = threading.Lock()
         self.message_processor = MessageProcessor()
         self.campaign_status = {}  # Diccionario de estados en tiempo real
         logger.info("✅ CampaignProcessor inicializado")
@@ -72,15 +107,7 @@ class CampaignProcessor:
                 }
 
             # Insertar en BD
-            query = """
-            INSERT INTO dynamic_campaigns (id, name, excel_import_id, template, created_at, status)
-            VALUES (?, ?, ?, ?, ?, ?)
-            """
-            self.db.execute_query(
-                query,
-                (campaign_id, name, excel_import_id, template, datetime.now().isoformat(), 'draft')
-            )
-            self.db.commit()
+            self.db.save_campaign(campaign_id, name, excel_import_id, template)
 
             # Inicializar estado
             self.campaign_status[campaign_id] = CampaignStatus(
@@ -105,73 +132,108 @@ class CampaignProcessor:
                 "campaign_id": None
             }
 
-    def process_contacts(self, campaign_id: str, contacts: List[Dict], template: str) -> Dict:
+    def register_import(self, excel_import_id: str, path: str, summary: Dict,
+                        filename: Optional[str] = None):
+        """
+        Registrar un archivo de contactos subido
+
+        Args:
+            excel_import_id: ID de la importación
+            path: Ruta del archivo guardado
+            summary: Resumen del pipeline
+            filename: Nombre original del archivo
+        """
+        self.db.save_excel_import(excel_import_id, path, summary, filename)
+        logger.info(f"📥 Importación registrada: {excel_import_id} ({summary.get('valid_rows', 0)} contactos)")
+
+    def process_contacts(self, campaign_id: str, contacts: Iterable[Dict], template: str) -> Dict:
         """
         Procesar contactos y sustituir variables en plantilla
 
         Args:
             campaign_id: ID de la campaña
-            contacts: Lista de contactos con variables
+            contacts: Contactos con variables (cualquier iterable)
             template: Plantilla con {{variables}}
 
         Returns:
-            Dict con contactos procesados
+            Dict con el resumen del procesamiento
         """
-        logger.info(f"⚙️ Procesando {len(contacts)} contactos para campaña {campaign_id}")
+        logger.info(f"⚙️ Procesando contactos para campaña {campaign_id}")
 
         try:
-            processed_contacts = []
-            errors = []
+            busy = self._reprocess_blocked(self._get_campaign(campaign_id))
+            if busy:
+                return {
+                    "success": False,
+                    "error": busy,
+                    "total_contacts": 0,
+                    "errors": [busy]
+                }
 
-            for idx, contact in enumerate(contacts):
-                try:
-                    # Sustituir variables en la plantilla
-                    processed_message = template
-                    variables = contact.get('variables', {})
-
-                    for var_name, var_value in variables.items():
-                        placeholder = f"{{{{{var_name}}}}}"
-                        processed_message = processed_message.replace(placeholder, str(var_value))
-
-                    # Verificar longitud del mensaje
-                    if len(processed_message) > 1000:
-                        errors.append(f"Contacto {idx + 1}: Mensaje muy largo ({len(processed_message)} chars)")
-                        continue
-
-                    processed_contact = {
-                        "id": str(uuid.uuid4()),
-                        "campaign_id": campaign_id,
-                        "numero": contact['numero'],
-                        "nombre": contact.get('nombre', ''),
-                        "variables": variables,
-                        "processed_message": processed_message,
-                        "status": "pending",
-                        "created_at": datetime.now().isoformat()
-                    }
-
-                    processed_contacts.append(processed_contact)
+            self._reset_campaign_contacts(campaign_id)
+            report = campaign_pipeline.run_contacts(
+                contacts, campaign_id, template, self._save_campaign_contacts
+            )
+            return self._processing_result(campaign_id, report)
 
-                except Exception as e:
-                    errors.append(f"Contacto {idx + 1}: Error: {str(e)}")
+        except Exception as e:
+            logger.error(f"❌ Error procesando contactos: {str(e)}")
+            return {
+                "success": False,
+                "error": str(e),
+                "total_contacts": 0,
+                "errors": [str(e)]
+            }
 
-            # Guardar en BD
-            if processed_contacts:
-                self._save_campaign_contacts(processed_contacts)
+    def process_import(self, campaign_id: str, excel_import_id: Optional[str] = None,
+                       template: Optional[str] = None) -> Dict:
+        """
+        Procesar en streaming el archivo de una importación
 
-            self.campaign_status[campaign_id].total = len(processed_contacts)
+        Lee, valida, deduplica, renderiza y guarda por lotes sin cargar
+        el archivo completo en memoria.
 
-            logger.info(f"✅ {len(processed_contacts)} contactos procesados")
+        Args:
+            campaign_id: ID de la campaña
+            excel_import_id: ID devuelto al subir el archivo (por defecto el de la campaña)
+            template: Plantilla con {{variables}} (por defecto la de la campaña)
 
-            return {
-                "success": True,
-                "total_contacts": len(processed_contacts),
-                "errors": errors,
-                "sample_message": processed_contacts[0]['processed_message'] if processed_contacts else "",
-                "contacts": processed_contacts
-            }
+        Returns:
+            Dict con el resumen del procesamiento
+        """
+        logger.info(f"⚙️ Procesando importación {excel_import_id} para campaña {campaign_id}")
+
+        try:
+            campaign = self._get_campaign(campaign_id) or {}
+            busy = self._reprocess_blocked(campaign)
+            if busy:
+                return {
+                    "success": False,
+                    "error": busy,
+                    "total_contacts": 0,
+                    "errors": [busy]
+                }
+
+            excel_import_id = excel_import_id or campaign.get('excel_import_id')
+            template = template or campaign.get('template', '')
+
+            path = self._get_import_path(excel_import_id)
+            if not path:
+                return {
+                    "success": False,
+                    "error": "Excel import no encontrado",
+                    "total_contacts": 0,
+                    "errors": ["Excel import no encontrado"]
+                }
+
+            self._reset_campaign_contacts(campaign_id)
+            report = campaign_pipeline.run_campaign(
+                path, campaign_id, template, self._save_campaign_contacts
+            )
+            return self._processing_result(campaign_id, report)
 
         except Exception as e:
-            logger.error(f"❌ Error procesando contactos: {str(e)}")
+            logger.error(f"❌ Error procesando importación: {str(e)}")
             return {
                 "success": False,
                 "error": str(e),
@@ -179,10 +241,40 @@ class CampaignProcessor:
                 "errors": [str(e)]
             }
 
+    def _processing_result(self, campaign_id: str, report: "campaign_pipeline.PipelineReport") -> Dict:
+        """Actualizar el estado y armar la respuesta de un procesamiento"""
+        if report.missing_variables:
+            logger.warning(f"⚠️ Variables sin valor en algunos contactos: {report.missing_variables}")
+
+        status = self.campaign_status.setdefault(
+            campaign_id, CampaignStatus(campaign_id=campaign_id, status='draft')
+        )
+        status.total = report.persisted
+        status.status = 'ready'
+        self.db.update_campaign_status(campaign_id, 'ready', total=report.persisted)
+
+        logger.info(f"✅ {report.persisted} contactos procesados")
+
+        summary = report.to_dict()
+        return {
+            "success": True,
+            "total_contacts": report.persisted,
+            "errors": summary["errors"],
+            "invalid_rows": summary["invalid_rows"],
+            "duplicate_rows": summary["duplicate_rows"],
+            "missing_variables": summary["missing_variables"],
+            "sample_message": report.sample_message
+        }
+
     def send_campaign(self, campaign_id: str) -> Dict:
         """
         Enviar campaña masiva (inicia en thread separado)
 
+        Los contactos se reparten en shards por hash del número y cada
+        shard se envía en un proceso del pool. Una campaña que ya está en
+        'sending' no se vuelve a iniciar: tras una caída se usa
+        resume_campaign.
+
         Args:
             campaign_id: ID de la campaña
 
@@ -191,126 +283,253 @@ class CampaignProcessor:
         """
         logger.info(f"🚀 Iniciando envío de campaña: {campaign_id}")
 
+        campaign = self._get_campaign(campaign_id)
+        if not campaign:
+            return {
+                "success": False,
+                "error": "Campaña no encontrada"
+            }
+
+        if campaign['status'] == 'sending':
+            return {
+                "success": False,
+                "error": "La campaña ya se está enviando"
+            }
+
+        return self._start_campaign(campaign)
+
+    def _start_campaign(self, campaign: Dict) -> Dict:
+        """
+        Tomar el lease de una campaña y lanzar su worker de envío
+
+        Si la campaña ya tiene checkpoints cada shard continúa desde el suyo.
+
+        Args:
+            campaign: Campaña leída de BD
+
+        Returns:
+            Dict con resultado
+        """
+        campaign_id = campaign['id']
+
+        # Un solo worker por campaña en este proceso
+        with self.active_lock:
+            if campaign_id in self.active_campaigns:
+                return {
+                    "success": False,
+                    "error": "La campaña ya se está enviando"
+                }
+            self.active_campaigns.add(campaign_id)
+
+        started = False
         try:
-            # Verificar campaña existe
-            campaign = self._get_campaign(campaign_id)
-            if not campaign:
+            # Un solo proceso envía cada campaña
+            if not self.db.acquire_campaign_lease(campaign_id, self.owner, CAMPAIGN_LEASE_SECONDS):
                 return {
                     "success": False,
-                    "error": "Campaña no encontrada"
+                    "error": "La campaña se está enviando en otro proceso"
                 }
 
-            # Obtener contactos
-            contacts = self._get_campaign_contacts(campaign_id)
-            if not contacts:
+            # Continuar cada shard desde su checkpoint (búsqueda por índice, sin recorrer lo enviado)
+            checkpoints = self._get_checkpoints(campaign_id)
+            shards = len(checkpoints)
+            tasks = [
+                ShardTask(campaign_id, checkpoint['shard'], shards, campaign['template'],
+                          checkpoint['last_seq'], checkpoint['sent'], checkpoint['failed'], self.owner)
+                for checkpoint in checkpoints
+                if next(self._get_campaign_contacts(campaign_id, checkpoint['last_seq'],
+                                                    checkpoint['shard'], shards), None) is not None
+            ]
+            if not tasks:
+                self.db.release_campaign_lease(campaign_id, self.owner)
                 return {
                     "success": False,
                     "error": "No hay contactos para enviar"
                 }
 
             # Iniciar envío en thread separado
-            status = self.campaign_status[campaign_id]
+            sent = sum(checkpoint['sent'] for checkpoint in checkpoints)
+            failed = sum(checkpoint['failed'] for checkpoint in checkpoints)
+            status = self.campaign_status.setdefault(
+                campaign_id, CampaignStatus(campaign_id=campaign_id, status='ready')
+            )
+            status.total = campaign['total']
+            status.sent = sent
+            status.failed = failed
             status.status = 'sending'
-            status.started_at = datetime.now().isoformat()
+            status.started_at = status.started_at or datetime.now().isoformat()
+            self._update_campaign_status(campaign_id, 'sending')
 
+            results = {
+                checkpoint['shard']: ShardResult(checkpoint['shard'], checkpoint['last_seq'],
+                                                 checkpoint['sent'], checkpoint['failed'])
+                for checkpoint in checkpoints
+            }
             thread = threading.Thread(
                 target=self._send_campaign_worker,
-                args=(campaign_id, contacts, campaign['template']),
+                args=(campaign_id, tasks, results),
                 daemon=True
             )
             thread.start()
+            started = True
 
+            remaining = max(campaign['total'] - sent - failed, 0)
             return {
                 "success": True,
                 "campaign_id": campaign_id,
-                "message": f"Iniciando envío de {len(contacts)} SMS",
+                "message": f"Iniciando envío de {remaining} SMS",
+                "shards": shards,
+                "resumed_from": {checkpoint['shard']: checkpoint['last_seq'] for checkpoint in checkpoints},
                 "job_id": str(uuid.uuid4())
             }
 
         except Exception as e:
             logger.error(f"❌ Error iniciando envío: {str(e)}")
+            self.db.release_campaign_lease(campaign_id, self.owner)
             return {
                 "success": False,
                 "error": str(e)
             }
 
-    def _send_campaign_worker(self, campaign_id: str, contacts: List[Dict], template: str):
+        finally:
+            # Si arrancó, el worker la quita al terminar
+            if not started:
+                with self.active_lock:
+                    self.active_campaigns.discard(campaign_id)
+
+    def resume_campaign(self, campaign_id: str) -> Dict:
+        """
+        Reanudar una campaña interrumpida desde su último checkpoint
+
+        Los contactos ya enviados quedaron confirmados con el checkpoint de
+        su shard y se saltan; solo el envío en curso al caer depende de su
+        clave de idempotencia.
+
+        Args:
+            campaign_id: ID de la campaña
+
+        Returns:
+            Dict con resultado
         """
-        Worker thread para enviar campaña (ejecución en background)
+        campaign = self._get_campaign(campaign_id)
+        if not campaign:
+            return {"success": False, "error": "Campaña no encontrada"}
+
+        if campaign['status'] not in ('sending', 'failed'):
+            return {"success": False, "error": f"La campaña no está interrumpida ({campaign['status']})"}
+
+        logger.info(f"🔁 Reanudando campaña {campaign_id}")
+        return self._start_campaign(campaign)
+
+    def resume_interrupted_campaigns(self) -> Dict:
         """
-        logger.info(f"👷 Worker iniciado para campaña {campaign_id}")
+        Reanudar las campañas que quedaron en 'sending' (caída o redeploy)
 
-        status = self.campaign_status[campaign_id]
-        results = {"sent": 0, "failed": 0}
+        Returns:
+            Dict con las campañas reanudadas y las que siguen en otro proceso
+        """
+        resumed = []
+        skipped = []
+        for campaign in self.db.get_campaigns_by_status('sending'):
+            if campaign['owner'] == self.owner:
+                continue
+            result = self.resume_campaign(campaign['id'])
+            if result.get('success'):
+                resumed.append(campaign['id'])
+            elif result.get('error') == "No hay contactos para enviar":
+                self._finish_campaign(campaign['id'], 'completed')
+            else:
+                skipped.append(campaign['id'])
+
+        if resumed:
+            logger.info(f"🔁 Campañas reanudadas: {resumed}")
+        return {"resumed": resumed, "skipped": skipped}
+
+    def start_resume_thread(self, attempts: int = 3):
+        """
+        Reanudar campañas interrumpidas en segundo plano
 
-        try:
-            for idx, contact in enumerate(contacts):
-                try:
-                    # Obtener mensaje procesado
-                    message = contact.get('processed_message', template)
-
-                    # Enviar SMS
-                    response = self.sms_sender.send_sms(
-                        numbers=[contact['numero']],
-                        content=message,
-                        sender=None
-                    )
-
-                    if response.get('code') == 0:
-                        # Actualizar estado en BD
-                        self._update_contact_status(
-                            contact['id'],
-                            'sent',
-                            datetime.now().isoformat()
-                        )
-                        results['sent'] += 1
-                        status.sent += 1
-                    else:
-                        self._update_contact_status(
-                            contact['id'],
-                            'failed',
-                            error=response.get('error', 'Unknown error')
-                        )
-                        results['failed'] += 1
-                        status.failed += 1
+        Las que aún tienen un lease vigente (el proceso anterior latió hace
+        poco) se reintentan cuando expira.
 
+        Args:
+            attempts: Pasadas máximas
+        """
+        def resume_loop():
+            for attempt in range(attempts):
+                try:
+                    if not self.resume_interrupted_campaigns()['skipped']:
+                        return
                 except Exception as e:
-                    logger.error(f"❌ Error enviando a {contact['numero']}: {str(e)}")
-                    self._update_contact_status(
-                        contact['id'],
-                        'failed',
-                        error=str(e)
-                    )
-                    results['failed'] += 1
-                    status.failed += 1
-
-                # Pequeña pausa para no saturar API
-                time.sleep(0.1)
-
-            # Marcar como completada
-            status.status = 'completed'
-            status.completed_at = datetime.now().isoformat()
-            self._update_campaign_status(campaign_id, 'completed')
+                    logger.error(f"❌ Error reanudando campañas: {str(e)}")
+                time.sleep(CAMPAIGN_LEASE_SECONDS)
 
-            logger.info(f"✅ Campaña {campaign_id} completada: {results['sent']} enviados, {results['failed']} fallidos")
+        threading.Thread(target=resume_loop, name="campaign-resume", daemon=True).start()
+
+    def _send_campaign_worker(self, campaign_id: str, tasks: List[ShardTask],
+                              results: Dict[int, ShardResult]):
+        """
+        Worker thread de una campaña (ejecución en background)
+
+        Reparte los shards en el pool de emisores (o los envía en este hilo
+        si no hay pool) y agrega sus resultados a medida que terminan.
+
+        Args:
+            campaign_id: ID de la campaña
+            tasks: Shards con contactos pendientes
+            results: Resultado de cada shard según su checkpoint
+        """
+        logger.info(f"👷 Worker iniciado para campaña {campaign_id} ({len(tasks)} shards)")
+
+        status = self.campaign_status[campaign_id]
+        failed_shards = []
+
+        try:
+            if self.sender_pool:
+                futures = [self.sender_pool.submit(task) for task in tasks]
+                finished = (future.result() for future in as_completed(futures))
+            else:
+                finished = (send_shard(task, self.db, self.sms_sender, self.limiter)
+                            for task in tasks)
+
+            for result in finished:
+                results[result.shard] = result
+                status.sent = sum(r.sent for r in results.values())
+                status.failed = sum(r.failed for r in results.values())
+                if result.error:
+                    failed_shards.append(result.shard)
+                    status.errors.append(f"Shard {result.shard}: {result.error}")
+                logger.info(f"📦 Shard {result.shard} de {campaign_id} terminado "
+                            f"(hasta seq {result.last_seq})")
+
+            self._finish_campaign(campaign_id, 'failed' if failed_shards else 'completed')
+
+            logger.info(f"✅ Campaña {campaign_id} terminada: {status.sent} enviados, {status.failed} fallidos")
 
         except Exception as e:
             logger.error(f"❌ Error en worker: {str(e)}")
-            status.status = 'failed'
             status.errors.append(str(e))
-            self._update_campaign_status(campaign_id, 'failed')
+            self._finish_campaign(campaign_id, 'failed')
+
+        finally:
+            with self.active_lock:
+                self.active_campaigns.discard(campaign_id)
 
     def get_progress(self, campaign_id: str) -> Dict:
         """
         Obtener progreso de una campaña
 
+        Se lee de la base (checkpoints que los emisores escriben en lotes),
+        así que es el mismo en cualquier worker del servidor.
+
         Args:
             campaign_id: ID de la campaña
 
         Returns:
             Dict con estado actual
         """
-        if campaign_id not in self.campaign_status:
+        progress = self.read_db.get_campaign_progress(campaign_id)
+        if not progress:
             return {
                 "status": "unknown",
                 "sent": 0,
@@ -319,56 +538,146 @@ class CampaignProcessor:
                 "percentage": 0
             }
 
-        status = self.campaign_status[campaign_id]
-        total = status.total or 1  # Evitar división por cero
-        percentage = int((status.sent + status.failed) / total * 100)
+        total = progress['total'] or 1  # Evitar división por cero
+        local = self.campaign_status.get(campaign_id)
 
         return {
             "campaign_id": campaign_id,
-            "status": status.status,
-            "sent": status.sent,
-            "failed": status.failed,
-            "total": status.total,
-            "percentage": percentage,
-            "started_at": status.started_at,
-            "completed_at": status.completed_at,
-            "errors": status.errors
+            "status": progress['status'],
+            "sent": progress['sent'],
+            "failed": progress['failed'],
+            "total": progress['total'],
+            "percentage": min(int((progress['sent'] + progress['failed']) / total * 100), 100),
+            "started_at": progress['started_at'],
+            "completed_at": progress['completed_at'],
+            "errors": local.errors if local else []
         }
 
+    def watch_progress(self, campaign_id: str, interval: float = CAMPAIGN_PROGRESS_INTERVAL,
+                       max_seconds: float = CAMPAIGN_SSE_MAX_SECONDS) -> Iterator[Dict]:
+        """
+        Seguir el progreso de una campaña (para el stream SSE)
+
+        Lee el progreso cada interval segundos y entrega solo los campos
+        que cambiaron; el primer elemento es el estado completo. Termina
+        cuando la campaña acaba o se cumple max_seconds.
+
+        Args:
+            campaign_id: ID de la campaña
+            interval: Segundos entre lecturas
+            max_seconds: Duración máxima del seguimiento
+
+        Returns:
+            Iterador de cambios (dict vacío si no hubo cambios en esa lectura)
+        """
+        last: Dict = {}
+        deadline = time.monotonic() + max_seconds
+
+        while True:
+            progress = self.get_progress(campaign_id)
+            yield {key: value for key, value in progress.items()
+                   if key not in last or last[key] != value}
+            last = progress
+
+            if progress['status'] in FINAL_STATUSES or time.monotonic() >= deadline:
+                return
+            time.sleep(interval)
+
     # ============= MÉTODOS PRIVADOS =============
 
-    def _verify_excel_import(self, excel_import_id: str) -> bool:
-        """Verificar que una importación de Excel existe"""
-        # Por ahora, siempre retornar True (implementar BD después)
-        return True
+    def _verify_excel_import(self, excel_import_id: Optional[str]) -> bool:
+        """Verificar que una importación de Excel existe (None: contactos enviados por API)"""
+        return excel_import_id is None or self._get_import_path(excel_import_id) is not None
+
+    def _get_import_path(self, excel_import_id: Optional[str]) -> Optional[str]:
+        """Ruta del archivo de una importación"""
+        if not excel_import_id:
+            return None
+        record = self.db.get_excel_import(excel_import_id)
+        if record and os.path.exists(record['path']):
+            return record['path']
+        return campaign_pipeline.find_upload(excel_import_id)
 
     def _get_campaign(self, campaign_id: str) -> Optional[Dict]:
         """Obtener campaña de BD"""
-        # Por ahora, retornar campaign template
-        return {
-            "id": campaign_id,
-            "template": "Hola {{nombre}}, tienes {{descuento}}% de descuento"
-        }
-
-    def _get_campaign_contacts(self, campaign_id: str) -> List[Dict]:
-        """Obtener contactos de una campaña"""
-        # Por ahora, retornar lista vacía (implementar BD después)
-        return []
+        return self.db.get_campaign(campaign_id)
+
+    def _get_campaign_contacts(self, campaign_id: str, after_seq: int = 0,
+                               shard: Optional[int] = None, shards: int = 1) -> Iterator[Dict]:
+        """Recorrer los contactos de una campaña (o de un shard) desde un cursor (por páginas)"""
+        return self.db.iter_campaign_contacts(campaign_id, status=None, after_seq=after_seq,
+                                              shard=shard, shards=shards)
+
+    def _reprocess_blocked(self, campaign: Optional[Dict]) -> Optional[str]:
+        """Motivo por el que no se pueden reemplazar los contactos (None si se puede)"""
+        if not campaign:
+            return None
+        if campaign['status'] == 'sending':
+            return "La campaña se está enviando; no se puede reprocesar"
+        if campaign.get('owner') and campaign['owner'] != self.owner:
+            return "La campaña está tomada por otro proceso"
+        return None
+
+    def _reset_campaign_contacts(self, campaign_id: str):
+        """Borrar contactos y cursor antes de (re)procesar una campaña"""
+        with self.db.transaction():
+            self.db.delete_campaign_contacts(campaign_id)
+            self.db.delete_campaign_checkpoints(campaign_id)
 
     def _save_campaign_contacts(self, contacts: List[Dict]):
-        """Guardar contactos en BD"""
-        logger.info(f"💾 Guardando {len(contacts)} contactos en BD")
-        # Implementar guardado en BD
+        """Guardar un lote de contactos en BD"""
+        logger.debug(f"💾 Guardando {len(contacts)} contactos en BD")
+        self.db.save_campaign_contacts_bulk(contacts)
 
     def _update_contact_status(self, contact_id: str, status: str, sent_at: Optional[str] = None, error: Optional[str] = None):
-        """Actualizar estado de un contacto"""
-        logger.info(f"📝 Actualizando contacto {contact_id}: {status}")
-        # Implementar actualización en BD
+        """Actualizar estado de un contacto (se confirma en lote)"""
+        self.writer.update_campaign_contact(contact_id, status, sent_at, error)
+
+    def _get_checkpoints(self, campaign_id: str) -> List[Dict]:
+        """
+        Cursor de envío de cada shard de una campaña
+
+        En el primer envío se guarda uno en cero por shard: el número de
+        shards queda fijo para la campaña aunque cambie el tamaño del pool.
+        """
+        checkpoints = self.db.get_campaign_checkpoints(campaign_id)
+        if checkpoints:
+            return checkpoints
+
+        shards = self.sender_pool.processes if self.sender_pool else 1
+        checkpoints = [
+            {"campaign_id": campaign_id, "shard": shard, "last_seq": 0, "sent": 0, "failed": 0}
+            for shard in range(shards)
+        ]
+        self.db.save_campaign_checkpoints_bulk(checkpoints)
+        return checkpoints
+
+    def _finish_campaign(self, campaign_id: str, final_status: str):
+        """Confirmar estados pendientes, cerrar la campaña y liberar el lease"""
+        # Lo encolado debe quedar escrito antes del estado final; los envíos
+        # de los shards ya se confirmaron con sus checkpoints
+        try:
+            self.writer.flush()
+        except WriteBehindError as e:
+            logger.error(f"❌ {str(e)}")
+            status = self.campaign_status.get(campaign_id)
+            if status:
+                status.errors.append(str(e))
+
+        with self.db.transaction():
+            self._update_campaign_status(campaign_id, final_status)
+            self.db.release_campaign_lease(campaign_id, self.owner)
+
+        # El estado en memoria cambia solo cuando la BD ya lo refleja
+        status = self.campaign_status.get(campaign_id)
+        if status:
+            status.status = final_status
+            status.completed_at = datetime.now().isoformat()
 
     def _update_campaign_status(self, campaign_id: str, status: str):
         """Actualizar estado de campaña en BD"""
         logger.info(f"📝 Actualizando campaña {campaign_id}: {status}")
-        # Implementar actualización en BD
+        self.db.update_campaign_status(campaign_id, status)
 
 
 # Instancia global
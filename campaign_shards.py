@@ -0,0 +1,319 @@
+"""
+CAMPAIGN SHARDS - Envío de campañas en procesos emisores
+Los contactos se reparten por hash del número (shard_key % shards), así
+los mensajes a un mismo destinatario salen en orden y en un solo shard;
+cada shard envía y confirma sus lotes por su cuenta bajo un rate limit
+compartido entre todos los procesos, y el proceso web solo agrega los
+resultados
+"""
+
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from datetime import datetime
+from itertools import groupby
+from typing import Callable, Dict, List, Optional
+
+from config import (CAMPAIGN_RATE_BLOCK, CAMPAIGN_RATE_LIMIT, CAMPAIGN_SENDER_PROCESSES,
+                    CAMPAIGN_SEND_WINDOW, SMS_LIMIT_POST)
+from database import Database
+from idempotency import DUPLICATE_IN_PROGRESS_CODE
+from sms_sender import SMSSender
+
+logger = logging.getLogger(__name__)
+
+
+class SharedRateLimiter:
+    """Límite de SMS por segundo compartido por todos los procesos (turnos en la BD de campañas)"""
+
+    def __init__(self, db_path: str, rate: float = CAMPAIGN_RATE_LIMIT, name: str = "campaigns",
+                 block: int = CAMPAIGN_RATE_BLOCK):
+        """
+        Inicializar limitador
+
+        Args:
+            db_path: Base de datos donde se reservan los turnos
+            rate: SMS por segundo (0 o menos: sin límite)
+            name: Límite compartido (los que usan el mismo nombre se reparten el rate)
+            block: Turnos que se reservan por cada escritura en la BD
+        """
+        self.db_path = db_path
+        self.name = name
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.block = max(block, 1)
+        self._db: Optional[Database] = None
+        # Turnos ya reservados y aún sin usar: [_next_slot, _end_slot)
+        self._next_slot = 0.0
+        self._end_slot = 0.0
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # Cada proceso abre sus propias conexiones y reserva sus bloques
+        state = dict(self.__dict__)
+        state.update(_db=None, _next_slot=0.0, _end_slot=0.0, _lock=None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def acquire(self, count: int = 1):
+        """
+        Esperar el turno de los siguientes SMS
+
+        Args:
+            count: SMS que salen juntos (un lote al gateway ocupa un turno por número)
+        """
+        if not self.interval:
+            return
+
+        with self._lock:
+            now = time.time()
+            # Los turnos del bloque que ya pasaron no se recuperan
+            self._next_slot = max(self._next_slot, now)
+            if self._end_slot - self._next_slot < count * self.interval - 1e-9:
+                if self._db is None:
+                    self._db = Database(self.db_path)
+                slots = max(count, self.block)
+                self._next_slot = self._db.reserve_rate_slot(self.name, self.interval, now, slots)
+                self._end_slot = self._next_slot + slots * self.interval
+            slot = self._next_slot
+            self._next_slot += count * self.interval
+
+        if slot > now:
+            time.sleep(slot - now)
+
+
+@dataclass
+class ShardTask:
+    """Trabajo de un shard: su parte de la campaña desde su checkpoint"""
+    campaign_id: str
+    shard: int
+    shards: int
+    template: str
+    last_seq: int = 0
+    sent: int = 0
+    failed: int = 0
+    owner: Optional[str] = None
+
+
+@dataclass
+class ShardResult:
+    """Resultado de un shard (contadores acumulados, incluido lo previo al checkpoint)"""
+    shard: int
+    last_seq: int = 0
+    sent: int = 0
+    failed: int = 0
+    error: Optional[str] = None
+
+
+def send_shard(task: ShardTask, db: Database, sms_sender: SMSSender,
+               limiter: SharedRateLimiter) -> ShardResult:
+    """
+    Enviar los contactos pendientes de un shard
+
+    Los contactos se recorren en ventanas de CAMPAIGN_SEND_WINDOW seqs; en
+    cada ventana los que tienen el mismo mensaje salen en un solo envío al
+    gateway (hasta SMS_LIMIT_POST números), con su clave de idempotencia y
+    sus turnos del rate limit reservados de una vez.
+
+    El estado de cada lote se confirma en la BD junto con el cursor del
+    shard antes de enviar el siguiente, así una reanudación (aunque sea horas
+    después) salta lo ya aceptado sin depender de las claves de
+    idempotencia, que vencen. Si el gateway tiene en curso el mismo lote
+    (otro proceso o un intento anterior) el shard se detiene sin marcarlo,
+    y se reintenta al reanudar.
+
+    Args:
+        task: Shard a enviar
+        db: Base de datos de la campaña
+        sms_sender: Emisor de SMS
+        limiter: Rate limit compartido
+
+    Returns:
+        Resultado del shard
+    """
+    result = ShardResult(shard=task.shard, last_seq=task.last_seq, sent=task.sent, failed=task.failed)
+
+    def record(updates: List[Dict]):
+        db.record_campaign_results(updates, {
+            "campaign_id": task.campaign_id, "shard": task.shard, "last_seq": result.last_seq,
+            "sent": result.sent, "failed": result.failed, "owner": task.owner
+        })
+
+    contacts = db.iter_campaign_contacts(task.campaign_id, status=None, after_seq=task.last_seq,
+                                         shard=task.shard, shards=task.shards)
+    try:
+        # Ventanas fijas por seq: al reanudar, un lote a medias se arma igual (misma clave)
+        for _, window in groupby(contacts, key=lambda contact: (contact['seq'] - 1) // CAMPAIGN_SEND_WINDOW):
+            _send_window(list(window), task, result, sms_sender, limiter, record)
+
+    except Exception as e:
+        logger.error(f"❌ Error en shard {task.shard} de {task.campaign_id}: {str(e)}")
+        result.error = str(e)
+
+    # Cursor final (incluye los contactos ya resueltos que se saltaron)
+    record([])
+    return result
+
+
+def _send_window(window: List[Dict], task: ShardTask, result: ShardResult, sms_sender: SMSSender,
+                 limiter: SharedRateLimiter, record: Callable[[List[Dict]], None]):
+    """
+    Enviar una ventana de contactos agrupando los mensajes idénticos
+
+    El cursor del resultado avanza solo sobre el prefijo ya resuelto de la
+    ventana, así sent y failed cuentan exactamente los contactos hasta
+    last_seq.
+
+    Args:
+        window: Contactos de la ventana, ordenados por seq
+        task: Shard a enviar
+        result: Resultado del shard (se actualiza)
+        sms_sender: Emisor de SMS
+        limiter: Rate limit compartido
+        record: Confirma estados y cursor en una transacción
+    """
+    # Los ya resueltos antes de la caída (posteriores al último checkpoint) no se reenvían
+    outcomes = {contact['id']: contact['status'] for contact in window if contact['status'] != 'pending'}
+    position = 0
+
+    def advance():
+        nonlocal position
+        while position < len(window) and window[position]['id'] in outcomes:
+            if outcomes[window[position]['id']] == 'sent':
+                result.sent += 1
+            else:
+                result.failed += 1
+            result.last_seq = window[position]['seq']
+            position += 1
+
+    groups: Dict[str, List[Dict]] = {}
+    for contact in window:
+        if contact['id'] not in outcomes:
+            groups.setdefault(contact.get('processed_message') or task.template, []).append(contact)
+
+    for content, group in groups.items():
+        for start in range(0, len(group), SMS_LIMIT_POST):
+            batch = group[start:start + SMS_LIMIT_POST]
+            limiter.acquire(len(batch))
+            try:
+                # La clave evita reenviar el lote si el proceso cae durante el envío
+                response = sms_sender.send_sms(
+                    numbers=[contact['numero'] for contact in batch],
+                    content=content,
+                    sender=None,
+                    idempotency_key=f"campaign:{task.campaign_id}:{batch[0]['id']}:{len(batch)}"
+                )
+            except Exception as e:
+                logger.error(f"❌ Error enviando lote de {len(batch)} desde {batch[0]['numero']}: {str(e)}")
+                response = {"code": -1, "error": str(e)}
+
+            if response.get('code') == DUPLICATE_IN_PROGRESS_CODE:
+                advance()
+                raise RuntimeError(f"Envío en curso para el lote desde {batch[0]['id']}; se reintenta al reanudar")
+
+            if response.get('code') == 0:
+                sent_at = datetime.now().isoformat()
+                updates = [{"id": contact['id'], "status": 'sent', "sent_at": sent_at} for contact in batch]
+            else:
+                error = response.get('error') or response.get('error_message') or 'Unknown error'
+                updates = [{"id": contact['id'], "status": 'failed', "error": error} for contact in batch]
+
+            outcomes.update((update['id'], update['status']) for update in updates)
+            advance()
+            record(updates)
+
+    advance()
+
+
+# Estado de cada proceso emisor (lo arma _init_sender_process)
+_process_state: Dict = {}
+
+
+def _init_sender_process(db_path: str, limiter: SharedRateLimiter,
+                         sender_factory: Callable[[], SMSSender]):
+    """Preparar un proceso emisor: conexiones y emisor propios"""
+    _process_state.update(
+        db=Database(db_path),
+        sms_sender=sender_factory(),
+        limiter=limiter
+    )
+
+
+def _run_shard(task: ShardTask) -> ShardResult:
+    """Ejecutar un shard en el proceso emisor"""
+    return send_shard(task, **_process_state)
+
+
+class SenderPool:
+    """
+    Pool de procesos emisores de campañas
+
+    Los procesos se crean con spawn (no heredan conexiones ni hilos del
+    worker web) y al primer envío, no al importar.
+    """
+
+    def __init__(self, db_path: str, processes: int = CAMPAIGN_SENDER_PROCESSES,
+                 rate_limit: float = CAMPAIGN_RATE_LIMIT,
+                 sender_factory: Callable[[], SMSSender] = SMSSender):
+        """
+        Inicializar pool
+
+        Args:
+            db_path: Ruta de la base de datos de campañas
+            processes: Procesos emisores (también el número de shards por campaña)
+            rate_limit: SMS por segundo (compartido con los demás pools y workers)
+            sender_factory: Crea el emisor de cada proceso (función de módulo, se serializa)
+        """
+        self.db_path = db_path
+        self.processes = processes
+        self.sender_factory = sender_factory
+        self.context = multiprocessing.get_context("spawn")
+        self.limiter = SharedRateLimiter(db_path, rate_limit)
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self.lock = threading.Lock()
+
+    def submit(self, task: ShardTask) -> Future:
+        """
+        Encolar un shard en el pool
+
+        Si un proceso emisor murió (pool roto) el pool se recrea.
+
+        Args:
+            task: Shard a enviar
+
+        Returns:
+            Future con el ShardResult
+        """
+        with self.lock:
+            try:
+                return self._get_executor().submit(_run_shard, task)
+            except BrokenProcessPool:
+                logger.warning("⚠️ Pool de emisores roto, recreándolo")
+                self.executor.shutdown(wait=False)
+                self.executor = None
+                return self._get_executor().submit(_run_shard, task)
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """Executor del pool (se crea al primer envío)"""
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.processes,
+                mp_context=self.context,
+                initializer=_init_sender_process,
+                initargs=(self.db_path, self.limiter, self.sender_factory)
+            )
+            logger.info(f"🧵 Pool de emisores iniciado: {self.processes} procesos")
+        return self.executor
+
+    def shutdown(self, wait: bool = True):
+        """Detener los procesos emisores"""
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=wait)
+                self.executor = None
@@ -17,6 +17,8 @@ TRAFFILINK_PASSWORD = os.getenv("TRAFFILINK_PASSWORD", "G2o0jRnm")
 # Límites de envío según método
 SMS_LIMIT_GET = 100
 SMS_LIMIT_POST = 10000
+# Números recientes que send_stream recuerda para deduplicar (0 = todos)
+SEND_DEDUPE_WINDOW = 100000
 
 # Límites de reportes y SMS entrantes
 REPORT_BATCH_LIMIT = 200
@@ -25,6 +27,98 @@ INCOMING_SMS_LIMIT = 50
 # Máxima longitud de mensaje
 MAX_MESSAGE_LENGTH = 1024
 
+# ==================== BASE DE DATOS ====================
+# Motor de almacenamiento: "sqlite" (traffilink.db), "tiered" (SQLite con los SMS
+# recientes en memoria) o "memory" (sin disco, para benchmarks). Solo lo usa
+# el pipeline de envío (SMSSender); reportes, analytics, tareas, campañas y
+# retención consultan SQLite directamente (agregados SQL, tablas propias),
+# así que con "memory" no ven lo enviado
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sqlite").lower()
+# SMS recientes que el motor "tiered" conserva en memoria
+HOT_TIER_MAX_SMS = int(os.getenv("HOT_TIER_MAX_SMS", "50000"))
+# Segundos desde el envío durante los que un SMS se considera reciente
+HOT_TIER_MAX_AGE_SECONDS = int(os.getenv("HOT_TIER_MAX_AGE_SECONDS", "3600"))
+# Milisegundos que una conexión espera un bloqueo antes de fallar
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+# Filas por executemany en las operaciones masivas
+DB_BULK_CHUNK_SIZE = int(os.getenv("DB_BULK_CHUNK_SIZE", "1000"))
+# Medir cada sentencia SQL y agruparla por huella (solo para diagnóstico)
+DB_PROFILE = os.getenv("DB_PROFILE", "false").lower() in ("1", "true", "yes")
+# Milisegundos a partir de los cuales una sentencia es lenta y se captura su plan
+DB_SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "100"))
+# Archivo donde se guarda el perfil al terminar el proceso (vacío = no guardar)
+DB_PROFILE_DUMP = os.getenv("DB_PROFILE_DUMP", "")
+
+# ==================== IDEMPOTENCIA ====================
+# Segundos que se conserva el resultado de un envío para responder reintentos
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", "600"))
+# Segundos que una clave queda reservada mientras su envío está en curso
+IDEMPOTENCY_PENDING_TTL = int(os.getenv("IDEMPOTENCY_PENDING_TTL", "120"))
+
+# ==================== ESCRITURA DIFERIDA ====================
+# Filas por commit agrupado del escritor en segundo plano
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "500"))
+# Milisegundos máximos que una fila espera antes de confirmarse
+WRITE_BEHIND_FLUSH_MS = int(os.getenv("WRITE_BEHIND_FLUSH_MS", "200"))
+# Filas pendientes máximas antes de aplicar contrapresión
+WRITE_BEHIND_MAX_PENDING = int(os.getenv("WRITE_BEHIND_MAX_PENDING", "50000"))
+# Reintentos de un commit agrupado con la base ocupada, y espera antes del
+# primero (ms, se duplica en cada uno); después se escribe fila por fila
+WRITE_BEHIND_RETRIES = int(os.getenv("WRITE_BEHIND_RETRIES", "3"))
+WRITE_BEHIND_RETRY_MS = int(os.getenv("WRITE_BEHIND_RETRY_MS", "50"))
+
+# ==================== RETENCIÓN ====================
+# Días de historial que se conservan en la base principal
+RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", "30"))
+# Filas borradas por transacción al aplicar la retención
+RETENTION_CHUNK_SIZE = int(os.getenv("RETENTION_CHUNK_SIZE", "500"))
+# Pausa entre bloques para dejar pasar a los escritores
+RETENTION_PAUSE_MS = int(os.getenv("RETENTION_PAUSE_MS", "10"))
+# Directorio de los archivos mensuales de historial (sms_AAAA_MM.db)
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+
+# ==================== CAMPAÑAS ====================
+# Directorio donde se guardan los archivos de contactos subidos
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
+# Tamaño máximo del archivo de contactos (MB); también es el límite de cada
+# request del servidor. El archivo se guarda en disco y se lee en streaming,
+# así que no ocupa memoria: 200 MB son unos 5 millones de filas en CSV
+UPLOAD_MAX_MB = int(os.getenv("UPLOAD_MAX_MB", "200"))
+# Horas que se conserva un archivo subido (los contactos ya quedaron en la
+# BD al procesarlo; el archivo solo sirve para reprocesar con otra plantilla)
+UPLOAD_TTL_HOURS = float(os.getenv("UPLOAD_TTL_HOURS", "24"))
+# Contactos por lote entre las etapas del pipeline de campañas
+CAMPAIGN_BATCH_SIZE = int(os.getenv("CAMPAIGN_BATCH_SIZE", "1000"))
+# Lotes en vuelo entre la lectura del archivo y la escritura
+CAMPAIGN_BUFFER_BATCHES = int(os.getenv("CAMPAIGN_BUFFER_BATCHES", "4"))
+# Errores por fila que se conservan en el resumen (el resto solo se cuenta)
+CAMPAIGN_MAX_REPORTED_ERRORS = int(os.getenv("CAMPAIGN_MAX_REPORTED_ERRORS", "100"))
+# Segundos sin checkpoint tras los que otro proceso puede retomar la campaña
+CAMPAIGN_LEASE_SECONDS = int(os.getenv("CAMPAIGN_LEASE_SECONDS", "60"))
+# Reanudar al arrancar las campañas que quedaron en 'sending'
+CAMPAIGN_RESUME_ON_STARTUP = os.getenv("CAMPAIGN_RESUME_ON_STARTUP", "true").lower() in ("1", "true", "yes")
+# Segundos entre lecturas de progreso de cada stream SSE
+CAMPAIGN_PROGRESS_INTERVAL = float(os.getenv("CAMPAIGN_PROGRESS_INTERVAL", "1"))
+# Duración máxima de un stream SSE (el navegador se reconecta solo)
+CAMPAIGN_SSE_MAX_SECONDS = int(os.getenv("CAMPAIGN_SSE_MAX_SECONDS", "55"))
+# Procesos emisores por worker del servidor; cada campaña se reparte en
+# ese número de shards por hash del número (0: envío en un hilo del worker)
+CAMPAIGN_SENDER_PROCESSES = int(os.getenv("CAMPAIGN_SENDER_PROCESSES", "2"))
+# SMS por segundo entre todos los shards de un pool de emisores
+CAMPAIGN_RATE_LIMIT = float(os.getenv("CAMPAIGN_RATE_LIMIT", "10"))
+# Turnos del rate limit que cada emisor reserva por escritura en la BD
+CAMPAIGN_RATE_BLOCK = int(os.getenv("CAMPAIGN_RATE_BLOCK", "50"))
+# Contactos (por seq) entre los que un shard agrupa los mensajes idénticos
+# en un solo envío al gateway (hasta SMS_LIMIT_POST números por envío)
+CAMPAIGN_SEND_WINDOW = int(os.getenv("CAMPAIGN_SEND_WINDOW", "1000"))
+
+# ==================== REPORTES ====================
+# Filas de detalle por página en los reportes de SMS y de entrega (los
+# totales se calculan en SQLite sobre toda la ventana; 0 = solo totales)
+REPORT_DETAILS_LIMIT = int(os.getenv("REPORT_DETAILS_LIMIT", "100"))
+# Máximo de filas de detalle que se pueden pedir en una página
+REPORT_DETAILS_MAX = int(os.getenv("REPORT_DETAILS_MAX", "1000"))
+
 # ==================== ENCODING ====================
 ENCODING = "utf-8"
 CONTENT_TYPE = "application/json;charset=utf-8"
@@ -2,12 +2,29 @@
 Capa de persistencia usando SQLite
 Almacena SMS, reportes, transacciones y metadatos
 """
+import re
+import base64
 import sqlite3
+import sys
 import logging
 import json
-from datetime import datetime
-from typing import List, Optional, Dict, Any
+import time
+import threading
+import zlib
+from contextlib import contextmanager
+from hashlib import sha256
+from datetime import datetime, timedelta
+from itertools import islice
+from typing import List, Optional, Dict, Any, Tuple, Union, Callable, Iterable, Iterator, Type
 from pathlib import Path
+from query_profiler import profiler
+from models import Record, TransactionRecord
+from config import (
+    DB_BUSY_TIMEOUT_MS,
+    DB_BULK_CHUNK_SIZE,
+    RETENTION_CHUNK_SIZE,
+    RETENTION_PAUSE_MS
+)
 
 logger = logging.getLogger(__name__)
 
@@ -15,38 +32,736 @@ logger = logging.getLogger(__name__)
 DB_PATH = Path("traffilink.db")
 
 
+class ConnectionPool:
+    """Pool de conexiones SQLite: una conexión por hilo y archivo"""
+
+    def __init__(self, db_path: str, busy_timeout_ms: int = DB_BUSY_TIMEOUT_MS,
+                 read_only: bool = False):
+        """
+        Inicializar pool
+
+        Args:
+            db_path: Ruta del archivo de base de datos
+            busy_timeout_ms: Espera máxima ante un bloqueo
+            read_only: Abrir las conexiones en modo solo lectura (mode=ro)
+        """
+        self.db_path = db_path
+        self.busy_timeout_ms = busy_timeout_ms
+        self.read_only = read_only
+        # La conexión de un hilo se libera junto con el hilo
+        self.local = threading.local()
+
+    def get(self) -> sqlite3.Connection:
+        """Obtener la conexión del hilo actual (la abre si no existe)"""
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = self._open()
+            self.local.connection = connection
+        return connection
+
+    def _open(self) -> sqlite3.Connection:
+        """Abrir y configurar una conexión nueva"""
+        if self.read_only:
+            return self._open_read_only()
+
+        connection = sqlite3.connect(self.db_path, timeout=self.busy_timeout_ms / 1000)
+        connection.row_factory = sqlite3.Row
+        # Solo tiene efecto en archivos nuevos; permite PRAGMA incremental_vacuum
+        connection.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        # WAL permite lectores concurrentes con un escritor; NORMAL evita un
+        # fsync por commit (en WAL sigue siendo seguro ante caídas del proceso)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        logger.debug(f"🔌 Conexión abierta ({threading.current_thread().name}): {self.db_path}")
+        return connection
+
+    def _open_read_only(self) -> sqlite3.Connection:
+        """Abrir una conexión de solo lectura sobre la base ya en modo WAL"""
+        uri = f"{Path(self.db_path).resolve().as_uri()}?mode=ro"
+        connection = sqlite3.connect(uri, uri=True, timeout=self.busy_timeout_ms / 1000)
+        connection.row_factory = sqlite3.Row
+        # En WAL cada lectura ve una instantánea y nunca bloquea al escritor
+        connection.execute("PRAGMA query_only=1")
+        connection.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        logger.debug(f"🔌 Conexión de lectura abierta ({threading.current_thread().name}): {self.db_path}")
+        return connection
+
+    def close(self):
+        """Cerrar la conexión del hilo actual"""
+        connection = getattr(self.local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self.local.connection = None
+
+
+def number_to_int(number: Any) -> Optional[int]:
+    """
+    Convertir un número telefónico a INTEGER para sms_recipients
+
+    Args:
+        number: Número con o sin formato
+
+    Returns:
+        Dígitos como int, o None si no contiene dígitos
+    """
+    digits = re.sub(r"\D", "", str(number))
+    return int(digits) if digits else None
+
+
+def body_hash(content: str) -> str:
+    """
+    Calcular la clave de un cuerpo de mensaje en message_bodies
+
+    Args:
+        content: Texto del mensaje
+
+    Returns:
+        SHA-256 hexadecimal del texto
+    """
+    return sha256(content.encode("utf-8")).hexdigest()
+
+
+def number_shard_key(number: Any) -> int:
+    """
+    Calcular la clave de reparto de un número entre shards de envío
+
+    Args:
+        number: Número con o sin formato
+
+    Returns:
+        CRC32 de los dígitos (el mismo número siempre cae en el mismo shard)
+    """
+    return zlib.crc32(re.sub(r"\D", "", str(number)).encode("utf-8"))
+
+
+def chunked(items: Iterable, size: int) -> Iterator[List]:
+    """
+    Partir un iterable en listas de tamaño fijo sin materializarlo
+
+    Args:
+        items: Filas a partir (puede ser un generador)
+        size: Filas por bloque
+
+    Returns:
+        Iterador de bloques (el último puede ser menor)
+    """
+    iterator = iter(items)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def encode_cursor(*values: Any) -> str:
+    """
+    Codificar la clave de la última fila de una página como cursor opaco
+
+    Args:
+        values: Columnas de la clave de ordenamiento
+
+    Returns:
+        Cursor en base64 apto para URLs
+    """
+    raw = json.dumps(list(values), separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, size: int) -> List[Any]:
+    """
+    Decodificar un cursor generado por encode_cursor
+
+    Args:
+        cursor: Cursor opaco
+        size: Cantidad de columnas esperadas
+
+    Returns:
+        Valores de la clave
+
+    Raises:
+        ValueError: Si el cursor no es válido
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Cursor inválido: {cursor}") from e
+
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError(f"Cursor inválido: {cursor}")
+    return values
+
+
+def _backfill_recipients(connection: sqlite3.Connection, chunk_size: int = 1000):
+    """Poblar sms_recipients y recipient_count a partir de sms.numbers"""
+    last_rowid = 0
+    while True:
+        rows = connection.execute(
+            "SELECT rowid, id, numbers FROM sms WHERE rowid > ? ORDER BY rowid LIMIT ?",
+            (last_rowid, chunk_size)
+        ).fetchall()
+        if not rows:
+            break
+
+        for rowid, sms_id, numbers in rows:
+            parsed = [n for n in map(number_to_int, (numbers or "").split(",")) if n is not None]
+            connection.executemany(
+                "INSERT OR IGNORE INTO sms_recipients (sms_id, number) VALUES (?, ?)",
+                ((sms_id, n) for n in parsed)
+            )
+            connection.execute(
+                "UPDATE sms SET recipient_count = ? WHERE rowid = ?",
+                (len(parsed), rowid)
+            )
+        last_rowid = rows[-1][0]
+
+
+def _backfill_shard_keys(connection: sqlite3.Connection, chunk_size: int = 1000):
+    """Calcular campaign_contacts.shard_key de los contactos existentes"""
+    last_rowid = 0
+    while True:
+        rows = connection.execute(
+            "SELECT rowid, numero FROM campaign_contacts WHERE rowid > ? ORDER BY rowid LIMIT ?",
+            (last_rowid, chunk_size)
+        ).fetchall()
+        if not rows:
+            break
+
+        connection.executemany(
+            "UPDATE campaign_contacts SET shard_key = ? WHERE rowid = ?",
+            ((number_shard_key(numero), rowid) for rowid, numero in rows)
+        )
+        last_rowid = rows[-1][0]
+
+
+def _backfill_report_numbers(connection: sqlite3.Connection, chunk_size: int = 1000):
+    """Calcular reports.number_int de los reportes existentes"""
+    last_rowid = 0
+    while True:
+        rows = connection.execute(
+            "SELECT rowid, number FROM reports WHERE rowid > ? ORDER BY rowid LIMIT ?",
+            (last_rowid, chunk_size)
+        ).fetchall()
+        if not rows:
+            break
+
+        connection.executemany(
+            "UPDATE reports SET number_int = ? WHERE rowid = ?",
+            ((number_to_int(number), rowid) for rowid, number in rows)
+        )
+        last_rowid = rows[-1][0]
+
+
+# Columna de fecha (UTC, indexada) usada por la retención de cada tabla
+RETENTION_COLUMNS: Dict[str, str] = {
+    "sms": "sent_at",
+    "reports": "created_at",
+    "transactions": "created_at",
+    "balance_history": "recorded_at",
+}
+
+
+def utc_cutoff(days: int) -> str:
+    """
+    Calcular el límite de retención en el formato de CURRENT_TIMESTAMP
+
+    Args:
+        days: Días a conservar
+
+    Returns:
+        Fecha UTC 'AAAA-MM-DD HH:MM:SS'
+    """
+    return (datetime.utcnow() - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _backfill_message_bodies(connection: sqlite3.Connection, chunk_size: int = 1000):
+    """Mover sms.content a message_bodies y dejar solo la referencia en sms"""
+    last_rowid = 0
+    while True:
+        rows = connection.execute(
+            "SELECT rowid, content FROM sms WHERE rowid > ? AND body_hash IS NULL "
+            "ORDER BY rowid LIMIT ?",
+            (last_rowid, chunk_size)
+        ).fetchall()
+        if not rows:
+            break
+
+        hashes = {content: body_hash(content) for _, content in rows}
+        connection.executemany(
+            "INSERT OR IGNORE INTO message_bodies (hash, content) VALUES (?, ?)",
+            ((digest, content) for content, digest in hashes.items())
+        )
+        connection.executemany(
+            "UPDATE sms SET body_hash = ?, content = '' WHERE rowid = ?",
+            ((hashes[content], rowid) for rowid, content in rows)
+        )
+        last_rowid = rows[-1][0]
+
+
+# Lectura de sms con el cuerpo resuelto desde message_bodies (las filas sin
+# body_hash conservan su content propio). La tabla sms guarda content vacío
+# en las filas deduplicadas: toda lectura de SMS pasa por este join o por
+# la vista sms_full, nunca por la tabla directa
+SMS_COLUMNS = """
+    s.id, s.account, s.numbers, COALESCE(b.content, s.content) AS content,
+    s.status, s.sender, s.sendtime, s.sent_at, s.updated_at,
+    s.delivered_count, s.failed_count, s.recipient_count, s.body_hash
+"""
+SMS_FROM = "sms s LEFT JOIN message_bodies b ON b.hash = s.body_hash"
+
+
+# Contadores de get_statistics: nombre -> (tabla, condición o None).
+# {row} se reemplaza por NEW/OLD en los triggers y por la tabla al reconstruir.
+COUNTERS: Dict[str, Tuple[str, Optional[str]]] = {
+    "total_sms": ("sms", None),
+    "sent_sms": ("sms", "{row}.status = 'sent'"),
+    "total_reports": ("reports", None),
+    "delivered_reports": ("reports", "{row}.status = 'delivered'"),
+    "active_tasks": ("tasks", "{row}.status = 'active'"),
+    "total_transactions": ("transactions", None),
+}
+
+
+def _counter_delta(table: str, row: str, sign: str, conditional_only: bool = False) -> str:
+    """Expresión CASE con el incremento de cada contador de una tabla"""
+    cases = []
+    for name, (counter_table, condition) in COUNTERS.items():
+        if counter_table != table or (conditional_only and condition is None):
+            continue
+        amount = f"IFNULL({condition.format(row=row)}, 0)" if condition else "1"
+        cases.append(f"WHEN '{name}' THEN {sign}{amount}")
+    return f"CASE name {' '.join(cases)} ELSE 0 END"
+
+
+def _counter_triggers() -> List[str]:
+    """Triggers que mantienen la tabla counters al insertar, borrar o cambiar estado"""
+    statements = []
+    for table in dict.fromkeys(t for t, _ in COUNTERS.values()):
+        # Solo se tocan las filas de contadores de esta tabla
+        names = ", ".join(f"'{name}'" for name, (t, _) in COUNTERS.items() if t == table)
+        statements.append(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_counters_insert AFTER INSERT ON {table}
+            BEGIN
+                UPDATE counters SET value = value + {_counter_delta(table, "NEW", "+")}
+                WHERE name IN ({names});
+            END
+        """)
+        statements.append(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_counters_delete AFTER DELETE ON {table}
+            BEGIN
+                UPDATE counters SET value = value + {_counter_delta(table, "OLD", "-")}
+                WHERE name IN ({names});
+            END
+        """)
+        if any(t == table and c for t, c in COUNTERS.values()):
+            statements.append(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_counters_status
+                AFTER UPDATE OF status ON {table} WHEN OLD.status IS NOT NEW.status
+                BEGIN
+                    UPDATE counters SET value = value
+                        + {_counter_delta(table, "NEW", "+", True)}
+                        + {_counter_delta(table, "OLD", "-", True)}
+                    WHERE name IN ({names});
+                END
+            """)
+    return statements
+
+
+def _rebuild_counters(connection: sqlite3.Connection):
+    """Recalcular todos los contadores con COUNT(*) sobre sus tablas"""
+    for name, (table, condition) in COUNTERS.items():
+        where = f"WHERE {condition.format(row=table)}" if condition else ""
+        connection.execute(
+            f"INSERT OR REPLACE INTO counters (name, value) "
+            f"VALUES (?, (SELECT COUNT(*) FROM {table} {where}))",
+            (name,)
+        )
+
+
+# Granularidades de los rollups de transacciones: tabla -> formato de bucket
+ROLLUP_TABLES: Dict[str, str] = {
+    "transaction_rollups_hourly": "%Y-%m-%d %H",
+    "transaction_rollups_daily": "%Y-%m-%d",
+}
+
+
+def _rollup_statements() -> List[str]:
+    """Tablas de rollup y el trigger que las actualiza al insertar transacciones"""
+    statements = []
+    upserts = []
+    for table, bucket_format in ROLLUP_TABLES.items():
+        statements.append(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                bucket TEXT NOT NULL,
+                operation TEXT NOT NULL,
+                tx_count INTEGER NOT NULL DEFAULT 0,
+                sms_count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (bucket, operation)
+            ) WITHOUT ROWID
+        """)
+        upserts.append(f"""
+                INSERT INTO {table} (bucket, operation, tx_count, sms_count)
+                VALUES (strftime('{bucket_format}', NEW.created_at), NEW.operation,
+                        1, IFNULL(NEW.sms_count, 0))
+                ON CONFLICT (bucket, operation) DO UPDATE
+                SET tx_count = tx_count + 1, sms_count = sms_count + excluded.sms_count;
+        """)
+
+    # Las purgas de retención no restan: los rollups conservan el histórico
+    statements.append(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_transactions_rollups AFTER INSERT ON transactions
+            BEGIN
+                {"".join(upserts)}
+            END
+    """)
+    return statements
+
+
+def _rebuild_rollups(connection: sqlite3.Connection):
+    """
+    Recalcular los rollups desde la tabla transactions
+
+    Solo se reconstruye la ventana que sigue en la tabla: los buckets
+    anteriores a la transacción más antigua (ya purgados o archivados) se
+    conservan, y el bucket de esa transacción se fusiona quedándose con el
+    mayor total, porque la purga pudo cortarlo a la mitad.
+
+    Args:
+        connection: Conexión dentro de la transacción de la reconstrucción
+    """
+    for table, bucket_format in ROLLUP_TABLES.items():
+        oldest = connection.execute(
+            f"SELECT strftime('{bucket_format}', MIN(created_at)) FROM transactions"
+        ).fetchone()[0]
+        if oldest is None:
+            continue
+        connection.execute(f"DELETE FROM {table} WHERE bucket > ?", (oldest,))
+        connection.execute(f"""
+            INSERT INTO {table} (bucket, operation, tx_count, sms_count)
+            SELECT strftime('{bucket_format}', created_at), operation,
+                   COUNT(*), IFNULL(SUM(sms_count), 0)
+            FROM transactions
+            WHERE created_at IS NOT NULL
+            GROUP BY 1, 2
+            ON CONFLICT (bucket, operation) DO UPDATE
+            SET tx_count = MAX(tx_count, excluded.tx_count),
+                sms_count = MAX(sms_count, excluded.sms_count)
+        """)
+
+
+# Migraciones versionadas: (versión, descripción, pasos). Cada paso es una
+# sentencia SQL o una función que recibe la conexión. Las migraciones ya
+# publicadas no se editan: los cambios nuevos van en una versión nueva.
+MIGRATIONS: List[Tuple[int, str, List[Union[str, Callable]]]] = [
+    (1, "Índices para reportes, historial, analytics y tareas", [
+        # get_reports_by_sms: filtro por sms_id ordenado por fecha
+        "CREATE INDEX IF NOT EXISTS idx_reports_sms_id ON reports(sms_id, created_at)",
+        # generate_delivery_report: últimos reportes
+        "CREATE INDEX IF NOT EXISTS idx_reports_created_at ON reports(created_at)",
+        # analyze_failures: índice parcial solo con los fallidos
+        "CREATE INDEX IF NOT EXISTS idx_reports_failed ON reports(created_at, error_code) "
+        "WHERE status = 'failed'",
+        # get_all_sms: historial ordenado por fecha
+        "CREATE INDEX IF NOT EXISTS idx_sms_sent_at ON sms(sent_at, id)",
+        # analytics: índice cubriente, no necesita leer la tabla
+        "CREATE INDEX IF NOT EXISTS idx_transactions_created_at "
+        "ON transactions(created_at, operation, sms_count)",
+        # list_tasks / get_active_tasks
+        "CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks(status, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_balance_history_account "
+        "ON balance_history(account, recorded_at)",
+        "CREATE INDEX IF NOT EXISTS idx_idempotency_expires ON idempotency_keys(expires_at)",
+    ]),
+    (2, "Tabla normalizada sms_recipients y sms.recipient_count", [
+        """
+        CREATE TABLE IF NOT EXISTS sms_recipients (
+            sms_id TEXT NOT NULL,
+            number INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'sent',
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (sms_id, number)
+        ) WITHOUT ROWID
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_sms_recipients_number ON sms_recipients(number, sms_id)",
+        "ALTER TABLE sms ADD COLUMN recipient_count INTEGER NOT NULL DEFAULT 0",
+        # Reportes por (sms_id, número) para el join con destinatarios
+        "CREATE INDEX IF NOT EXISTS idx_reports_sms_number ON reports(sms_id, number)",
+        "CREATE INDEX IF NOT EXISTS idx_reports_number ON reports(number)",
+        _backfill_recipients,
+    ]),
+    (3, "Contadores de estadísticas mantenidos por triggers", [
+        """
+        CREATE TABLE IF NOT EXISTS counters (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+        """,
+        *_counter_triggers(),
+        _rebuild_counters,
+    ]),
+    (4, "Índice de retención para balance_history", [
+        "CREATE INDEX IF NOT EXISTS idx_balance_history_recorded_at "
+        "ON balance_history(recorded_at)",
+    ]),
+    (5, "Rollups de transacciones por hora, día y operación", [
+        *_rollup_statements(),
+        _rebuild_rollups,
+    ]),
+    (6, "Cuerpos de mensaje deduplicados en message_bodies", [
+        """
+        CREATE TABLE IF NOT EXISTS message_bodies (
+            hash TEXT PRIMARY KEY,
+            content TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        "ALTER TABLE sms ADD COLUMN body_hash TEXT",
+        # purge_orphan_bodies: saber si un cuerpo sigue referenciado
+        "CREATE INDEX IF NOT EXISTS idx_sms_body_hash ON sms(body_hash)",
+        _backfill_message_bodies,
+    ]),
+    (7, "Campañas dinámicas: importaciones, campañas y contactos", [
+        """
+        CREATE TABLE IF NOT EXISTS excel_imports (
+            id TEXT PRIMARY KEY,
+            filename TEXT,
+            path TEXT NOT NULL,
+            total_rows INTEGER NOT NULL DEFAULT 0,
+            valid_rows INTEGER NOT NULL DEFAULT 0,
+            invalid_rows INTEGER NOT NULL DEFAULT 0,
+            duplicate_rows INTEGER NOT NULL DEFAULT 0,
+            variables TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS dynamic_campaigns (
+            id TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            excel_import_id TEXT,
+            template TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'draft',
+            total INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            started_at TIMESTAMP,
+            completed_at TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_dynamic_campaigns_status ON dynamic_campaigns(status, created_at)",
+        """
+        CREATE TABLE IF NOT EXISTS campaign_contacts (
+            id TEXT PRIMARY KEY,
+            campaign_id TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            numero TEXT NOT NULL,
+            nombre TEXT,
+            message TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            error TEXT,
+            sent_at TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        # iter_campaign_contacts: recorrido por clave en el orden del archivo
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_campaign_contacts_seq ON campaign_contacts(campaign_id, seq)",
+        # get_campaign_counts: conteo por estado sin leer la tabla
+        "CREATE INDEX IF NOT EXISTS idx_campaign_contacts_status ON campaign_contacts(campaign_id, status)",
+    ]),
+    (8, "Checkpoints y lease de envío de campañas", [
+        """
+        CREATE TABLE IF NOT EXISTS campaign_checkpoints (
+            campaign_id TEXT NOT NULL,
+            shard INTEGER NOT NULL DEFAULT 0,
+            last_seq INTEGER NOT NULL DEFAULT 0,
+            sent INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (campaign_id, shard)
+        ) WITHOUT ROWID
+        """,
+        # Proceso que envía la campaña y último latido (epoch)
+        "ALTER TABLE dynamic_campaigns ADD COLUMN owner TEXT",
+        "ALTER TABLE dynamic_campaigns ADD COLUMN heartbeat_at REAL",
+    ]),
+    (9, "Clave de reparto de contactos entre shards de envío", [
+        "ALTER TABLE campaign_contacts ADD COLUMN shard_key INTEGER NOT NULL DEFAULT 0",
+        _backfill_shard_keys,
+    ]),
+    (10, "Rate limits compartidos entre procesos", [
+        """
+        CREATE TABLE IF NOT EXISTS rate_limits (
+            name TEXT PRIMARY KEY,
+            next_slot REAL NOT NULL
+        ) WITHOUT ROWID
+        """,
+    ]),
+    (11, "Vista sms_full con el cuerpo resuelto desde message_bodies", [
+        f"CREATE VIEW IF NOT EXISTS sms_full AS SELECT {SMS_COLUMNS} FROM {SMS_FROM}",
+    ]),
+    (12, "Número entero de los reportes para el join con sms_recipients", [
+        "ALTER TABLE reports ADD COLUMN number_int INTEGER",
+        _backfill_report_numbers,
+        # get_recipient_reports: último reporte de cada (sms_id, número)
+        "CREATE INDEX IF NOT EXISTS idx_reports_sms_number_int ON reports(sms_id, number_int, created_at)",
+        # Lo reemplaza el índice anterior (el texto del número no coincide con el destinatario)
+        "DROP INDEX IF EXISTS idx_reports_sms_number",
+    ]),
+]
+
+# Pools y esquemas inicializados por proceso
+_pools: Dict[Tuple[str, bool], ConnectionPool] = {}
+_initialized_paths = set()
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path: str, read_only: bool = False) -> ConnectionPool:
+    """Obtener el pool compartido (de escritura o de lectura) de un archivo de base de datos"""
+    key = (db_path, read_only)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(db_path, read_only=read_only)
+        return _pools[key]
+
+
+class AggregateQuery:
+    """
+    Constructor de consultas de agregación que se resuelven dentro de SQLite
+
+    Ejemplo:
+        AggregateQuery("sms").count("total").count_where("sent", "status = ?", "sent")
+            .since("sent_at", "2026-01-01 00:00:00").group_by("account")
+    """
+
+    def __init__(self, table: str):
+        """
+        Inicializar consulta
+
+        Args:
+            table: Tabla a agregar
+        """
+        self.table = table
+        self.columns: List[str] = []
+        self.column_params: List[Any] = []
+        self.conditions: List[str] = []
+        self.params: List[Any] = []
+        self.groups: List[str] = []
+        self.window: Optional[Tuple[str, int]] = None
+
+    def count(self, alias: str = "total") -> "AggregateQuery":
+        """Agregar COUNT(*)"""
+        self.columns.append(f"COUNT(*) AS {alias}")
+        return self
+
+    def count_where(self, alias: str, condition: str, *params) -> "AggregateQuery":
+        """Agregar un conteo condicional (filas que cumplen condition)"""
+        self.columns.append(f"IFNULL(SUM(CASE WHEN {condition} THEN 1 ELSE 0 END), 0) AS {alias}")
+        self.column_params.extend(params)
+        return self
+
+    def sum(self, alias: str, expression: str) -> "AggregateQuery":
+        """Agregar SUM(expression), 0 si no hay filas"""
+        self.columns.append(f"IFNULL(SUM({expression}), 0) AS {alias}")
+        return self
+
+    def where(self, condition: str, *params) -> "AggregateQuery":
+        """Filtrar filas antes de agregar"""
+        self.conditions.append(condition)
+        self.params.extend(params)
+        return self
+
+    def since(self, column: str, start: str, end: Optional[str] = None) -> "AggregateQuery":
+        """Limitar a un rango de fechas [start, end)"""
+        self.where(f"{column} >= ?", start)
+        if end is not None:
+            self.where(f"{column} < ?", end)
+        return self
+
+    def latest(self, column: str, limit: int) -> "AggregateQuery":
+        """Agregar solo las últimas `limit` filas según column (descendente)"""
+        self.window = (column, limit)
+        return self
+
+    def group_by(self, *columns: str) -> "AggregateQuery":
+        """Agrupar por columnas (se incluyen en el resultado)"""
+        self.groups.extend(columns)
+        return self
+
+    def build(self) -> Tuple[str, tuple]:
+        """
+        Construir SQL y parámetros
+
+        Returns:
+            Tupla (consulta, parámetros)
+        """
+        where = f"WHERE {' AND '.join(self.conditions)}" if self.conditions else ""
+        params = list(self.column_params) + list(self.params)
+
+        if self.window:
+            column, limit = self.window
+            source = f"(SELECT * FROM {self.table} {where} ORDER BY {column} DESC LIMIT ?)"
+            params.append(limit)
+            where = ""
+        else:
+            source = self.table
+
+        query = f"SELECT {', '.join(self.groups + self.columns)} FROM {source} {where}"
+        if self.groups:
+            query += f" GROUP BY {', '.join(self.groups)}"
+        return query, tuple(params)
+
+
 class Database:
     """Gestor de base de datos SQLite"""
 
-    def __init__(self, db_path: str = str(DB_PATH)):
+    def __init__(self, db_path: str = str(DB_PATH), read_only: bool = False):
         """
         Inicializar conexión a base de datos
 
         Args:
             db_path: Ruta del archivo de base de datos
+            read_only: Usar el pool de solo lectura (dashboard y reportes);
+                las escrituras fallan con sqlite3.OperationalError
         """
         self.db_path = db_path
-        self.connection = None
+        self.read_only = read_only
+        # El esquema y las migraciones siempre van por una conexión de escritura
+        self.pool = get_pool(db_path)
         self.init_database()
+        if read_only:
+            self.pool = get_pool(db_path, read_only=True)
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """Conexión del hilo actual"""
+        return self.pool.get()
 
     def connect(self):
         """Conectar a la base de datos"""
         try:
-            self.connection = sqlite3.connect(self.db_path)
-            self.connection.row_factory = sqlite3.Row
+            self.pool.get()
             logger.info(f"✅ Conectado a base de datos: {self.db_path}")
         except sqlite3.Error as e:
             logger.error(f"❌ Error de conexión a BD: {str(e)}")
             raise
 
     def disconnect(self):
-        """Desconectar de la base de datos"""
-        if self.connection:
-            self.connection.close()
-            logger.info("👋 Desconectado de base de datos")
+        """Desconectar de la base de datos (conexión del hilo actual)"""
+        self.pool.close()
+        logger.info("👋 Desconectado de base de datos")
 
     def init_database(self):
-        """Inicializar tablas si no existen"""
+        """Inicializar tablas si no existen (una sola vez por proceso)"""
+        with _pools_lock:
+            if self.db_path in _initialized_paths:
+                return
+            self._create_tables()
+            self.run_migrations()
+            _initialized_paths.add(self.db_path)
+
+    def _create_tables(self):
+        """Crear tablas base"""
         self.connect()
 
         cursor = self.connection.cursor()
@@ -126,9 +841,83 @@ class Database:
             )
         """)
 
+        # Tabla de claves de idempotencia (compartida entre workers)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS idempotency_keys (
+                key TEXT PRIMARY KEY,
+                status TEXT NOT NULL DEFAULT 'pending',
+                result TEXT,
+                created_at REAL NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        """)
+
+        # Registro de migraciones aplicadas
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                description TEXT NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+
         self.connection.commit()
         logger.info("✅ Base de datos inicializada")
 
+    # ==================== MIGRACIONES ====================
+
+    def get_schema_version(self) -> int:
+        """Obtener la última versión de esquema aplicada"""
+        row = self.connection.execute(
+            "SELECT COALESCE(MAX(version), 0) FROM schema_migrations"
+        ).fetchone()
+        return row[0]
+
+    def run_migrations(self) -> int:
+        """
+        Aplicar migraciones pendientes sobre una base existente
+
+        Cada migración corre en su propia transacción BEGIN IMMEDIATE, así
+        que si varios procesos arrancan a la vez solo uno la aplica.
+
+        Returns:
+            Versión de esquema resultante
+        """
+        connection = self.connection
+
+        for version, description, steps in MIGRATIONS:
+            if version <= self.get_schema_version():
+                continue
+
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                # Otro proceso pudo aplicarla mientras esperábamos el bloqueo
+                if version <= self.get_schema_version():
+                    connection.rollback()
+                    continue
+
+                started = time.time()
+                for step in steps:
+                    if callable(step):
+                        step(connection)
+                    else:
+                        connection.execute(step)
+
+                connection.execute(
+                    "INSERT INTO schema_migrations (version, description) VALUES (?, ?)",
+                    (version, description)
+                )
+                connection.commit()
+                logger.info(
+                    f"🧱 Migración {version} aplicada en {time.time() - started:.2f}s: {description}"
+                )
+            except Exception:
+                connection.rollback()
+                logger.error(f"❌ Error aplicando migración {version}: {description}")
+                raise
+
+        return self.get_schema_version()
+
     def execute_query(self, query: str, params: tuple = ()) -> List[Dict]:
         """
         Ejecutar consulta SELECT
@@ -141,8 +930,74 @@ class Database:
             Lista de resultados como dicts
         """
         cursor = self.connection.cursor()
+        if not profiler.enabled:
+            cursor.execute(query, params)
+            return [dict(row) for row in cursor.fetchall()]
+
+        start = time.perf_counter()
         cursor.execute(query, params)
-        return [dict(row) for row in cursor.fetchall()]
+        rows = [dict(row) for row in cursor.fetchall()]
+        self._profile(query, params, time.perf_counter() - start, len(rows))
+        return rows
+
+    def iter_query(self, query: str, params: tuple = (),
+                   chunk_size: int = DB_BULK_CHUNK_SIZE,
+                   record_type: Optional[Type[Record]] = None) -> Iterator:
+        """
+        Recorrer una consulta SELECT fila por fila sin cargarla completa
+
+        Args:
+            query: Consulta SQL
+            params: Parámetros
+            chunk_size: Filas leídas por fetchmany
+            record_type: Subclase de models.Record para obtener filas con
+                __slots__ en lugar de un dict por fila
+
+        Returns:
+            Iterador de resultados como dicts (o registros de record_type)
+        """
+        cursor = self.connection.cursor()
+        if record_type is not None:
+            # Tuplas planas: el registro se arma directo sin pasar por sqlite3.Row
+            cursor.row_factory = None
+        # Solo se mide el tiempo dentro de SQLite, no el del consumidor
+        elapsed = 0.0
+        count = 0
+        try:
+            start = time.perf_counter()
+            cursor.execute(query, params)
+            if record_type is None:
+                make = dict
+            else:
+                make = record_type.factory([column[0] for column in cursor.description])
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                elapsed += time.perf_counter() - start
+                if not rows:
+                    break
+                count += len(rows)
+                for row in rows:
+                    yield make(row)
+                start = time.perf_counter()
+        finally:
+            cursor.close()
+            if profiler.enabled:
+                self._profile(query, params, elapsed, count)
+
+    def query_records(self, query: str, params: tuple = (),
+                      record_type: Type[Record] = Record) -> List[Record]:
+        """
+        Ejecutar consulta SELECT devolviendo registros con __slots__
+
+        Args:
+            query: Consulta SQL
+            params: Parámetros
+            record_type: SMSRecord, ReportRecord, TransactionRecord u otra subclase
+
+        Returns:
+            Lista de registros
+        """
+        return list(self.iter_query(query, params, record_type=record_type))
 
     def execute_update(self, query: str, params: tuple = ()) -> int:
         """
@@ -155,41 +1010,238 @@ class Database:
         Returns:
             Número de filas afectadas
         """
-        cursor = self.connection.cursor()
-        cursor.execute(query, params)
-        self.connection.commit()
+        cursor = self._run(self.connection.cursor(), query, params)
+        if not self.in_transaction():
+            self.connection.commit()
         return cursor.rowcount
 
+    def _run(self, target, query: str, params: Any = (), many: bool = False) -> sqlite3.Cursor:
+        """
+        Ejecutar una sentencia (o executemany) pasando por el perfilador
+
+        Args:
+            target: Conexión o cursor
+            query: Sentencia SQL
+            params: Parámetros (lista de tuplas si many)
+            many: Usar executemany
+
+        Returns:
+            Cursor resultante
+        """
+        execute = target.executemany if many else target.execute
+        if not profiler.enabled:
+            return execute(query, params)
+
+        start = time.perf_counter()
+        cursor = execute(query, params)
+        elapsed = time.perf_counter() - start
+        if many:
+            # El plan se captura con la primera fila del lote
+            params = params[0] if isinstance(params, list) and params else ()
+        self._profile(query, params, elapsed, cursor.rowcount)
+        return cursor
+
+    def _profile(self, query: str, params: Any, elapsed: float, rows: int):
+        """Registrar una sentencia en el perfilador"""
+        def explain() -> List[str]:
+            plan = self.connection.execute(f"EXPLAIN QUERY PLAN {query}", params)
+            return [row["detail"] for row in plan.fetchall()]
+
+        profiler.record(query, elapsed * 1000, rows, explain)
+
+    def in_transaction(self) -> bool:
+        """Indica si el hilo actual está dentro de transaction()"""
+        return getattr(self.pool.local, "tx_depth", 0) > 0
+
+    @contextmanager
+    def transaction(self):
+        """
+        Agrupar varias escrituras en un único commit
+
+        Se puede anidar: solo el bloque más externo confirma o revierte,
+        y execute_update no confirma mientras haya uno abierto.
+
+        Returns:
+            Conexión del hilo actual
+        """
+        connection = self.connection
+        depth = getattr(self.pool.local, "tx_depth", 0)
+        self.pool.local.tx_depth = depth + 1
+        try:
+            yield connection
+            if depth == 0:
+                connection.commit()
+        except BaseException:
+            if depth == 0:
+                connection.rollback()
+            raise
+        finally:
+            self.pool.local.tx_depth = depth
+
+    def execute_many(self, query: str, rows: Iterable[tuple],
+                     chunk_size: int = DB_BULK_CHUNK_SIZE) -> List[int]:
+        """
+        Ejecutar una sentencia para muchas filas en una sola transacción
+
+        Args:
+            query: Consulta SQL con parámetros
+            rows: Tuplas de parámetros (puede ser un generador)
+            chunk_size: Filas por executemany
+
+        Returns:
+            Filas afectadas por cada bloque
+        """
+        counts = []
+        with self.transaction() as connection:
+            for chunk in chunked(rows, chunk_size):
+                counts.append(self._run(connection, query, chunk, many=True).rowcount)
+        return counts
+
     # ==================== SMS ====================
 
     def save_sms(self, sms_id: str, account: str, numbers: List[str],
                  content: str, sender: Optional[str] = None,
                  sendtime: Optional[str] = None) -> bool:
-        """Guardar SMS enviado"""
+        """Guardar SMS enviado junto con sus destinatarios"""
         try:
-            query = """
-                INSERT INTO sms (id, account, numbers, content, sender, sendtime, status)
-                VALUES (?, ?, ?, ?, ?, ?, 'sent')
-            """
-            numbers_str = ",".join(numbers) if isinstance(numbers, list) else numbers
-            self.execute_update(query, (sms_id, account, numbers_str, content, sender, sendtime))
+            self.save_sms_bulk([{
+                "sms_id": sms_id, "account": account, "numbers": numbers,
+                "content": content, "sender": sender, "sendtime": sendtime
+            }])
             logger.info(f"💾 SMS guardado: {sms_id}")
             return True
         except Exception as e:
             logger.error(f"❌ Error guardando SMS: {str(e)}")
             return False
 
+    def save_sms_bulk(self, records: Iterable[Dict], ignore_existing: bool = False,
+                      chunk_size: int = DB_BULK_CHUNK_SIZE) -> List[int]:
+        """
+        Guardar muchos SMS con sus destinatarios en una sola transacción
+
+        Args:
+            records: Dicts con sms_id, account, numbers, content, sender y sendtime
+            ignore_existing: Omitir SMS cuyo ID ya existe en lugar de fallar
+            chunk_size: SMS por executemany
+
+        Returns:
+            SMS insertados por cada bloque
+        """
+        # El texto va una sola vez a message_bodies; sms guarda solo su hash
+        query = f"""
+            INSERT {"OR IGNORE " if ignore_existing else ""}INTO sms
+                (id, account, numbers, content, sender, sendtime, status, recipient_count, body_hash)
+            VALUES (?, ?, ?, '', ?, ?, 'sent', ?, ?)
+        """
+        counts = []
+        with self.transaction() as connection:
+            for chunk in chunked(records, chunk_size):
+                sms_rows = []
+                recipient_rows = []
+                hashes: Dict[str, str] = {}
+                for record in chunk:
+                    numbers = record["numbers"]
+                    number_list = numbers if isinstance(numbers, list) else numbers.split(",")
+                    recipients = [n for n in map(number_to_int, number_list) if n is not None]
+                    content = record["content"]
+                    if content not in hashes:
+                        hashes[content] = body_hash(content)
+                    sms_rows.append((
+                        record["sms_id"], record["account"], ",".join(number_list),
+                        record.get("sender"), record.get("sendtime"),
+                        len(recipients), hashes[content]
+                    ))
+                    recipient_rows.extend((record["sms_id"], n) for n in recipients)
+
+                self._run(
+                    connection,
+                    "INSERT OR IGNORE INTO message_bodies (hash, content) VALUES (?, ?)",
+                    [(digest, content) for content, digest in hashes.items()], many=True
+                )
+                counts.append(self._run(connection, query, sms_rows, many=True).rowcount)
+                self._run(
+                    connection,
+                    "INSERT OR IGNORE INTO sms_recipients (sms_id, number) VALUES (?, ?)",
+                    recipient_rows, many=True
+                )
+        return counts
+
+    def save_recipients_bulk(self, rows: Iterable[Tuple[str, Any]],
+                             chunk_size: int = DB_BULK_CHUNK_SIZE) -> List[int]:
+        """
+        Guardar destinatarios sueltos (sms_id, número)
+
+        Args:
+            rows: Pares (sms_id, número); los duplicados se ignoran
+            chunk_size: Filas por executemany
+
+        Returns:
+            Destinatarios insertados por cada bloque
+        """
+        return self.execute_many(
+            "INSERT OR IGNORE INTO sms_recipients (sms_id, number) VALUES (?, ?)",
+            ((sms_id, number_to_int(number)) for sms_id, number in rows),
+            chunk_size
+        )
+
     def get_sms(self, sms_id: str) -> Optional[Dict]:
         """Obtener SMS por ID"""
-        query = "SELECT * FROM sms WHERE id = ?"
+        query = f"SELECT {SMS_COLUMNS} FROM {SMS_FROM} WHERE s.id = ?"
         results = self.execute_query(query, (sms_id,))
         return results[0] if results else None
 
     def get_all_sms(self, limit: int = 100, offset: int = 0) -> List[Dict]:
         """Obtener todos los SMS"""
-        query = "SELECT * FROM sms ORDER BY sent_at DESC LIMIT ? OFFSET ?"
+        query = f"SELECT {SMS_COLUMNS} FROM {SMS_FROM} ORDER BY s.sent_at DESC LIMIT ? OFFSET ?"
         return self.execute_query(query, (limit, offset))
 
+    def get_sms_page(self, limit: int = 100,
+                     cursor: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        """
+        Obtener una página del historial de SMS (más recientes primero)
+
+        Usa paginación por clave (sent_at, id) en lugar de OFFSET, por lo que
+        el costo no depende de qué tan atrás esté la página.
+
+        Args:
+            limit: SMS por página
+            cursor: Cursor devuelto por la página anterior (None para la primera)
+
+        Returns:
+            Tupla (SMS de la página, cursor de la siguiente o None si no hay más)
+
+        Raises:
+            ValueError: Si el cursor no es válido
+        """
+        limit = max(limit, 1)
+        if cursor:
+            sent_at, sms_id = decode_cursor(cursor, 2)
+            query = f"""
+                SELECT {SMS_COLUMNS} FROM {SMS_FROM}
+                WHERE (s.sent_at, s.id) < (?, ?)
+                ORDER BY s.sent_at DESC, s.id DESC
+                LIMIT ?
+            """
+            params = (sent_at, sms_id, limit + 1)
+        else:
+            query = f"SELECT {SMS_COLUMNS} FROM {SMS_FROM} ORDER BY s.sent_at DESC, s.id DESC LIMIT ?"
+            params = (limit + 1,)
+
+        rows = self.execute_query(query, params)
+        if not rows or len(rows) <= limit:
+            return rows, None
+
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1]["sent_at"], rows[-1]["id"])
+
+    def iter_sms(self, chunk_size: int = DB_BULK_CHUNK_SIZE,
+                 record_type: Optional[Type[Record]] = None) -> Iterator:
+        """Recorrer todo el historial de SMS (más recientes primero) en bloques"""
+        return self.iter_query(
+            f"SELECT {SMS_COLUMNS} FROM {SMS_FROM} ORDER BY s.sent_at DESC, s.id DESC",
+            chunk_size=chunk_size, record_type=record_type
+        )
+
     def update_sms_status(self, sms_id: str, status: str,
                          delivered: int = 0, failed: int = 0):
         """Actualizar estado de SMS"""
@@ -200,6 +1252,84 @@ class Database:
         """
         self.execute_update(query, (status, delivered, failed, sms_id))
 
+    def update_sms_status_bulk(self, updates: Iterable[Dict],
+                               chunk_size: int = DB_BULK_CHUNK_SIZE) -> List[int]:
+        """
+        Actualizar el estado de muchos SMS
+
+        Args:
+            updates: Dicts con sms_id, status, delivered y failed
+            chunk_size: Filas por executemany
+
+        Returns:
+            SMS actualizados por cada bloque
+        """
+        query = """
+            UPDATE sms
+            SET status = ?, delivered_count = ?, failed_count = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        """
+        return self.execute_many(query, (
+            (u["status"], u.get("delivered", 0), u.get("failed", 0), u["sms_id"])
+            for u in updates
+        ), chunk_size)
+
+    def get_recipients(self, sms_id: str) -> List[Dict]:
+        """Obtener destinatarios de un SMS"""
+        query = "SELECT number, status, updated_at FROM sms_recipients WHERE sms_id = ?"
+        return self.execute_query(query, (sms_id,))
+
+    def get_sms_by_number(self, number: str, limit: int = 100) -> List[Dict]:
+        """
+        Obtener los SMS enviados a un número
+
+        Args:
+            number: Número de teléfono
+            limit: Máximo de resultados
+
+        Returns:
+            SMS más recientes primero, con el estado del destinatario
+        """
+        query = f"""
+            SELECT {SMS_COLUMNS}, sr.status AS recipient_status
+            FROM sms_recipients sr
+            JOIN sms s ON s.id = sr.sms_id
+            LEFT JOIN message_bodies b ON b.hash = s.body_hash
+            WHERE sr.number = ?
+            ORDER BY s.sent_at DESC
+            LIMIT ?
+        """
+        return self.execute_query(query, (number_to_int(number), limit))
+
+    def get_recipient_reports(self, sms_id: str) -> List[Dict]:
+        """
+        Obtener destinatarios de un SMS con su reporte de entrega (si existe)
+
+        El reporte guarda el número como llegó ("+57...", "0300...") y
+        además su forma entera (number_int), que es la del destinatario; el
+        cruce es un join por índice y si un número tiene varios reportes se
+        usa el más reciente.
+
+        Args:
+            sms_id: ID del SMS
+
+        Returns:
+            Un dict por destinatario (report_id None si no hay reporte)
+        """
+        query = """
+            SELECT sr.number, sr.status AS recipient_status, r.id AS report_id,
+                   r.status AS report_status, r.error_code, r.delivered_at
+            FROM sms_recipients sr
+            LEFT JOIN reports r ON r.rowid = (
+                SELECT rowid FROM reports
+                WHERE sms_id = sr.sms_id AND number_int = sr.number
+                ORDER BY created_at DESC, rowid DESC
+                LIMIT 1
+            )
+            WHERE sr.sms_id = ?
+        """
+        return self.execute_query(query, (sms_id,))
+
     # ==================== REPORTES ====================
 
     def save_report(self, report_id: str, sms_id: str, number: str,
@@ -207,17 +1337,55 @@ class Database:
                    error_message: Optional[str] = None) -> bool:
         """Guardar reporte de entrega"""
         try:
-            query = """
-                INSERT INTO reports (id, sms_id, number, status, error_code, error_message)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """
-            self.execute_update(query, (report_id, sms_id, number, status, error_code, error_message))
+            self.save_reports_bulk([{
+                "report_id": report_id, "sms_id": sms_id, "number": number,
+                "status": status, "error_code": error_code, "error_message": error_message
+            }])
             logger.info(f"📋 Reporte guardado: {report_id}")
             return True
         except Exception as e:
             logger.error(f"❌ Error guardando reporte: {str(e)}")
             return False
 
+    def save_reports_bulk(self, reports: Iterable[Dict], ignore_existing: bool = False,
+                          chunk_size: int = DB_BULK_CHUNK_SIZE) -> List[int]:
+        """
+        Guardar muchos reportes de entrega en una sola transacción
+
+        Args:
+            reports: Dicts con report_id, sms_id, number, status,
+                error_code y error_message
+            ignore_existing: Omitir reportes cuyo ID ya existe en lugar de fallar
+            chunk_size: Reportes por executemany
+
+        Returns:
+            Reportes insertados por cada bloque
+        """
+        query = f"""
+            INSERT {"OR IGNORE " if ignore_existing else ""}INTO reports
+                (id, sms_id, number, number_int, status, error_code, error_message)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """
+        counts = []
+        with self.transaction() as connection:
+            for chunk in chunked(reports, chunk_size):
+                counts.append(self._run(connection, query, [
+                    (r["report_id"], r["sms_id"], r["number"], number_to_int(r["number"]), r["status"],
+                     r.get("error_code"), r.get("error_message"))
+                    for r in chunk
+                ], many=True).rowcount)
+                # Reflejar el estado de entrega en el destinatario
+                self._run(
+                    connection,
+                    """
+                    UPDATE sms_recipients SET status = ?, updated_at = CURRENT_TIMESTAMP
+                    WHERE sms_id = ? AND number = ?
+                    """,
+                    [(r["status"], r["sms_id"], number_to_int(r["number"])) for r in chunk],
+                    many=True
+                )
+        return counts
+
     def get_reports_by_sms(self, sms_id: str) -> List[Dict]:
         """Obtener reportes de un SMS"""
         query = "SELECT * FROM reports WHERE sms_id = ? ORDER BY created_at DESC"
@@ -231,19 +1399,41 @@ class Database:
                  endtime: Optional[str] = None) -> bool:
         """Guardar tarea programada"""
         try:
-            query = """
-                INSERT INTO tasks (id, account, task_type, contacts, content, sender, sendtime, interval, endtime)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """
-            contacts_str = ",".join(contacts) if isinstance(contacts, list) else contacts
-            self.execute_update(query, (task_id, account, task_type, contacts_str, content,
-                                       sender, sendtime, interval, endtime))
+            self.save_tasks_bulk([{
+                "task_id": task_id, "account": account, "task_type": task_type,
+                "contacts": contacts, "content": content, "sender": sender,
+                "sendtime": sendtime, "interval": interval, "endtime": endtime
+            }])
             logger.info(f"⏰ Tarea guardada: {task_id}")
             return True
         except Exception as e:
             logger.error(f"❌ Error guardando tarea: {str(e)}")
             return False
 
+    def save_tasks_bulk(self, tasks: Iterable[Dict],
+                        chunk_size: int = DB_BULK_CHUNK_SIZE) -> List[int]:
+        """
+        Guardar muchas tareas programadas
+
+        Args:
+            tasks: Dicts con los mismos campos que save_task
+            chunk_size: Tareas por executemany
+
+        Returns:
+            Tareas insertadas por cada bloque
+        """
+        query = """
+            INSERT INTO tasks (id, account, task_type, contacts, content, sender, sendtime, interval, endtime)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """
+        return self.execute_many(query, (
+            (t["task_id"], t["account"], t["task_type"],
+             ",".join(t["contacts"]) if isinstance(t["contacts"], list) else t["contacts"],
+             t["content"], t.get("sender"), t.get("sendtime"),
+             t.get("interval"), t.get("endtime"))
+            for t in tasks
+        ), chunk_size)
+
     def get_active_tasks(self) -> List[Dict]:
         """Obtener tareas activas"""
         query = "SELECT * FROM tasks WHERE status = 'active' ORDER BY created_at DESC"
@@ -261,22 +1451,148 @@ class Database:
                         status: str = "success", notes: Optional[str] = None) -> bool:
         """Guardar transacción"""
         try:
-            query = """
-                INSERT INTO transactions (id, operation, sms_count, balance_change, status, notes)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """
-            self.execute_update(query, (transaction_id, operation, sms_count, balance_change, status, notes))
+            self.save_transactions_bulk([{
+                "transaction_id": transaction_id, "operation": operation,
+                "sms_count": sms_count, "balance_change": balance_change,
+                "status": status, "notes": notes
+            }])
             logger.info(f"📊 Transacción guardada: {transaction_id}")
             return True
         except Exception as e:
             logger.error(f"❌ Error guardando transacción: {str(e)}")
             return False
 
-    def get_transactions(self, limit: int = 100) -> List[Dict]:
-        """Obtener últimas transacciones"""
+    def save_transactions_bulk(self, transactions: Iterable[Dict],
+                               ignore_existing: bool = False,
+                               chunk_size: int = DB_BULK_CHUNK_SIZE) -> List[int]:
+        """
+        Guardar muchas transacciones en una sola transacción SQLite
+
+        Args:
+            transactions: Dicts con transaction_id, operation, sms_count,
+                balance_change, status y notes
+            ignore_existing: Omitir transacciones cuyo ID ya existe en lugar de fallar
+            chunk_size: Filas por executemany
+
+        Returns:
+            Transacciones insertadas por cada bloque
+        """
+        query = f"""
+            INSERT {"OR IGNORE " if ignore_existing else ""}INTO transactions
+                (id, operation, sms_count, balance_change, status, notes)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """
+        return self.execute_many(query, (
+            (t["transaction_id"], t["operation"], t.get("sms_count", 0),
+             t.get("balance_change", 0), t.get("status", "success"), t.get("notes"))
+            for t in transactions
+        ), chunk_size)
+
+    def get_transaction_records(self, limit: int = 100) -> List[TransactionRecord]:
+        """Obtener últimas transacciones como registros livianos"""
         query = "SELECT * FROM transactions ORDER BY created_at DESC LIMIT ?"
+        return self.query_records(query, (limit,), TransactionRecord)
+
+    def get_transactions(self, limit: int = 100, since: Optional[str] = None) -> List[Dict]:
+        """Obtener últimas transacciones (opcionalmente desde una fecha UTC)"""
+        if since is None:
+            query = "SELECT * FROM transactions ORDER BY created_at DESC LIMIT ?"
+            return self.execute_query(query, (limit,))
+
+        query = "SELECT * FROM transactions WHERE created_at >= ? ORDER BY created_at DESC LIMIT ?"
+        return self.execute_query(query, (since, limit))
+
+    # ==================== ROLLUPS ====================
+
+    def get_hourly_sms(self) -> Dict[int, int]:
+        """
+        Obtener SMS por hora del día (UTC) desde los rollups
+
+        Returns:
+            Dict hora -> SMS, ordenado por hora
+        """
+        query = """
+            SELECT CAST(substr(bucket, 12, 2) AS INTEGER) AS hour, SUM(sms_count) AS sms
+            FROM transaction_rollups_hourly
+            GROUP BY hour
+            ORDER BY hour
+        """
+        return {row["hour"]: row["sms"] for row in self.execute_query(query)}
+
+    def get_daily_sms(self, days: int = 30) -> List[Dict]:
+        """
+        Obtener SMS por día desde los rollups (días más recientes primero)
+
+        Args:
+            days: Días con actividad a incluir
+
+        Returns:
+            Lista de {day, transactions, sms}
+        """
+        query = """
+            SELECT bucket AS day, SUM(tx_count) AS transactions, SUM(sms_count) AS sms
+            FROM transaction_rollups_daily
+            GROUP BY bucket
+            ORDER BY bucket DESC
+            LIMIT ?
+        """
+        return self.execute_query(query, (days,))
+
+    def get_operation_totals(self, limit: int = 10) -> List[Dict]:
+        """
+        Obtener totales por operación desde los rollups
+
+        Args:
+            limit: Operaciones a incluir
+
+        Returns:
+            Lista de {operation, count, total_sms} por volumen de SMS
+        """
+        query = """
+            SELECT operation, SUM(tx_count) AS count, SUM(sms_count) AS total_sms
+            FROM transaction_rollups_daily
+            GROUP BY operation
+            ORDER BY total_sms DESC
+            LIMIT ?
+        """
         return self.execute_query(query, (limit,))
 
+    def get_period_totals(self, since_day: str, until_day: Optional[str] = None) -> Dict:
+        """
+        Obtener transacciones y SMS de un rango de días
+
+        Args:
+            since_day: Primer día 'AAAA-MM-DD' (inclusivo)
+            until_day: Último día (exclusivo), None para hasta hoy
+
+        Returns:
+            Dict con transactions y sms
+        """
+        query = """
+            SELECT IFNULL(SUM(tx_count), 0) AS transactions, IFNULL(SUM(sms_count), 0) AS sms
+            FROM transaction_rollups_daily
+            WHERE bucket >= ? AND bucket < ?
+        """
+        return self.execute_query(query, (since_day, until_day or "9999-12-31"))[0]
+
+    def rebuild_rollups(self) -> int:
+        """
+        Recalcular los rollups desde las transacciones existentes
+
+        Los buckets anteriores a la transacción más antigua (purgados o
+        archivados por retención) se conservan.
+
+        Returns:
+            Buckets diarios resultantes
+        """
+        with self.transaction() as connection:
+            _rebuild_rollups(connection)
+        buckets = self.execute_query(
+            "SELECT COUNT(*) AS c FROM transaction_rollups_daily"
+        )[0]["c"]
+        logger.info(f"📈 Rollups recalculados: {buckets} buckets diarios")
+        return buckets
+
     # ==================== BALANCE ====================
 
     def save_balance(self, account: str, balance: float, gift_balance: float = 0):
@@ -298,38 +1614,455 @@ class Database:
         """
         return self.execute_query(query, (account, limit))
 
-    # ==================== ESTADÍSTICAS ====================
+    # ==================== IDEMPOTENCIA ====================
 
-    def get_statistics(self) -> Dict[str, Any]:
-        """Obtener estadísticas generales"""
-        stats = {}
+    def claim_idempotency_key(self, key: str, ttl: int) -> bool:
+        """
+        Reservar una clave de idempotencia
 
-        # Total de SMS
-        result = self.execute_query("SELECT COUNT(*) as count FROM sms")
-        stats["total_sms"] = result[0]["count"] if result else 0
+        Args:
+            key: Clave del envío
+            ttl: Segundos que dura la reserva mientras el envío está en curso
 
-        # SMS enviados
-        result = self.execute_query("SELECT COUNT(*) as count FROM sms WHERE status = 'sent'")
-        stats["sent_sms"] = result[0]["count"] if result else 0
+        Returns:
+            True si la clave quedó reservada, False si ya existía
+        """
+        now = time.time()
+        # Una clave vencida se puede volver a reservar
+        self.execute_update(
+            "DELETE FROM idempotency_keys WHERE key = ? AND expires_at < ?",
+            (key, now)
+        )
+        query = """
+            INSERT OR IGNORE INTO idempotency_keys (key, status, created_at, expires_at)
+            VALUES (?, 'pending', ?, ?)
+        """
+        return self.execute_update(query, (key, now, now + ttl)) == 1
 
-        # Total de reportes
-        result = self.execute_query("SELECT COUNT(*) as count FROM reports")
-        stats["total_reports"] = result[0]["count"] if result else 0
+    def get_idempotency_record(self, key: str) -> Optional[Dict]:
+        """Obtener registro vigente de una clave de idempotencia"""
+        query = "SELECT * FROM idempotency_keys WHERE key = ? AND expires_at >= ?"
+        results = self.execute_query(query, (key, time.time()))
+        if not results:
+            return None
 
-        # Reportes entregados
-        result = self.execute_query("SELECT COUNT(*) as count FROM reports WHERE status = 'delivered'")
-        stats["delivered_reports"] = result[0]["count"] if result else 0
+        record = results[0]
+        record["result"] = json.loads(record["result"]) if record["result"] else None
+        return record
 
-        # Tareas activas
-        result = self.execute_query("SELECT COUNT(*) as count FROM tasks WHERE status = 'active'")
-        stats["active_tasks"] = result[0]["count"] if result else 0
+    def complete_idempotency_key(self, key: str, result: Dict, ttl: int):
+        """Guardar el resultado de un envío aceptado bajo su clave"""
+        query = """
+            UPDATE idempotency_keys
+            SET status = 'completed', result = ?, expires_at = ?
+            WHERE key = ?
+        """
+        self.execute_update(query, (json.dumps(result, default=str), time.time() + ttl, key))
+
+    def release_idempotency_key(self, key: str):
+        """Liberar una clave cuyo envío no fue aceptado"""
+        self.execute_update(
+            "DELETE FROM idempotency_keys WHERE key = ? AND status = 'pending'",
+            (key,)
+        )
+
+    def purge_idempotency_keys(self) -> int:
+        """Eliminar claves de idempotencia vencidas"""
+        return self.execute_update(
+            "DELETE FROM idempotency_keys WHERE expires_at < ?",
+            (time.time(),)
+        )
+
+    # ==================== CAMPAÑAS ====================
+
+    def save_excel_import(self, import_id: str, path: str, summary: Dict,
+                          filename: Optional[str] = None):
+        """
+        Registrar un archivo de contactos subido
+
+        Args:
+            import_id: ID de la importación
+            path: Ruta del archivo guardado
+            summary: Resumen del pipeline (conteos y variables detectadas)
+            filename: Nombre original del archivo
+        """
+        query = """
+            INSERT INTO excel_imports
+                (id, filename, path, total_rows, valid_rows, invalid_rows, duplicate_rows, variables)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """
+        self.execute_update(query, (
+            import_id, filename, path,
+            summary.get("total_rows", 0), summary.get("valid_rows", 0),
+            summary.get("invalid_rows", 0), summary.get("duplicate_rows", 0),
+            json.dumps(summary.get("detected_variables", []), ensure_ascii=False)
+        ))
+
+    def get_excel_import(self, import_id: str) -> Optional[Dict]:
+        """Obtener una importación de contactos"""
+        rows = self.execute_query("SELECT * FROM excel_imports WHERE id = ?", (import_id,))
+        return rows[0] if rows else None
+
+    def save_campaign(self, campaign_id: str, name: str, excel_import_id: Optional[str],
+                      template: str, status: str = "draft"):
+        """Guardar una campaña dinámica"""
+        query = """
+            INSERT INTO dynamic_campaigns (id, name, excel_import_id, template, status)
+            VALUES (?, ?, ?, ?, ?)
+        """
+        self.execute_update(query, (campaign_id, name, excel_import_id, template, status))
+
+    def get_campaign(self, campaign_id: str) -> Optional[Dict]:
+        """Obtener una campaña dinámica"""
+        rows = self.execute_query("SELECT * FROM dynamic_campaigns WHERE id = ?", (campaign_id,))
+        return rows[0] if rows else None
+
+    def update_campaign_status(self, campaign_id: str, status: str,
+                               total: Optional[int] = None):
+        """
+        Actualizar estado de una campaña
+
+        Args:
+            campaign_id: ID de la campaña
+            status: draft, ready, sending, completed o failed
+            total: Contactos a enviar (se conserva si es None)
+        """
+        query = """
+            UPDATE dynamic_campaigns
+            SET status = ?,
+                total = COALESCE(?, total),
+                started_at = CASE WHEN ? = 'sending' THEN COALESCE(started_at, CURRENT_TIMESTAMP)
+                                  ELSE started_at END,
+                completed_at = CASE WHEN ? IN ('completed', 'failed') THEN CURRENT_TIMESTAMP
+                                    ELSE completed_at END,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        """
+        self.execute_update(query, (status, total, status, status, campaign_id))
+
+    def save_campaign_contacts_bulk(self, contacts: Iterable[Dict], ignore_existing: bool = False,
+                                    chunk_size: int = DB_BULK_CHUNK_SIZE) -> List[int]:
+        """
+        Guardar contactos procesados de una campaña
+
+        Args:
+            contacts: Dicts con id, campaign_id, seq, numero, nombre y processed_message
+            ignore_existing: Omitir contactos cuyo ID ya existe en lugar de fallar
+            chunk_size: Contactos por executemany
+
+        Returns:
+            Contactos insertados por cada bloque
+        """
+        query = f"""
+            INSERT {"OR IGNORE " if ignore_existing else ""}INTO campaign_contacts
+                (id, campaign_id, seq, numero, nombre, message, status, shard_key)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """
+        return self.execute_many(query, (
+            (c["id"], c["campaign_id"], c["seq"], c["numero"], c.get("nombre", ""),
+             c["processed_message"], c.get("status", "pending"), number_shard_key(c["numero"]))
+            for c in contacts
+        ), chunk_size)
+
+    def delete_campaign_contacts(self, campaign_id: str) -> int:
+        """Borrar los contactos de una campaña (reprocesar un borrador)"""
+        return self.execute_update("DELETE FROM campaign_contacts WHERE campaign_id = ?", (campaign_id,))
+
+    def iter_campaign_contacts(self, campaign_id: str, status: Optional[str] = "pending",
+                               after_seq: int = 0, shard: Optional[int] = None, shards: int = 1,
+                               chunk_size: int = DB_BULK_CHUNK_SIZE) -> Iterator[Dict]:
+        """
+        Recorrer los contactos de una campaña en el orden del archivo
+
+        Cada página es una consulta por clave (campaign_id, seq), así que las
+        actualizaciones de estado durante el recorrido no lo afectan.
+
+        Args:
+            campaign_id: ID de la campaña
+            status: Filtrar por estado (None para todos)
+            after_seq: Empezar después de esta posición
+            shard: Recorrer solo los contactos de este shard (None para todos)
+            shards: Número de shards de la campaña
+            chunk_size: Contactos por página
+
+        Returns:
+            Iterador de contactos
+        """
+        filters = ""
+        extra: Tuple = ()
+        if status:
+            filters += " AND status = ?"
+            extra += (status,)
+        if shard is not None:
+            filters += " AND shard_key % ? = ?"
+            extra += (shards, shard)
+
+        query = f"""
+            SELECT id, campaign_id, seq, numero, nombre, message AS processed_message,
+                   status, error, sent_at
+            FROM campaign_contacts
+            WHERE campaign_id = ? AND seq > ?{filters}
+            ORDER BY seq
+            LIMIT ?
+        """
+        while True:
+            rows = self.execute_query(query, (campaign_id, after_seq) + extra + (chunk_size,))
+            yield from rows
+            if len(rows) < chunk_size:
+                return
+            after_seq = rows[-1]["seq"]
+
+    def update_campaign_contacts_bulk(self, updates: Iterable[Dict],
+                                      chunk_size: int = DB_BULK_CHUNK_SIZE) -> List[int]:
+        """
+        Actualizar el estado de muchos contactos de campaña
 
-        # Total de transacciones
-        result = self.execute_query("SELECT COUNT(*) as count FROM transactions")
-        stats["total_transactions"] = result[0]["count"] if result else 0
+        Las actualizaciones repetidas de un mismo contacto se combinan
+        (gana la última), y los contactos que solo cambian de estado se
+        agrupan en un UPDATE ... WHERE id IN (...) por estado.
 
+        Args:
+            updates: Dicts con id, status y opcionalmente sent_at y error
+            chunk_size: Contactos por sentencia
+
+        Returns:
+            Contactos actualizados por cada bloque
+        """
+        latest: Dict[str, Dict] = {}
+        for update in updates:
+            latest[update["id"]] = update
+
+        plain: Dict[str, List[str]] = {}
+        detailed = []
+        for contact_id, update in latest.items():
+            if update.get("sent_at") or update.get("error"):
+                detailed.append((update["status"], update.get("sent_at"), update.get("error"), contact_id))
+            else:
+                plain.setdefault(update["status"], []).append(contact_id)
+
+        counts = []
+        with self.transaction() as connection:
+            for status, ids in plain.items():
+                for chunk in chunked(ids, chunk_size):
+                    placeholders = ",".join("?" * len(chunk))
+                    counts.append(self._run(
+                        connection,
+                        f"UPDATE campaign_contacts SET status = ? WHERE id IN ({placeholders})",
+                        (status, *chunk)
+                    ).rowcount)
+            for chunk in chunked(detailed, chunk_size):
+                counts.append(self._run(
+                    connection,
+                    """
+                    UPDATE campaign_contacts
+                    SET status = ?, sent_at = COALESCE(?, sent_at), error = ?
+                    WHERE id = ?
+                    """,
+                    chunk, many=True
+                ).rowcount)
+        return counts
+
+    def get_campaigns_by_status(self, status: str) -> List[Dict]:
+        """Obtener campañas en un estado (por ejemplo las interrumpidas en 'sending')"""
+        query = "SELECT * FROM dynamic_campaigns WHERE status = ? ORDER BY created_at"
+        return self.execute_query(query, (status,))
+
+    def acquire_campaign_lease(self, campaign_id: str, owner: str, stale_after: float) -> bool:
+        """
+        Tomar el envío de una campaña para un proceso
+
+        Se concede si nadie la tiene o si el dueño anterior dejó de latir
+        (proceso caído o redeploy). El mismo dueño no puede tomarla otra vez:
+        su latido se renueva con los checkpoints.
+
+        Args:
+            campaign_id: ID de la campaña
+            owner: Identificador del proceso
+            stale_after: Segundos sin latido tras los que el lease expira
+
+        Returns:
+            True si el proceso quedó como dueño
+        """
+        now = time.time()
+        query = """
+            UPDATE dynamic_campaigns SET owner = ?, heartbeat_at = ?
+            WHERE id = ? AND (owner IS NULL OR heartbeat_at IS NULL OR heartbeat_at < ?)
+        """
+        return self.execute_update(query, (owner, now, campaign_id, now - stale_after)) == 1
+
+    def release_campaign_lease(self, campaign_id: str, owner: str):
+        """Liberar el envío de una campaña"""
+        query = "UPDATE dynamic_campaigns SET owner = NULL WHERE id = ? AND owner = ?"
+        self.execute_update(query, (campaign_id, owner))
+
+    def reserve_rate_slot(self, name: str, interval: float, now: Optional[float] = None,
+                          slots: int = 1) -> float:
+        """
+        Reservar los siguientes turnos de un rate limit compartido
+
+        Los turnos se toman con un solo UPSERT, así que todos los procesos que
+        usan la misma base (workers del servidor y emisores) comparten el límite.
+
+        Args:
+            name: Nombre del límite
+            interval: Segundos entre turnos
+            now: Hora actual (epoch); por defecto time.time()
+            slots: Turnos consecutivos a reservar
+
+        Returns:
+            Hora (epoch) del primero de los turnos reservados
+        """
+        now = time.time() if now is None else now
+        span = interval * slots
+        query = """
+            INSERT INTO rate_limits (name, next_slot) VALUES (?, ? + ?)
+            ON CONFLICT (name) DO UPDATE SET next_slot = MAX(next_slot, ?) + ?
+            RETURNING next_slot
+        """
+        with self.transaction() as connection:
+            next_slot = self._run(connection, query, (name, now, span, now, span)).fetchone()[0]
+        return next_slot - span
+
+    def save_campaign_checkpoints_bulk(self, checkpoints: Iterable[Dict],
+                                       chunk_size: int = DB_BULK_CHUNK_SIZE) -> List[int]:
+        """
+        Guardar el cursor de envío de campañas (uno por campaña y shard)
+
+        Solo se conserva el último checkpoint de cada (campaña, shard); si
+        trae owner también renueva el latido del lease.
+
+        Args:
+            checkpoints: Dicts con campaign_id, shard, last_seq, sent, failed y owner
+            chunk_size: Filas por executemany
+
+        Returns:
+            Checkpoints escritos por cada bloque
+        """
+        latest: Dict[Tuple[str, int], Dict] = {}
+        for checkpoint in checkpoints:
+            latest[(checkpoint["campaign_id"], checkpoint.get("shard", 0))] = checkpoint
+
+        query = """
+            INSERT INTO campaign_checkpoints (campaign_id, shard, last_seq, sent, failed, updated_at)
+            VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT (campaign_id, shard) DO UPDATE SET
+                last_seq = MAX(last_seq, excluded.last_seq),
+                sent = excluded.sent,
+                failed = excluded.failed,
+                updated_at = excluded.updated_at
+        """
+        now = time.time()
+        with self.transaction() as connection:
+            counts = self.execute_many(query, (
+                (c["campaign_id"], shard, c["last_seq"], c.get("sent", 0), c.get("failed", 0))
+                for (_, shard), c in latest.items()
+            ), chunk_size)
+            beats = [(now, c["campaign_id"], c["owner"]) for c in latest.values() if c.get("owner")]
+            if beats:
+                self._run(connection, "UPDATE dynamic_campaigns SET heartbeat_at = ? WHERE id = ? AND owner = ?",
+                          beats, many=True)
+        return counts
+
+    def record_campaign_results(self, updates: Iterable[Dict], checkpoint: Dict):
+        """
+        Confirmar los estados de un lote enviado junto con el cursor de su shard
+
+        Se escriben en una sola transacción, así lo aceptado por el gateway
+        queda registrado (sin vencimiento) antes de enviar el lote siguiente.
+
+        Args:
+            updates: Dicts con id, status y opcionalmente sent_at y error
+            checkpoint: Dict con campaign_id, shard, last_seq, sent, failed y owner
+        """
+        with self.transaction():
+            self.update_campaign_contacts_bulk(updates)
+            self.save_campaign_checkpoints_bulk([checkpoint])
+
+    def get_campaign_checkpoints(self, campaign_id: str) -> List[Dict]:
+        """Obtener el cursor de envío de cada shard de una campaña"""
+        query = "SELECT * FROM campaign_checkpoints WHERE campaign_id = ? ORDER BY shard"
+        return self.execute_query(query, (campaign_id,))
+
+    def delete_campaign_checkpoints(self, campaign_id: str) -> int:
+        """Borrar los checkpoints de una campaña (reprocesar un borrador)"""
+        return self.execute_update("DELETE FROM campaign_checkpoints WHERE campaign_id = ?", (campaign_id,))
+
+    def get_campaign_progress(self, campaign_id: str) -> Optional[Dict]:
+        """
+        Progreso compartido de una campaña (sumando los checkpoints de cada shard)
+
+        Los emisores actualizan los checkpoints en lotes, así que cualquier
+        worker del servidor ve el mismo progreso con una sola lectura.
+
+        Args:
+            campaign_id: ID de la campaña
+
+        Returns:
+            Dict con status, total, sent, failed y marcas de tiempo, o None
+        """
+        query = """
+            SELECT c.id AS campaign_id, c.status, c.total, c.started_at, c.completed_at,
+                   COALESCE(SUM(k.sent), 0) AS sent, COALESCE(SUM(k.failed), 0) AS failed
+            FROM dynamic_campaigns c
+            LEFT JOIN campaign_checkpoints k ON k.campaign_id = c.id
+            WHERE c.id = ?
+            GROUP BY c.id
+        """
+        rows = self.execute_query(query, (campaign_id,))
+        return rows[0] if rows else None
+
+    def get_campaign_counts(self, campaign_id: str) -> Dict[str, int]:
+        """
+        Contar contactos de una campaña por estado
+
+        Args:
+            campaign_id: ID de la campaña
+
+        Returns:
+            Dict {estado: cantidad}
+        """
+        query = """
+            SELECT status, COUNT(*) AS total FROM campaign_contacts
+            WHERE campaign_id = ?
+            GROUP BY status
+        """
+        return {row["status"]: row["total"] for row in self.execute_query(query, (campaign_id,))}
+
+    # ==================== ESTADÍSTICAS ====================
+
+    def aggregate(self, query: AggregateQuery) -> Union[Dict, List[Dict]]:
+        """
+        Ejecutar una AggregateQuery
+
+        Args:
+            query: Consulta de agregación
+
+        Returns:
+            Un dict con los totales, o una lista de dicts si la consulta agrupa
+        """
+        rows = self.execute_query(*query.build())
+        return rows if query.groups else rows[0]
+
+    def get_statistics(self) -> Dict[str, Any]:
+        """Obtener estadísticas generales (leídas de la tabla counters)"""
+        stats = dict.fromkeys(COUNTERS, 0)
+        for row in self.execute_query("SELECT name, value FROM counters"):
+            if row["name"] in stats:
+                stats[row["name"]] = row["value"]
         return stats
 
+    def rebuild_counters(self) -> Dict[str, Any]:
+        """
+        Recalcular los contadores desde las tablas (corrige desvíos)
+
+        Returns:
+            Estadísticas recalculadas
+        """
+        with self.transaction() as connection:
+            _rebuild_counters(connection)
+        logger.info("🔢 Contadores recalculados")
+        return self.get_statistics()
+
     def cleanup_old_data(self, days: int = 30) -> int:
         """
         Limpiar datos antiguos
@@ -340,25 +2073,141 @@ class Database:
         Returns:
             Número de registros eliminados
         """
-        date_limit = f"{datetime.now().year}-{(datetime.now().month - 1):02d}-{datetime.now().day:02d}"
+        cutoff = utc_cutoff(days)
+        total = self.delete_before("sms", cutoff) + self.delete_before("reports", cutoff)
+        self.purge_orphan_bodies()
+        logger.info(f"🧹 Datos antiguos limpiados: {total} registros")
+        return total
 
-        # Limpiar SMS antiguo
-        cursor = self.connection.cursor()
-        cursor.execute("DELETE FROM sms WHERE date(sent_at) < date(?)", (date_limit,))
-        sms_count = cursor.rowcount
+    # ==================== RETENCIÓN ====================
 
-        # Limpiar reportes antiguos
-        cursor.execute("DELETE FROM reports WHERE date(created_at) < date(?)", (date_limit,))
-        reports_count = cursor.rowcount
+    def select_rowids_before(self, table: str, cutoff: str, limit: int,
+                             since: Optional[str] = None) -> List[int]:
+        """
+        Obtener el siguiente bloque de filas anteriores a una fecha
 
-        self.connection.commit()
+        Args:
+            table: Tabla de RETENTION_COLUMNS
+            cutoff: Fecha UTC límite (exclusiva)
+            limit: Filas máximas
+            since: Fecha UTC mínima (inclusiva), opcional
 
-        total = sms_count + reports_count
-        logger.info(f"🧹 Datos antiguos limpiados: {total} registros")
-        return total
+        Returns:
+            rowids de las filas más antiguas primero
+        """
+        column = RETENTION_COLUMNS[table]
+        query = f"SELECT rowid AS row_id FROM {table} WHERE {column} < ?"
+        params: Tuple = (cutoff,)
+        if since is not None:
+            query += f" AND {column} >= ?"
+            params += (since,)
+        query += f" ORDER BY {column} LIMIT ?"
+        return [row["row_id"] for row in self.execute_query(query, params + (limit,))]
+
+    def delete_rowids(self, table: str, rowids: List[int]) -> int:
+        """
+        Borrar filas por rowid (en SMS también sus destinatarios)
+
+        Args:
+            table: Tabla de RETENTION_COLUMNS
+            rowids: Filas a borrar
+
+        Returns:
+            Filas borradas de la tabla
+        """
+        placeholders = ",".join("?" * len(rowids))
+        with self.transaction() as connection:
+            if table == "sms":
+                self._run(
+                    connection,
+                    f"DELETE FROM sms_recipients WHERE sms_id IN "
+                    f"(SELECT id FROM sms WHERE rowid IN ({placeholders}))",
+                    rowids
+                )
+            return self._run(
+                connection, f"DELETE FROM {table} WHERE rowid IN ({placeholders})", rowids
+            ).rowcount
+
+    def purge_orphan_bodies(self, chunk_size: int = RETENTION_CHUNK_SIZE) -> int:
+        """
+        Borrar cuerpos de mensaje que ya ningún SMS referencia
+
+        Args:
+            chunk_size: Cuerpos por transacción
+
+        Returns:
+            Cuerpos borrados
+        """
+        deleted = 0
+        while True:
+            with self.transaction() as connection:
+                count = self._run(connection, """
+                    DELETE FROM message_bodies WHERE rowid IN (
+                        SELECT b.rowid FROM message_bodies b
+                        WHERE NOT EXISTS (SELECT 1 FROM sms WHERE sms.body_hash = b.hash)
+                        LIMIT ?
+                    )
+                """, (chunk_size,)).rowcount
+            deleted += count
+            if count < chunk_size:
+                break
+
+        if deleted:
+            logger.info(f"🧹 message_bodies: {deleted} cuerpos sin referencia eliminados")
+        return deleted
+
+    def delete_before(self, table: str, cutoff: str,
+                      chunk_size: int = RETENTION_CHUNK_SIZE,
+                      pause_ms: int = RETENTION_PAUSE_MS) -> int:
+        """
+        Borrar filas anteriores a una fecha en bloques cortos
+
+        Cada bloque es una transacción propia, de modo que los escritores
+        solo esperan lo que tarda un bloque y no todo el borrado.
+
+        Args:
+            table: Tabla de RETENTION_COLUMNS
+            cutoff: Fecha UTC límite (exclusiva)
+            chunk_size: Filas por transacción
+            pause_ms: Pausa entre bloques
+
+        Returns:
+            Filas borradas
+        """
+        deleted = 0
+        while True:
+            rowids = self.select_rowids_before(table, cutoff, chunk_size)
+            if not rowids:
+                break
+            deleted += self.delete_rowids(table, rowids)
+            if len(rowids) < chunk_size:
+                break
+            time.sleep(pause_ms / 1000)
+
+        if deleted:
+            logger.info(f"🧹 {table}: {deleted} filas anteriores a {cutoff} eliminadas")
+        return deleted
 
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "migrate":
+        # python database.py migrate [ruta.db]
+        db = Database(sys.argv[2] if len(sys.argv) > 2 else str(DB_PATH))
+        print(f"✅ Esquema en versión {db.get_schema_version()}")
+        sys.exit(0)
+
+    if len(sys.argv) > 1 and sys.argv[1] == "rebuild-counters":
+        # python database.py rebuild-counters [ruta.db]
+        db = Database(sys.argv[2] if len(sys.argv) > 2 else str(DB_PATH))
+        print(f"✅ Contadores recalculados: {db.rebuild_counters()}")
+        sys.exit(0)
+
+    if len(sys.argv) > 1 and sys.argv[1] == "rebuild-rollups":
+        # python database.py rebuild-rollups [ruta.db]
+        db = Database(sys.argv[2] if len(sys.argv) > 2 else str(DB_PATH))
+        print(f"✅ Rollups recalculados: {db.rebuild_rollups()} buckets diarios")
+        sys.exit(0)
+
     print("\n" + "="*60)
     print("🧪 PRUEBA DE BASE DE DATOS")
     print("="*60 + "\n")
@@ -3,12 +3,12 @@ EXCEL LOADER - Carga y validación de archivos Excel con contactos
 Goleador SMS Marketing - Carga de Campañas Dinámicas
 """
 
+import csv
 import logging
 import os
 import uuid
 from datetime import datetime
-from typing import Dict, List, Tuple
-import json
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
 
 try:
     from openpyxl import load_workbook
@@ -22,6 +22,7 @@ try:
 except ImportError:
     XLRD_AVAILABLE = False
 
+from config import UPLOAD_MAX_MB
 from utils import PhoneValidator
 
 logger = logging.getLogger(__name__)
@@ -31,7 +32,7 @@ class ExcelLoader:
     Cargador de archivos Excel con validación de contactos y variables dinámicas
     """
 
-    MAX_FILE_SIZE = 10 * 1024 * 1024  # 10 MB
+    MAX_FILE_SIZE = UPLOAD_MAX_MB * 1024 * 1024
     ALLOWED_EXTENSIONS = {'.xlsx', '.xls', '.csv'}
     REQUIRED_COLUMNS = {'numero', 'phone', 'cel', 'número'}
 
@@ -44,6 +45,9 @@ class ExcelLoader:
         """
         Leer archivo Excel y extraer contactos con variables
 
+        Carga todos los contactos en memoria; para archivos grandes usar
+        campaign_pipeline, que recorre las mismas etapas en streaming.
+
         Args:
             file_path: Ruta del archivo Excel
             sheet_name: Nombre de la hoja (por defecto 'Contactos')
@@ -53,81 +57,16 @@ class ExcelLoader:
         """
         logger.info(f"📖 Leyendo archivo: {file_path}")
 
-        # Validar archivo
-        validation = self.validate_file(file_path)
-        if not validation['valid']:
-            return {
-                "status": "error",
-                "message": validation['error'],
-                "errors": [validation['error']]
-            }
-
-        try:
-            # Detectar extensión
-            ext = os.path.splitext(file_path)[1].lower()
-
-            if ext == '.xlsx':
-                return self._read_xlsx(file_path, sheet_name)
-            elif ext == '.xls':
-                return self._read_xls(file_path, sheet_name)
-            elif ext == '.csv':
-                return self._read_csv(file_path)
-            else:
-                return {
-                    "status": "error",
-                    "message": f"Formato no soportado: {ext}",
-                    "errors": [f"Formato no soportado: {ext}"]
-                }
-
-        except Exception as e:
-            logger.error(f"❌ Error leyendo archivo: {str(e)}")
-            return {
-                "status": "error",
-                "message": f"Error al leer archivo: {str(e)}",
-                "errors": [str(e)]
-            }
-
-    def _read_xlsx(self, file_path: str, sheet_name: str) -> Dict:
-        """Leer archivo XLSX"""
-        if not OPENPYXL_AVAILABLE:
-            return {
-                "status": "error",
-                "message": "openpyxl no está instalado",
-                "errors": ["Instalar: pip install openpyxl"]
-            }
-
         try:
-            wb = load_workbook(file_path, data_only=True)
+            rows = self.iter_rows(file_path, sheet_name)
+            headers, phone_col = self.parse_header(next(rows, None))
 
-            # Intentar encontrar la hoja
-            if sheet_name not in wb.sheetnames:
-                sheet_name = wb.sheetnames[0]  # Usar primera hoja
-                logger.warning(f"⚠️ Hoja '{sheet_name}' no encontrada, usando: {sheet_name}")
-
-            ws = wb[sheet_name]
-
-            # Extraer encabezados
-            headers = []
-            for cell in ws[1]:
-                if cell.value:
-                    headers.append(str(cell.value).lower().strip())
-                else:
-                    headers.append(f"columna_{len(headers) + 1}")
-
-            # Validar columnas requeridas
-            phone_col = self._find_phone_column(headers)
-            if phone_col is None:
-                return {
-                    "status": "error",
-                    "message": "No se encontró columna de números de teléfono",
-                    "errors": ["Debe haber una columna: 'numero', 'phone', 'cel' o 'número'"]
-                }
-
-            # Extraer datos
             contacts = []
             errors = []
 
-            for row_idx, row in enumerate(ws.iter_rows(min_row=2, values_only=True), start=2):
+            for row_idx, row in enumerate(rows, start=2):
+                if self.is_blank(row):
+                    continue
                 contact = self._parse_row(row, headers, phone_col, row_idx, errors)
                 if contact:
                     contacts.append(contact)
@@ -135,113 +74,112 @@ class ExcelLoader:
             return self._process_results(contacts, errors, len(headers))
 
         except Exception as e:
-            logger.error(f"❌ Error en _read_xlsx: {str(e)}")
+            logger.error(f"❌ Error leyendo archivo: {str(e)}")
             return {
                 "status": "error",
                 "message": str(e),
                 "errors": [str(e)]
             }
 
-    def _read_xls(self, file_path: str, sheet_name: str) -> Dict:
+    def iter_rows(self, file_path: str, sheet_name: str = 'Contactos') -> Iterator[Sequence]:
+        """
+        Leer filas crudas del archivo sin cargarlo completo
+
+        Args:
+            file_path: Ruta del archivo (.xlsx, .xls o .csv)
+            sheet_name: Nombre de la hoja (si no existe se usa la primera)
+
+        Returns:
+            Iterador de filas; la primera es el encabezado
+
+        Raises:
+            ValueError: Archivo inválido o formato no soportado
+        """
+        validation = self.validate_file(file_path)
+        if not validation['valid']:
+            raise ValueError(validation['error'])
+
+        ext = os.path.splitext(file_path)[1].lower()
+
+        if ext == '.xlsx':
+            yield from self._iter_xlsx(file_path, sheet_name)
+        elif ext == '.xls':
+            yield from self._iter_xls(file_path, sheet_name)
+        elif ext == '.csv':
+            yield from self._iter_csv(file_path)
+        else:
+            raise ValueError(f"Formato no soportado: {ext}")
+
+    def _iter_xlsx(self, file_path: str, sheet_name: str) -> Iterator[Sequence]:
+        """Leer archivo XLSX en modo read_only (fila a fila)"""
+        if not OPENPYXL_AVAILABLE:
+            raise ValueError("openpyxl no está instalado. Instalar: pip install openpyxl")
+
+        wb = load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            # Intentar encontrar la hoja
+            if sheet_name not in wb.sheetnames:
+                logger.warning(f"⚠️ Hoja '{sheet_name}' no encontrada, usando: {wb.sheetnames[0]}")
+                sheet_name = wb.sheetnames[0]
+
+            yield from wb[sheet_name].iter_rows(values_only=True)
+        finally:
+            wb.close()
+
+    def _iter_xls(self, file_path: str, sheet_name: str) -> Iterator[Sequence]:
         """Leer archivo XLS (Excel antiguo)"""
         if not XLRD_AVAILABLE:
-            return {
-                "status": "error",
-                "message": "xlrd no está instalado",
-                "errors": ["Instalar: pip install xlrd"]
-            }
+            raise ValueError("xlrd no está instalado. Instalar: pip install xlrd")
 
+        book = xlrd.open_workbook(file_path, on_demand=True)
         try:
-            book = xlrd.open_workbook(file_path)
-
             # Intentar encontrar la hoja
             if sheet_name not in book.sheet_names():
                 sheet_name = book.sheet_names()[0]
 
             sheet = book.sheet_by_name(sheet_name)
+            for row_idx in range(sheet.nrows):
+                yield sheet.row_values(row_idx)
+        finally:
+            book.release_resources()
 
-            # Extraer encabezados
-            headers = []
-            for cell in sheet.row_values(0):
-                headers.append(str(cell).lower().strip() if cell else "")
-
-            # Validar columnas
-            phone_col = self._find_phone_column(headers)
-            if phone_col is None:
-                return {
-                    "status": "error",
-                    "message": "No se encontró columna de números",
-                    "errors": ["Debe haber: 'numero', 'phone', 'cel'"]
-                }
-
-            # Extraer datos
-            contacts = []
-            errors = []
+    def _iter_csv(self, file_path: str) -> Iterator[Sequence]:
+        """Leer archivo CSV"""
+        with open(file_path, 'r', encoding='utf-8', newline='') as f:
+            yield from csv.reader(f)
 
-            for row_idx in range(1, sheet.nrows):
-                row = sheet.row_values(row_idx)
-                contact = self._parse_row(row, headers, phone_col, row_idx + 1, errors)
-                if contact:
-                    contacts.append(contact)
+    def parse_header(self, row: Optional[Sequence]) -> Tuple[List[str], int]:
+        """
+        Normalizar encabezados y ubicar la columna de teléfono
 
-            return self._process_results(contacts, errors, len(headers))
+        Args:
+            row: Primera fila del archivo
 
-        except Exception as e:
-            logger.error(f"❌ Error en _read_xls: {str(e)}")
-            return {
-                "status": "error",
-                "message": str(e),
-                "errors": [str(e)]
-            }
+        Returns:
+            Tupla (encabezados, índice de la columna de teléfono)
 
-    def _read_csv(self, file_path: str) -> Dict:
-        """Leer archivo CSV"""
-        import csv
+        Raises:
+            ValueError: Archivo vacío o sin columna de teléfono
+        """
+        if not row:
+            raise ValueError("El archivo está vacío")
 
-        try:
-            contacts = []
-            errors = []
+        headers = [
+            str(cell).lower().strip() if cell not in (None, '') else f"columna_{idx + 1}"
+            for idx, cell in enumerate(row)
+        ]
 
-            with open(file_path, 'r', encoding='utf-8') as f:
-                reader = csv.DictReader(f)
-
-                if not reader.fieldnames:
-                    return {
-                        "status": "error",
-                        "message": "CSV vacío",
-                        "errors": ["El archivo CSV está vacío"]
-                    }
-
-                headers = [h.lower().strip() for h in reader.fieldnames]
-
-                phone_col = self._find_phone_column(headers)
-                if phone_col is None:
-                    return {
-                        "status": "error",
-                        "message": "No se encontró columna de números",
-                        "errors": ["Debe haber: 'numero', 'phone', 'cel'"]
-                    }
-
-                for row_idx, row in enumerate(reader, start=2):
-                    contact = self._parse_row(
-                        [row.get(h, '') for h in headers],
-                        headers,
-                        phone_col,
-                        row_idx,
-                        errors
-                    )
-                    if contact:
-                        contacts.append(contact)
+        phone_col = self._find_phone_column(headers)
+        if phone_col is None:
+            raise ValueError("No se encontró columna de números de teléfono. "
+                             "Debe haber una columna: 'numero', 'phone', 'cel' o 'número'")
 
-            return self._process_results(contacts, errors, len(headers))
+        return headers, phone_col
 
-        except Exception as e:
-            logger.error(f"❌ Error en _read_csv: {str(e)}")
-            return {
-                "status": "error",
-                "message": str(e),
-                "errors": [str(e)]
-            }
+    @staticmethod
+    def is_blank(row: Sequence) -> bool:
+        """Fila sin ningún valor (líneas vacías y relleno de hojas XLSX)"""
+        return all(cell in (None, '') for cell in row)
 
     def validate_file(self, file_path: str) -> Dict:
         """Validar archivo"""
@@ -262,7 +200,7 @@ class ExcelLoader:
         if size > self.MAX_FILE_SIZE:
             return {
                 "valid": False,
-                "error": f"Archivo muy grande ({size / 1024 / 1024:.1f}MB). Máximo: 10MB"
+                "error": f"Archivo muy grande ({size / 1024 / 1024:.1f}MB). Máximo: {UPLOAD_MAX_MB}MB"
             }
 
         return {"valid": True}
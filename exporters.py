@@ -5,7 +5,7 @@ CSV, Excel, PDF, JSON
 import logging
 import json
 import csv
-from typing import Dict, List, Optional
+from typing import Dict, Iterable, List, Optional
 from datetime import datetime
 from pathlib import Path
 
@@ -44,18 +44,20 @@ class ReportExporter:
 class CSVExporter(ReportExporter):
     """Exportador a CSV"""
 
-    def export_sms_report(self, data: List[Dict], filename: Optional[str] = None) -> str:
+    def export_sms_report(self, data: Iterable[Dict], filename: Optional[str] = None) -> str:
         """
         Exportar reportes de SMS a CSV
 
         Args:
-            data: Lista de diccionarios con datos de SMS
+            data: Diccionarios con datos de SMS (lista o iterador, p. ej. Database.iter_sms)
             filename: Nombre de archivo personalizado
 
         Returns:
             Ruta del archivo creado
         """
-        if not data:
+        rows = iter(data)
+        first = next(rows, None)
+        if first is None:
             logger.warning("⚠️  No hay datos para exportar")
             return ""
 
@@ -64,10 +66,12 @@ class CSVExporter(ReportExporter):
 
         try:
             with open(filepath, 'w', newline='', encoding='utf-8') as f:
-                fieldnames = data[0].keys()
+                fieldnames = first.keys()
                 writer = csv.DictWriter(f, fieldnames=fieldnames)
                 writer.writeheader()
-                writer.writerows(data)
+                writer.writerow(first)
+                # Escribir fila por fila para no materializar el iterador
+                writer.writerows(rows)
 
             logger.info(f"✅ Reporte CSV exportado: {filepath}")
             return str(filepath)
@@ -76,7 +80,7 @@ class CSVExporter(ReportExporter):
             logger.error(f"❌ Error exportando CSV: {str(e)}")
             return ""
 
-    def export_transactions(self, data: List[Dict], filename: Optional[str] = None) -> str:
+    def export_transactions(self, data: Iterable[Dict], filename: Optional[str] = None) -> str:
         """
         Exportar transacciones a CSV
 
@@ -0,0 +1,116 @@
+"""
+Claves de idempotencia para envíos de SMS
+Evita reenviar al gateway lotes que ya fueron aceptados
+"""
+import logging
+import sqlite3
+from hashlib import sha256
+from typing import Dict, Iterable, Optional
+from config import IDEMPOTENCY_TTL, IDEMPOTENCY_PENDING_TTL
+
+logger = logging.getLogger(__name__)
+
+# Código devuelto cuando otro worker está enviando el mismo lote
+DUPLICATE_IN_PROGRESS_CODE = -102
+
+
+def derive_idempotency_key(numbers: Iterable[str], content: str,
+                           sender: Optional[str] = None,
+                           sendtime: Optional[str] = None) -> str:
+    """
+    Derivar clave de idempotencia de un envío
+
+    Args:
+        numbers: Números de teléfono (el orden no importa)
+        content: Contenido del mensaje
+        sender: Remitente opcional
+        sendtime: Tiempo de envío opcional
+
+    Returns:
+        Hash hexadecimal del envío
+    """
+    digest = sha256()
+    for part in (content, sender or "", sendtime or ""):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\x1f")
+
+    for number in sorted(str(n) for n in numbers):
+        digest.update(number.encode("utf-8"))
+        digest.update(b",")
+
+    return digest.hexdigest()
+
+
+class IdempotencyStore:
+    """Registro de envíos con TTL compartido por todos los workers vía SQLite"""
+
+    def __init__(self, db, ttl: int = IDEMPOTENCY_TTL,
+                 pending_ttl: int = IDEMPOTENCY_PENDING_TTL):
+        """
+        Inicializar registro
+
+        Args:
+            db: Motor de almacenamiento donde se guardan las claves
+            ttl: Segundos que se conserva el resultado de un envío aceptado
+            pending_ttl: Segundos que dura la reserva de un envío en curso
+        """
+        self.db = db
+        self.ttl = ttl
+        self.pending_ttl = pending_ttl
+        self.replays = 0
+
+    def begin(self, key: str) -> Optional[Dict]:
+        """
+        Reservar una clave antes de enviar
+
+        Args:
+            key: Clave de idempotencia
+
+        Returns:
+            None si el envío puede continuar, o el resultado a devolver
+            si la clave ya fue usada
+        """
+        try:
+            if self.db.claim_idempotency_key(key, self.pending_ttl):
+                return None
+
+            record = self.db.get_idempotency_record(key)
+        except sqlite3.Error as e:
+            # Sin registro disponible se envía igual: es preferible a bloquear
+            logger.warning(f"⚠️  Registro de idempotencia no disponible: {str(e)}")
+            return None
+
+        if record is None:
+            # La clave venció entre la reserva y la lectura
+            return self.begin(key)
+
+        self.replays += 1
+
+        if record["status"] == "completed":
+            logger.info(f"♻️  Envío repetido, devolviendo resultado original: {key[:12]}")
+            result = dict(record["result"] or {})
+            result["idempotent_replay"] = True
+            return result
+
+        logger.warning(f"⏳ Envío duplicado en curso: {key[:12]}")
+        return {
+            "code": DUPLICATE_IN_PROGRESS_CODE,
+            "error_message": "Envío duplicado en curso",
+            "sms_count": 0,
+            "sent_ids": [],
+            "idempotent_replay": True
+        }
+
+    def complete(self, key: str, result: Dict):
+        """Guardar el resultado de un envío aceptado"""
+        try:
+            self.db.complete_idempotency_key(key, result, self.ttl)
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️  No se pudo guardar resultado idempotente: {str(e)}")
+
+    def release(self, key: str):
+        """Liberar una clave para permitir un nuevo intento"""
+        try:
+            self.db.release_idempotency_key(key)
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️  No se pudo liberar clave idempotente: {str(e)}")
@@ -6,6 +6,7 @@ import logging
 import re
 from typing import Dict, List, Tuple, Optional
 from datetime import datetime
+from template_engine import compile_template
 
 logger = logging.getLogger(__name__)
 
@@ -143,12 +144,7 @@ class MessageProcessor:
         Returns:
             Texto procesado
         """
-        result = text
-        for var_name, var_value in variables.items():
-            placeholder = f"{{{{{var_name}}}}}"
-            result = result.replace(placeholder, var_value)
-
-        return result
+        return compile_template(text).render(variables)
 
     def add_unsubscribe_link(self, text: str, code: str) -> str:
         """
@@ -293,6 +289,7 @@ class MessageTemplate:
     def __init__(self):
         """Inicializar gestor de plantillas"""
         self.templates = {}
+        self.compiled = {}
         self.processor = MessageProcessor()
 
     def register_template(self, name: str, template: str):
@@ -304,6 +301,7 @@ class MessageTemplate:
             template: Contenido de la plantilla
         """
         self.templates[name] = template
+        self.compiled[name] = compile_template(template)
         logger.info(f"📝 Plantilla registrada: {name}")
 
     def render(self, template_name: str, variables: Dict[str, str]) -> Dict:
@@ -323,16 +321,32 @@ class MessageTemplate:
                 "error": f"Plantilla no encontrada: {template_name}"
             }
 
-        template = self.templates[template_name]
-        message = self.processor.replace_variables(template, variables)
+        compiled = self.compiled[template_name]
 
         return {
             "code": 0,
             "template": template_name,
-            "message": message,
-            "variables_used": variables
+            "message": compiled.render(variables),
+            "variables_used": variables,
+            "missing_variables": compiled.missing(variables),
+            "unused_variables": compiled.unused(variables)
         }
 
+    def render_many(self, template_name: str, contacts: List[Dict[str, str]]) -> List[str]:
+        """
+        Renderizar plantilla para muchos contactos
+
+        Args:
+            template_name: Nombre de la plantilla
+            contacts: Dicts de variables (uno por contacto)
+
+        Returns:
+            Mensajes renderizados en el mismo orden
+        """
+        if template_name not in self.compiled:
+            raise KeyError(f"Plantilla no encontrada: {template_name}")
+        return list(self.compiled[template_name].render_many(contacts))
+
     def list_templates(self) -> List[str]:
         """Listar plantillas registradas"""
         return list(self.templates.keys())
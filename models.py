@@ -1,12 +1,79 @@
 """
 Modelos de datos para el sistema de SMS
 Define estructuras para SMS, Reportes, Tareas, etc.
+
+Los modelos usan __slots__, guardan los números en buffers compactos
+(array('q')) y las fechas como epoch en segundos; to_dict() los convierte
+al formato de las APIs JSON.
 """
+import time
+from array import array
+from collections import OrderedDict
 from dataclasses import dataclass, field
-from typing import Optional, List
-from datetime import datetime
+from typing import Optional, List, Callable, Iterable, Sequence, Tuple, Union, Any
+from datetime import date, datetime, timezone
 from enum import Enum
 
+# Números de un modelo: array('q') si todos son dígitos, tupla de str si no
+NumberBuffer = Union[array, Tuple[str, ...]]
+
+# Fechas de los modelos: epoch en segundos (acepta datetime o texto al crear)
+Timestamp = Optional[float]
+
+
+def pack_numbers(numbers: Union[Iterable[Any], str]) -> NumberBuffer:
+    """
+    Guardar números telefónicos en un buffer compacto
+
+    Args:
+        numbers: Números (lista, tupla o texto separado por comas)
+
+    Returns:
+        array('q') con 8 bytes por número, o una tupla de str si alguno
+        no se puede representar como entero sin perder formato
+    """
+    if isinstance(numbers, array):
+        return numbers
+    if isinstance(numbers, str):
+        numbers = numbers.split(",") if numbers else []
+
+    numbers = [n if isinstance(n, str) else str(n) for n in numbers]
+    # Un cero inicial o un '+' se perderían al convertir a entero
+    if all(n.isascii() and n.isdigit() and n[0] != "0" and len(n) <= 18 for n in numbers):
+        return array("q", map(int, numbers))
+    return tuple(numbers)
+
+
+def unpack_numbers(numbers: NumberBuffer) -> List[str]:
+    """Convertir un buffer de números a lista de str"""
+    return [str(n) for n in numbers]
+
+
+def to_epoch(value: Union[None, float, int, datetime, str]) -> Timestamp:
+    """
+    Convertir una fecha a epoch en segundos
+
+    Args:
+        value: Epoch, datetime (naive = hora local) o TIMESTAMP de SQLite (UTC)
+
+    Returns:
+        Epoch en segundos o None
+    """
+    if value is None or isinstance(value, float):
+        return value
+    if isinstance(value, datetime):
+        return value.timestamp()
+    if isinstance(value, str):
+        if not value:
+            return None
+        return datetime.fromisoformat(value).replace(tzinfo=timezone.utc).timestamp()
+    return float(value)
+
+
+def epoch_to_iso(value: Timestamp) -> Optional[str]:
+    """Formatear un epoch como ISO 8601 en hora local (formato de las APIs JSON)"""
+    return datetime.fromtimestamp(value).isoformat() if value is not None else None
+
 
 class SMSStatus(Enum):
     """Estados posibles de un SMS"""
@@ -27,18 +94,42 @@ class TaskType(Enum):
     MONTHLY = 5
 
 
-@dataclass
+@dataclass(slots=True)
 class SMS:
     """Modelo para un SMS"""
     id: str
-    numbers: List[str]
+    numbers: NumberBuffer
     content: str
     status: SMSStatus = SMSStatus.PENDING
     sender: Optional[str] = None
     sendtime: Optional[str] = None
-    sent_at: Optional[datetime] = None
+    sent_at: Timestamp = None
     delivered_count: int = 0
     failed_count: int = 0
+    account: Optional[str] = None
+
+    def __post_init__(self):
+        self.numbers = pack_numbers(self.numbers)
+        self.sent_at = to_epoch(self.sent_at)
+
+    def number_list(self) -> List[str]:
+        """Obtener los números como lista de str"""
+        return unpack_numbers(self.numbers)
+
+    def to_dict(self) -> dict:
+        """Convertir a diccionario para JSON"""
+        return {
+            "id": self.id,
+            "account": self.account,
+            "numbers": self.number_list(),
+            "content": self.content,
+            "status": self.status.value,
+            "sender": self.sender,
+            "sendtime": self.sendtime,
+            "sent_at": epoch_to_iso(self.sent_at),
+            "delivered_count": self.delivered_count,
+            "failed_count": self.failed_count
+        }
 
     def __str__(self):
         return (
@@ -47,7 +138,7 @@ class SMS:
         )
 
 
-@dataclass
+@dataclass(slots=True)
 class Report:
     """Modelo para reporte de SMS"""
     id: str
@@ -55,8 +146,26 @@ class Report:
     status: SMSStatus
     error_code: Optional[int] = None
     error_message: Optional[str] = None
-    sent_at: Optional[datetime] = None
-    delivered_at: Optional[datetime] = None
+    sent_at: Timestamp = None
+    delivered_at: Timestamp = None
+    sms_id: Optional[str] = None
+
+    def __post_init__(self):
+        self.sent_at = to_epoch(self.sent_at)
+        self.delivered_at = to_epoch(self.delivered_at)
+
+    def to_dict(self) -> dict:
+        """Convertir a diccionario para JSON"""
+        return {
+            "id": self.id,
+            "sms_id": self.sms_id,
+            "number": self.number,
+            "status": self.status.value,
+            "error_code": self.error_code,
+            "error_message": self.error_message,
+            "sent_at": epoch_to_iso(self.sent_at),
+            "delivered_at": epoch_to_iso(self.delivered_at)
+        }
 
     def __str__(self):
         return (
@@ -65,20 +174,43 @@ class Report:
         )
 
 
-@dataclass
+@dataclass(slots=True)
 class SMSTask:
     """Modelo para tarea de SMS programada"""
     id: str
     task_type: TaskType
-    contacts: List[str]
+    contacts: NumberBuffer
     content: str
     sender: Optional[str] = None
     sendtime: Optional[str] = None
     interval: Optional[int] = None
     endtime: Optional[str] = None
-    created_at: datetime = field(default_factory=datetime.now)
+    created_at: Timestamp = field(default_factory=time.time)
     status: str = "active"
 
+    def __post_init__(self):
+        self.contacts = pack_numbers(self.contacts)
+        self.created_at = to_epoch(self.created_at)
+
+    def contact_list(self) -> List[str]:
+        """Obtener los contactos como lista de str"""
+        return unpack_numbers(self.contacts)
+
+    def to_dict(self) -> dict:
+        """Convertir a diccionario para JSON"""
+        return {
+            "id": self.id,
+            "task_type": self.task_type.value,
+            "contacts": self.contact_list(),
+            "content": self.content,
+            "sender": self.sender,
+            "sendtime": self.sendtime,
+            "interval": self.interval,
+            "endtime": self.endtime,
+            "created_at": epoch_to_iso(self.created_at),
+            "status": self.status
+        }
+
     def __str__(self):
         return (
             f"Task(id={self.id}, tipo={self.task_type.name}, "
@@ -86,19 +218,32 @@ class SMSTask:
         )
 
 
-@dataclass
+@dataclass(slots=True)
 class Account:
     """Modelo para información de cuenta"""
     account: str
     balance: float
     gift_balance: float = 0.0
-    last_updated: datetime = field(default_factory=datetime.now)
+    last_updated: Timestamp = field(default_factory=time.time)
+
+    def __post_init__(self):
+        self.last_updated = to_epoch(self.last_updated)
 
     @property
     def total_balance(self) -> float:
         """Obtener balance total (saldo + regalo)"""
         return self.balance + self.gift_balance
 
+    def to_dict(self) -> dict:
+        """Convertir a diccionario para JSON"""
+        return {
+            "account": self.account,
+            "balance": self.balance,
+            "gift_balance": self.gift_balance,
+            "total_balance": self.total_balance,
+            "last_updated": epoch_to_iso(self.last_updated)
+        }
+
     def __str__(self):
         return (
             f"Account({self.account}) - "
@@ -107,17 +252,32 @@ class Account:
         )
 
 
-@dataclass
+@dataclass(slots=True)
 class TransactionLog:
     """Modelo para registro de transacciones"""
     id: str
     operation: str  # "send_sms", "get_balance", etc.
-    timestamp: datetime = field(default_factory=datetime.now)
+    timestamp: Timestamp = field(default_factory=time.time)
     sms_count: int = 0
     balance_change: float = 0.0
     status: str = "success"
     notes: Optional[str] = None
 
+    def __post_init__(self):
+        self.timestamp = to_epoch(self.timestamp)
+
+    def to_dict(self) -> dict:
+        """Convertir a diccionario para JSON"""
+        return {
+            "id": self.id,
+            "operation": self.operation,
+            "timestamp": epoch_to_iso(self.timestamp),
+            "sms_count": self.sms_count,
+            "balance_change": self.balance_change,
+            "status": self.status,
+            "notes": self.notes
+        }
+
     def __str__(self):
         return (
             f"Log(op={self.operation}, sms={self.sms_count}, "
@@ -125,40 +285,359 @@ class TransactionLog:
         )
 
 
-class DataStorage:
-    """Almacenamiento en memoria de datos (simplificado)"""
+def _parse_status(value: Optional[str]) -> SMSStatus:
+    """Convertir un estado guardado en SMSStatus (PENDING si no se reconoce)"""
+    try:
+        return SMSStatus(value)
+    except ValueError:
+        return SMSStatus.PENDING
+
+
+class Record:
+    """
+    Fila de solo lectura con __slots__ (sin dict por fila)
+
+    Las subclases son @dataclass(slots=True, repr=False, eq=False) con un
+    campo por columna de su tabla, en orden. Se puede leer como atributo
+    (record.status) o como dict (record["status"]).
+    """
+    __slots__ = ()
+
+    @classmethod
+    def factory(cls, columns: Sequence[str]) -> Callable[[Sequence[Any]], "Record"]:
+        """
+        Crear un constructor de registros para las columnas de un cursor
+
+        Args:
+            columns: Nombres de columnas en el orden del cursor
+
+        Returns:
+            Función fila -> registro (las columnas ausentes quedan en None)
+        """
+        positions = {name: index for index, name in enumerate(columns)}
+        indexes = [positions.get(name) for name in cls.__slots__]
+        # Mismas columnas y en el mismo orden: la fila se pasa tal cual
+        if len(columns) == len(cls.__slots__) and indexes == list(range(len(columns))):
+            return lambda row: cls(*row)
+        return lambda row: cls(*[None if i is None else row[i] for i in indexes])
+
+    def __getitem__(self, key: str) -> Any:
+        return getattr(self, key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """Leer una columna con valor por defecto"""
+        return getattr(self, key, default)
+
+    def to_dict(self) -> dict:
+        """Convertir a diccionario"""
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()})"
+
+
+@dataclass(slots=True, repr=False, eq=False)
+class SMSRecord(Record):
+    """Fila de SMS (leer de la vista sms_full: la tabla sms no trae el cuerpo deduplicado)"""
+    id: Optional[str] = None
+    account: Optional[str] = None
+    numbers: Optional[str] = None
+    content: Optional[str] = None
+    status: Optional[str] = None
+    sender: Optional[str] = None
+    sendtime: Optional[str] = None
+    sent_at: Optional[str] = None
+    updated_at: Optional[str] = None
+    delivered_count: Optional[int] = None
+    failed_count: Optional[int] = None
+    recipient_count: Optional[int] = None
+    body_hash: Optional[str] = None
+
+    def to_model(self) -> SMS:
+        """Convertir al modelo SMS"""
+        return SMS(
+            id=self.id,
+            numbers=self.numbers or "",
+            content=self.content,
+            status=_parse_status(self.status),
+            sender=self.sender,
+            sendtime=self.sendtime,
+            sent_at=to_epoch(self.sent_at),
+            delivered_count=self.delivered_count or 0,
+            failed_count=self.failed_count or 0,
+            account=self.account
+        )
+
+
+@dataclass(slots=True, repr=False, eq=False)
+class ReportRecord(Record):
+    """Fila de la tabla reports"""
+    id: Optional[str] = None
+    sms_id: Optional[str] = None
+    number: Optional[str] = None
+    status: Optional[str] = None
+    error_code: Optional[int] = None
+    error_message: Optional[str] = None
+    sent_at: Optional[str] = None
+    delivered_at: Optional[str] = None
+    created_at: Optional[str] = None
+
+    def to_model(self) -> Report:
+        """Convertir al modelo Report"""
+        return Report(
+            id=self.id,
+            number=self.number,
+            status=_parse_status(self.status),
+            error_code=self.error_code,
+            error_message=self.error_message,
+            sent_at=to_epoch(self.sent_at),
+            delivered_at=to_epoch(self.delivered_at),
+            sms_id=self.sms_id
+        )
+
+
+@dataclass(slots=True, repr=False, eq=False)
+class TransactionRecord(Record):
+    """Fila de la tabla transactions"""
+    id: Optional[str] = None
+    operation: Optional[str] = None
+    sms_count: Optional[int] = None
+    balance_change: Optional[float] = None
+    status: Optional[str] = None
+    notes: Optional[str] = None
+    created_at: Optional[str] = None
+
+    def to_model(self) -> TransactionLog:
+        """Convertir al modelo TransactionLog"""
+        return TransactionLog(
+            id=self.id,
+            operation=self.operation,
+            timestamp=to_epoch(self.created_at) or time.time(),
+            sms_count=self.sms_count or 0,
+            balance_change=self.balance_change or 0.0,
+            status=self.status,
+            notes=self.notes
+        )
+
+
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
 
-    def __init__(self):
-        self.sms_messages: dict[str, SMS] = {}
+
+def _epoch_day(timestamp: float) -> int:
+    """Día UTC de un epoch (días desde 1970-01-01)"""
+    return int(timestamp // 86400)
+
+
+class DataStorage:
+    """
+    Almacenamiento en memoria de datos con índices y capacidad acotada
+
+    Los SMS se guardan en orden LRU. Con max_sms se descarta el menos usado
+    al superar la capacidad y con max_age_seconds los enviados hace más de
+    ese tiempo (ni siquiera se admiten). Los reportes de un SMS descartado
+    salen con él. Los cambios de estado deben pasar por update_sms_status
+    para mantener índices y estadísticas.
+    """
+
+    def __init__(self, max_sms: Optional[int] = None,
+                 max_age_seconds: Optional[float] = None):
+        """
+        Inicializar almacenamiento
+
+        Args:
+            max_sms: SMS máximos en memoria (None = sin límite)
+            max_age_seconds: Antigüedad máxima de un SMS según sent_at (None = sin límite)
+        """
+        self.max_sms = max_sms
+        self.max_age_seconds = max_age_seconds
+        self.sms_messages: "OrderedDict[str, SMS]" = OrderedDict()
         self.reports: dict[str, Report] = {}
         self.tasks: dict[str, SMSTask] = {}
         self.account: Optional[Account] = None
         self.transaction_logs: List[TransactionLog] = []
 
-    def add_sms(self, sms: SMS):
-        """Agregar SMS al almacenamiento"""
+        # Índices secundarios
+        self.reports_by_sms: dict[str, List[str]] = {}
+        self.sms_by_status: dict[SMSStatus, set] = {status: set() for status in SMSStatus}
+        # Día UTC como número de días desde 1970-01-01
+        self.sms_by_day: dict[int, set] = {}
+
+        # Estadísticas incrementales
+        self.delivered_total = 0
+        self.delivered_reports = 0
+        self.active_tasks = 0
+        self.evicted = 0
+
+    # ==================== SMS ====================
+
+    def add_sms(self, sms: SMS) -> bool:
+        """
+        Agregar SMS al almacenamiento
+
+        Args:
+            sms: SMS a guardar (sin sent_at se toma la hora actual)
+
+        Returns:
+            False si es más antiguo que max_age_seconds y no se admitió
+        """
+        if sms.sent_at is None:
+            sms.sent_at = time.time()
+        cutoff = self._age_cutoff()
+        if cutoff and sms.sent_at < cutoff:
+            return False
+
+        if sms.id in self.sms_messages:
+            self.remove_sms(sms.id)
+
         self.sms_messages[sms.id] = sms
+        self.sms_by_status[sms.status].add(sms.id)
+        self.sms_by_day.setdefault(_epoch_day(sms.sent_at), set()).add(sms.id)
+        self.delivered_total += sms.delivered_count
+
+        if cutoff and min(self.sms_by_day) < _epoch_day(cutoff):
+            self.evict_expired()
+        while self.max_sms is not None and len(self.sms_messages) > self.max_sms:
+            self.remove_sms(next(iter(self.sms_messages)))
+            self.evicted += 1
+        return True
 
     def get_sms(self, sms_id: str) -> Optional[SMS]:
-        """Obtener SMS por ID"""
-        return self.sms_messages.get(sms_id)
+        """Obtener SMS por ID (lo marca como usado recientemente)"""
+        sms = self.sms_messages.get(sms_id)
+        if sms is None:
+            return None
+
+        cutoff = self._age_cutoff()
+        if cutoff and sms.sent_at < cutoff:
+            self.remove_sms(sms_id)
+            self.evicted += 1
+            return None
+
+        self.sms_messages.move_to_end(sms_id)
+        return sms
+
+    def update_sms_status(self, sms_id: str, status: SMSStatus,
+                          delivered: int = 0, failed: int = 0) -> bool:
+        """
+        Actualizar estado de un SMS manteniendo índices y estadísticas
+
+        Returns:
+            False si el SMS no está en memoria
+        """
+        sms = self.sms_messages.get(sms_id)
+        if sms is None:
+            return False
+
+        self.sms_by_status[sms.status].discard(sms_id)
+        self.sms_by_status[status].add(sms_id)
+        self.delivered_total += delivered - sms.delivered_count
+        sms.status = status
+        sms.delivered_count = delivered
+        sms.failed_count = failed
+        return True
+
+    def remove_sms(self, sms_id: str) -> Optional[SMS]:
+        """Quitar un SMS, sus entradas de índice y sus reportes"""
+        sms = self.sms_messages.pop(sms_id, None)
+        if sms is None:
+            return None
+
+        self.sms_by_status[sms.status].discard(sms_id)
+        day = _epoch_day(sms.sent_at)
+        bucket = self.sms_by_day.get(day)
+        if bucket is not None:
+            bucket.discard(sms_id)
+            if not bucket:
+                del self.sms_by_day[day]
+        self.delivered_total -= sms.delivered_count
+
+        for report_id in self.reports_by_sms.pop(sms_id, []):
+            report = self.reports.pop(report_id, None)
+            if report is not None and report.status == SMSStatus.DELIVERED:
+                self.delivered_reports -= 1
+        return sms
+
+    def get_sms_by_status(self, status: SMSStatus) -> List[SMS]:
+        """Obtener SMS en un estado"""
+        return [self.sms_messages[i] for i in self.sms_by_status[status]]
+
+    def get_sms_by_day(self, day: date) -> List[SMS]:
+        """Obtener SMS enviados un día (UTC)"""
+        return [self.sms_messages[i] for i in self.sms_by_day.get(day.toordinal() - _EPOCH_ORDINAL, ())]
+
+    def evict_expired(self) -> int:
+        """
+        Descartar SMS más antiguos que max_age_seconds
+
+        Returns:
+            SMS descartados
+        """
+        cutoff = self._age_cutoff()
+        if cutoff is None:
+            return 0
+
+        # Solo se revisan los días que pueden contener SMS vencidos
+        expired = [
+            sms_id
+            for day in sorted(d for d in self.sms_by_day if d <= _epoch_day(cutoff))
+            for sms_id in self.sms_by_day[day]
+            if self.sms_messages[sms_id].sent_at < cutoff
+        ]
+        for sms_id in expired:
+            self.remove_sms(sms_id)
+        self.evicted += len(expired)
+        return len(expired)
+
+    def _age_cutoff(self) -> Timestamp:
+        """Epoch antes del cual un SMS está vencido"""
+        if self.max_age_seconds is None:
+            return None
+        return time.time() - self.max_age_seconds
+
+    # ==================== REPORTES ====================
 
     def add_report(self, report: Report):
-        """Agregar reporte"""
+        """Agregar reporte (indexado por sms_id)"""
+        previous = self.reports.get(report.id)
+        if previous is None:
+            if report.sms_id is not None:
+                self.reports_by_sms.setdefault(report.sms_id, []).append(report.id)
+        elif previous.status == SMSStatus.DELIVERED:
+            self.delivered_reports -= 1
         self.reports[report.id] = report
+        if report.status == SMSStatus.DELIVERED:
+            self.delivered_reports += 1
 
     def get_reports_by_sms_id(self, sms_id: str) -> List[Report]:
         """Obtener reportes de un SMS específico"""
-        return [r for r in self.reports.values() if r.id.startswith(sms_id)]
+        return [self.reports[r] for r in self.reports_by_sms.get(sms_id, [])]
+
+    # ==================== TAREAS ====================
 
     def add_task(self, task: SMSTask):
         """Agregar tarea"""
+        previous = self.tasks.get(task.id)
+        if previous is not None and previous.status == "active":
+            self.active_tasks -= 1
         self.tasks[task.id] = task
+        if task.status == "active":
+            self.active_tasks += 1
 
     def get_task(self, task_id: str) -> Optional[SMSTask]:
         """Obtener tarea por ID"""
         return self.tasks.get(task_id)
 
+    def update_task_status(self, task_id: str, status: str) -> bool:
+        """Actualizar estado de tarea manteniendo el conteo de activas"""
+        task = self.tasks.get(task_id)
+        if task is None:
+            return False
+        self.active_tasks += (status == "active") - (task.status == "active")
+        task.status = status
+        return True
+
+    # ==================== GENERAL ====================
+
     def set_account(self, account: Account):
         """Actualizar información de cuenta"""
         self.account = account
@@ -167,23 +646,22 @@ class DataStorage:
         """Registrar transacción"""
         self.transaction_logs.append(log)
 
-    def get_statistics(self) -> dict:
-        """Obtener estadísticas generales"""
-        total_sms = len(self.sms_messages)
-        sent_sms = sum(1 for s in self.sms_messages.values()
-                      if s.status == SMSStatus.SENT)
-        failed_sms = sum(1 for s in self.sms_messages.values()
-                        if s.status == SMSStatus.FAILED)
-        delivered_count = sum(s.delivered_count for s in self.sms_messages.values())
+    def clear(self):
+        """Vaciar todo el almacenamiento"""
+        self.__init__(self.max_sms, self.max_age_seconds)
 
+    def get_statistics(self) -> dict:
+        """Obtener estadísticas generales (O(1), mantenidas al escribir)"""
         return {
-            "total_sms_messages": total_sms,
-            "sent_messages": sent_sms,
-            "failed_messages": failed_sms,
-            "total_delivered": delivered_count,
+            "total_sms_messages": len(self.sms_messages),
+            "sent_messages": len(self.sms_by_status[SMSStatus.SENT]),
+            "failed_messages": len(self.sms_by_status[SMSStatus.FAILED]),
+            "total_delivered": self.delivered_total,
+            "total_reports": len(self.reports),
+            "delivered_reports": self.delivered_reports,
             "total_transactions": len(self.transaction_logs),
-            "active_tasks": sum(1 for t in self.tasks.values()
-                              if t.status == "active")
+            "active_tasks": self.active_tasks,
+            "evicted_sms": self.evicted
         }
 
     def __str__(self):
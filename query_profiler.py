@@ -0,0 +1,188 @@
+"""
+Perfilador de consultas SQL
+Agrupa las sentencias por huella, mide su latencia y guarda el plan
+(EXPLAIN QUERY PLAN) de las que superan el umbral de lentitud
+"""
+import atexit
+import json
+import logging
+import re
+import threading
+from collections import deque
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+from config import DB_PROFILE, DB_SLOW_QUERY_MS, DB_PROFILE_DUMP
+
+logger = logging.getLogger(__name__)
+
+# Sentencias cuyo plan se puede capturar
+EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "REPLACE")
+
+# Muestras recientes por huella para calcular percentiles
+SAMPLE_SIZE = 200
+
+
+def fingerprint(query: str) -> str:
+    """
+    Normalizar una sentencia para agrupar ejecuciones equivalentes
+
+    Args:
+        query: Sentencia SQL
+
+    Returns:
+        Sentencia sin literales, con listas IN colapsadas y espacios normalizados
+    """
+    normalized = re.sub(r"'(?:[^']|'')*'", "?", query)
+    normalized = re.sub(r"\b\d+(\.\d+)?\b", "?", normalized)
+    normalized = re.sub(r"\(\s*\?(\s*,\s*\?)*\s*\)", "(?+)", normalized)
+    return " ".join(normalized.split())
+
+
+class QueryStats:
+    """Latencias acumuladas de una huella"""
+
+    def __init__(self, query: str):
+        """
+        Inicializar estadísticas
+
+        Args:
+            query: Huella de la sentencia
+        """
+        self.query = query
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.rows = 0
+        self.slow_count = 0
+        self.samples = deque(maxlen=SAMPLE_SIZE)
+        self.plan: Optional[List[str]] = None
+
+    def add(self, elapsed_ms: float, rows: int, slow: bool):
+        """Registrar una ejecución"""
+        self.count += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        self.rows += max(rows, 0)
+        self.samples.append(elapsed_ms)
+        if slow:
+            self.slow_count += 1
+
+    def to_dict(self) -> Dict:
+        """Convertir a diccionario"""
+        ordered = sorted(self.samples)
+        p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] if ordered else 0
+        return {
+            "query": self.query,
+            "count": self.count,
+            "total_ms": round(self.total_ms, 3),
+            "avg_ms": round(self.total_ms / self.count, 3) if self.count else 0,
+            "p95_ms": round(p95, 3),
+            "max_ms": round(self.max_ms, 3),
+            "rows": self.rows,
+            "slow_count": self.slow_count,
+            "plan": self.plan
+        }
+
+
+class QueryProfiler:
+    """Perfilador opcional de sentencias SQL"""
+
+    def __init__(self, enabled: bool = DB_PROFILE, slow_query_ms: float = DB_SLOW_QUERY_MS):
+        """
+        Inicializar perfilador
+
+        Args:
+            enabled: Medir sentencias (desactivado no tiene costo)
+            slow_query_ms: Umbral a partir del cual se captura el plan
+        """
+        self.enabled = enabled
+        self.slow_query_ms = slow_query_ms
+        self.stats: Dict[str, QueryStats] = {}
+        self.lock = threading.Lock()
+        self.started_at = datetime.now()
+
+    def record(self, query: str, elapsed_ms: float, rows: int = 0,
+               explain: Optional[Callable[[], List[str]]] = None):
+        """
+        Registrar la ejecución de una sentencia
+
+        Args:
+            query: Sentencia SQL ejecutada
+            elapsed_ms: Duración en milisegundos
+            rows: Filas afectadas o leídas
+            explain: Función que devuelve el plan (se llama solo si es lenta)
+        """
+        key = fingerprint(query)
+        slow = elapsed_ms >= self.slow_query_ms
+
+        with self.lock:
+            stats = self.stats.get(key)
+            if stats is None:
+                stats = self.stats[key] = QueryStats(key)
+            stats.add(elapsed_ms, rows, slow)
+            needs_plan = slow and stats.plan is None
+
+        if not slow:
+            return
+
+        logger.warning(f"🐢 Consulta lenta ({elapsed_ms:.1f} ms): {key[:200]}")
+        if needs_plan and explain and key.split(" ", 1)[0].upper() in EXPLAINABLE:
+            try:
+                stats.plan = explain()
+            except Exception as e:
+                stats.plan = [f"EXPLAIN no disponible: {str(e)}"]
+
+    def get_report(self, sort_by: str = "total_ms", limit: int = 50) -> Dict:
+        """
+        Obtener las sentencias más costosas
+
+        Args:
+            sort_by: Campo de orden (total_ms, avg_ms, p95_ms, max_ms, count)
+            limit: Sentencias a incluir
+
+        Returns:
+            Reporte del perfilador
+        """
+        with self.lock:
+            queries = [stats.to_dict() for stats in self.stats.values()]
+
+        queries.sort(key=lambda q: q.get(sort_by, 0), reverse=True)
+        return {
+            "enabled": self.enabled,
+            "slow_query_ms": self.slow_query_ms,
+            "since": self.started_at.isoformat(),
+            "statements": len(queries),
+            "queries": queries[:limit]
+        }
+
+    def dump(self, path: str) -> str:
+        """
+        Guardar el reporte completo en un archivo JSON
+
+        Args:
+            path: Ruta del archivo
+
+        Returns:
+            Ruta escrita
+        """
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.get_report(limit=len(self.stats)), f, indent=2, ensure_ascii=False)
+        logger.info(f"💾 Perfil de consultas guardado: {path}")
+        return path
+
+    def reset(self):
+        """Borrar las estadísticas acumuladas"""
+        with self.lock:
+            self.stats.clear()
+            self.started_at = datetime.now()
+
+
+# Perfilador compartido por todas las instancias de Database del proceso
+profiler = QueryProfiler()
+
+
+@atexit.register
+def _dump_on_exit():
+    """Guardar el perfil al terminar si se configuró DB_PROFILE_DUMP"""
+    if profiler.enabled and DB_PROFILE_DUMP and profiler.stats:
+        profiler.dump(DB_PROFILE_DUMP)
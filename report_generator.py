@@ -5,8 +5,8 @@ Crea reportes detallados, resúmenes y análisis
 import logging
 from typing import List, Dict, Optional, Tuple
 from datetime import datetime, timedelta
-from database import Database
-from config import ERROR_CODES
+from database import Database, AggregateQuery, utc_cutoff
+from config import ERROR_CODES, REPORT_DETAILS_LIMIT, REPORT_DETAILS_MAX
 
 logger = logging.getLogger(__name__)
 
@@ -16,26 +16,71 @@ class ReportGenerator:
 
     def __init__(self):
         """Inicializar generador"""
-        self.db = Database()
+        self.db = Database(read_only=True)
 
-    def generate_sms_report(self, limit: int = 100) -> Dict:
+    @staticmethod
+    def _details_page(total: int, offset: int, details_limit: Optional[int]) -> Tuple[int, int]:
+        """
+        Calcular la página de detalle dentro de la ventana del reporte
+
+        Args:
+            total: Filas de la ventana (las que suman los totales)
+            offset: Filas de la ventana a saltar
+            details_limit: Filas por página (None = REPORT_DETAILS_LIMIT, 0 = ninguna)
+
+        Returns:
+            Tupla (offset, filas a leer)
+        """
+        if details_limit is None:
+            details_limit = REPORT_DETAILS_LIMIT
+        details_limit = max(0, min(details_limit, REPORT_DETAILS_MAX))
+        offset = max(offset, 0)
+        return offset, max(0, min(details_limit, total - offset))
+
+    @staticmethod
+    def _page_info(total: int, offset: int, details: List[Dict]) -> Dict:
+        """Describir la página de detalle devuelta (next_offset None si no hay más)"""
+        end = offset + len(details)
+        return {
+            "offset": offset,
+            "limit": len(details),
+            "next_offset": end if details and end < total else None
+        }
+
+    def generate_sms_report(self, limit: int = 100, details_limit: Optional[int] = None,
+                            offset: int = 0) -> Dict:
         """
         Generar reporte de SMS
 
+        Los totales cubren los últimos `limit` SMS; el detalle es solo una
+        página de esa ventana.
+
         Args:
             limit: Límite de SMS a incluir
+            details_limit: SMS de detalle por página (None = REPORT_DETAILS_LIMIT, 0 = solo totales)
+            offset: SMS de la ventana a saltar en el detalle
 
         Returns:
             Reporte completo
         """
         logger.info(f"📊 Generando reporte de SMS (últimos {limit})...")
 
-        sms_list = self.db.get_all_sms(limit=limit)
+        totals = self.db.aggregate(
+            AggregateQuery("sms")
+            .count("total")
+            .count_where("sent", "status = ?", "sent")
+            .count_where("failed", "status = ?", "failed")
+            .sum("total_numbers", "recipient_count")
+            .latest("sent_at", limit)
+        )
 
-        total = len(sms_list)
-        sent = sum(1 for s in sms_list if s['status'] == 'sent')
-        failed = sum(1 for s in sms_list if s['status'] == 'failed')
-        total_numbers = sum(len(s['numbers'].split(',')) for s in sms_list)
+        total = totals["total"]
+        sent = totals["sent"]
+        failed = totals["failed"]
+        total_numbers = totals["total_numbers"]
+
+        offset, page_size = self._details_page(total, offset, details_limit)
+        sms_list = self.db.get_all_sms(limit=page_size, offset=offset) if page_size else []
 
         report = {
             "title": "Reporte de SMS Enviados",
@@ -47,32 +92,60 @@ class ReportGenerator:
                 "success_rate": (sent / total * 100) if total > 0 else 0,
                 "total_numbers": total_numbers
             },
-            "details": sms_list
+            "details": sms_list,
+            "page": self._page_info(total, offset, sms_list)
         }
 
         logger.info(f"✅ Reporte generado: {total} SMS, éxito: {report['summary']['success_rate']:.2f}%")
         return report
 
-    def generate_delivery_report(self, sms_id: Optional[str] = None) -> Dict:
+    def generate_delivery_report(self, sms_id: Optional[str] = None, limit: int = 1000,
+                                 details_limit: Optional[int] = None, offset: int = 0) -> Dict:
         """
         Generar reporte de entrega
 
+        Los totales cubren todos los reportes del SMS (o los últimos `limit`
+        si no se indica uno); el detalle es solo una página de esa ventana.
+
         Args:
             sms_id: ID específico de SMS (si None, todos)
+            limit: Últimos reportes a incluir cuando no se indica sms_id
+            details_limit: Reportes de detalle por página (None = REPORT_DETAILS_LIMIT, 0 = solo totales)
+            offset: Reportes de la ventana a saltar en el detalle
 
         Returns:
             Reporte de entrega
         """
         logger.info(f"📋 Generando reporte de entrega...")
 
+        query = (
+            AggregateQuery("reports")
+            .count("total")
+            .count_where("delivered", "status = ?", "delivered")
+            .count_where("failed", "status = ?", "failed")
+        )
         if sms_id:
-            reports = self.db.get_reports_by_sms(sms_id)
+            query.where("sms_id = ?", sms_id)
         else:
-            reports = self.db.execute_query("SELECT * FROM reports ORDER BY created_at DESC LIMIT 1000")
-
-        delivered = sum(1 for r in reports if r['status'] == 'delivered')
-        failed = sum(1 for r in reports if r['status'] == 'failed')
-        total = len(reports)
+            query.latest("created_at", limit)
+
+        totals = self.db.aggregate(query)
+        delivered = totals["delivered"]
+        failed = totals["failed"]
+        total = totals["total"]
+
+        offset, page_size = self._details_page(total, offset, details_limit)
+        reports = []
+        if page_size and sms_id:
+            reports = self.db.execute_query(
+                "SELECT * FROM reports WHERE sms_id = ? ORDER BY created_at DESC, rowid DESC LIMIT ? OFFSET ?",
+                (sms_id, page_size, offset)
+            )
+        elif page_size:
+            reports = self.db.execute_query(
+                "SELECT * FROM reports ORDER BY created_at DESC, rowid DESC LIMIT ? OFFSET ?",
+                (page_size, offset)
+            )
 
         return {
             "title": "Reporte de Entrega",
@@ -83,7 +156,8 @@ class ReportGenerator:
                 "failed": failed,
                 "delivery_rate": (delivered / total * 100) if total > 0 else 0
             },
-            "details": reports
+            "details": reports,
+            "page": self._page_info(total, offset, reports)
         }
 
     def generate_transaction_report(self, days: int = 30) -> Dict:
@@ -98,12 +172,21 @@ class ReportGenerator:
         """
         logger.info(f"💰 Generando reporte de transacciones (últimos {days} días)...")
 
-        transactions = self.db.get_transactions(limit=1000)
+        since = utc_cutoff(days)
+        transactions = self.db.get_transactions(limit=1000, since=since)
+        totals = self.db.aggregate(
+            AggregateQuery("transactions")
+            .count("total")
+            .count_where("successful", "status = ?", "success")
+            .count_where("failed", "status = ?", "failed")
+            .sum("total_sms", "CAST(sms_count AS INTEGER)")
+            .since("created_at", since)
+        )
 
-        total = len(transactions)
-        successful = sum(1 for t in transactions if t['status'] == 'success')
-        failed = sum(1 for t in transactions if t['status'] == 'failed')
-        total_sms = sum(int(t['sms_count']) for t in transactions)
+        total = totals["total"]
+        successful = totals["successful"]
+        failed = totals["failed"]
+        total_sms = totals["total_sms"]
 
         return {
             "title": "Reporte de Transacciones",
@@ -207,20 +290,15 @@ class ReportGenerator:
         logger.info(f"📊 Comparando períodos: {period1_days} vs {period2_days} días...")
 
         now = datetime.now()
-        period1_date = (now - timedelta(days=period1_days)).date()
-        period2_date = (now - timedelta(days=period2_days)).date()
+        period1_date = (now - timedelta(days=period1_days)).date().isoformat()
+        period2_date = (now - timedelta(days=period2_days)).date().isoformat()
 
-        # Obtener transacciones de cada período
-        all_transactions = self.db.get_transactions(limit=10000)
+        # Totales de cada período desde los rollups diarios
+        period1 = self.db.get_period_totals(period1_date)
+        period2 = self.db.get_period_totals(period2_date, period1_date)
 
-        period1 = [t for t in all_transactions if
-                  datetime.fromisoformat(t['created_at']).date() >= period1_date]
-        period2 = [t for t in all_transactions if
-                  datetime.fromisoformat(t['created_at']).date() >= period2_date and
-                  datetime.fromisoformat(t['created_at']).date() < period1_date]
-
-        p1_sms = sum(int(t['sms_count']) for t in period1)
-        p2_sms = sum(int(t['sms_count']) for t in period2)
+        p1_sms = period1["sms"]
+        p2_sms = period2["sms"]
 
         growth = ((p1_sms - p2_sms) / p2_sms * 100) if p2_sms > 0 else 0
 
@@ -229,12 +307,12 @@ class ReportGenerator:
             "generated_at": datetime.now().isoformat(),
             "period1": {
                 "days": period1_days,
-                "transactions": len(period1),
+                "transactions": period1["transactions"],
                 "sms_count": p1_sms
             },
             "period2": {
                 "days": period2_days,
-                "transactions": len(period2),
+                "transactions": period2["transactions"],
                 "sms_count": p2_sms
             },
             "comparison": {
@@ -250,7 +328,7 @@ class ErrorAnalyzer:
 
     def __init__(self):
         """Inicializar analizador"""
-        self.db = Database()
+        self.db = Database(read_only=True)
 
     def analyze_failures(self, limit: int = 1000) -> Dict:
         """
@@ -264,19 +342,16 @@ class ErrorAnalyzer:
         """
         logger.info("🔍 Analizando fallos...")
 
-        reports = self.db.execute_query(
-            "SELECT * FROM reports WHERE status = 'failed' ORDER BY created_at DESC LIMIT ?",
-            (limit,)
+        rows = self.db.aggregate(
+            AggregateQuery("reports")
+            .count("count")
+            .where("status = ?", "failed")
+            .latest("created_at", limit)
+            .group_by("error_code")
         )
 
-        error_codes = {}
-        for report in reports:
-            code = report.get('error_code')
-            if code not in error_codes:
-                error_codes[code] = 0
-            error_codes[code] += 1
-
-        total_failures = len(reports)
+        error_codes = {row["error_code"]: row["count"] for row in rows}
+        total_failures = sum(error_codes.values())
 
         return {
             "title": "Análisis de Fallos",
@@ -0,0 +1,284 @@
+"""
+Retención del historial
+Borra en bloques lo que supera el período de retención, opcionalmente
+moviéndolo a archivos mensuales (sms_AAAA_MM.db) consultables con ATTACH
+"""
+import logging
+import re
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+from database import Database, RETENTION_COLUMNS, utc_cutoff
+from config import (
+    ARCHIVE_DIR,
+    RETENTION_DAYS,
+    RETENTION_CHUNK_SIZE,
+    RETENTION_PAUSE_MS
+)
+
+logger = logging.getLogger(__name__)
+
+# Tablas que se purgan por defecto (las mismas que cleanup_old_data)
+DEFAULT_TABLES = ("sms", "reports")
+
+
+def month_bounds(timestamp: str) -> Tuple[str, str]:
+    """
+    Obtener el inicio del mes de una fecha y el del mes siguiente
+
+    Args:
+        timestamp: Fecha 'AAAA-MM-DD ...'
+
+    Returns:
+        Tupla (inicio, inicio del mes siguiente) en formato de CURRENT_TIMESTAMP
+    """
+    year, month = int(timestamp[:4]), int(timestamp[5:7])
+    next_year, next_month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return f"{year:04d}-{month:02d}-01 00:00:00", f"{next_year:04d}-{next_month:02d}-01 00:00:00"
+
+
+class RetentionManager:
+    """Retención por bloques con archivo mensual opcional"""
+
+    def __init__(self, db: Optional[Database] = None, archive_dir: str = ARCHIVE_DIR,
+                 chunk_size: int = RETENTION_CHUNK_SIZE,
+                 pause_ms: int = RETENTION_PAUSE_MS):
+        """
+        Inicializar gestor
+
+        Args:
+            db: Base de datos principal
+            archive_dir: Directorio de los archivos mensuales
+            chunk_size: Filas por transacción
+            pause_ms: Pausa entre bloques
+        """
+        self.db = db or Database()
+        self.archive_dir = Path(archive_dir)
+        self.chunk_size = chunk_size
+        self.pause_ms = pause_ms
+
+    # ==================== PURGA ====================
+
+    def purge(self, days: int = RETENTION_DAYS, tables: Iterable[str] = DEFAULT_TABLES,
+              archive: bool = False, vacuum: bool = True) -> Dict[str, int]:
+        """
+        Aplicar la retención
+
+        Args:
+            days: Días a conservar en la base principal
+            tables: Tablas de RETENTION_COLUMNS a purgar
+            archive: Mover las filas a archivos mensuales en lugar de solo borrarlas
+            vacuum: Devolver al sistema las páginas liberadas
+
+        Returns:
+            Filas retiradas por tabla
+        """
+        cutoff = utc_cutoff(days)
+        logger.info(f"🧹 Aplicando retención: anteriores a {cutoff} (archivar={archive})")
+
+        removed = {}
+        for table in tables:
+            if archive:
+                removed[table] = self.archive_before(table, cutoff)
+            else:
+                removed[table] = self.db.delete_before(
+                    table, cutoff, self.chunk_size, self.pause_ms
+                )
+
+        if "sms" in removed:
+            self.db.purge_orphan_bodies(self.chunk_size)
+
+        if vacuum:
+            self.incremental_vacuum()
+
+        logger.info(f"✅ Retención aplicada: {removed}")
+        return removed
+
+    # ==================== ARCHIVO MENSUAL ====================
+
+    def archive_path(self, month: str) -> Path:
+        """Ruta del archivo de un mes ('AAAA_MM')"""
+        return self.archive_dir / f"sms_{month}.db"
+
+    def list_archives(self) -> List[str]:
+        """Meses archivados disponibles ('AAAA_MM'), del más antiguo al más reciente"""
+        if not self.archive_dir.exists():
+            return []
+        return sorted(p.stem[len("sms_"):] for p in self.archive_dir.glob("sms_*.db"))
+
+    def archive_before(self, table: str, cutoff: str) -> int:
+        """
+        Mover a los archivos mensuales las filas anteriores a una fecha
+
+        Args:
+            table: Tabla de RETENTION_COLUMNS
+            cutoff: Fecha UTC límite (exclusiva)
+
+        Returns:
+            Filas movidas
+        """
+        column = RETENTION_COLUMNS[table]
+        moved = 0
+        while True:
+            oldest = self.db.connection.execute(
+                f"SELECT MIN({column}) FROM {table} WHERE {column} < ?", (cutoff,)
+            ).fetchone()[0]
+            if oldest is None:
+                break
+
+            start, end = month_bounds(oldest)
+            moved += self._archive_range(table, start, min(end, cutoff))
+
+        return moved
+
+    def _archive_range(self, table: str, start: str, end: str) -> int:
+        """Mover un rango dentro de un mismo mes, bloque por bloque"""
+        month = start[:7].replace("-", "_")
+        moved = 0
+        with self.attached(month, create=True) as alias:
+            self._ensure_archive_table(alias, table)
+            if table == "sms":
+                self._ensure_archive_table(alias, "sms_recipients")
+                self._ensure_archive_table(alias, "message_bodies")
+            columns = self._columns(table)
+
+            while True:
+                rowids = self.db.select_rowids_before(table, end, self.chunk_size, since=start)
+                if not rowids:
+                    break
+
+                placeholders = ",".join("?" * len(rowids))
+                with self.db.transaction() as connection:
+                    # OR IGNORE: si un bloque se interrumpe, repetirlo no duplica filas
+                    connection.execute(
+                        f"INSERT OR IGNORE INTO {alias}.{table} ({columns}) "
+                        f"SELECT {columns} FROM main.{table} "
+                        f"WHERE rowid IN ({placeholders})",
+                        rowids
+                    )
+                    if table == "sms":
+                        connection.execute(
+                            f"INSERT OR IGNORE INTO {alias}.sms_recipients "
+                            f"SELECT * FROM main.sms_recipients WHERE sms_id IN "
+                            f"(SELECT id FROM main.sms WHERE rowid IN ({placeholders}))",
+                            rowids
+                        )
+                        # El archivo debe poder leer el texto sin la base principal
+                        connection.execute(
+                            f"INSERT OR IGNORE INTO {alias}.message_bodies "
+                            f"SELECT * FROM main.message_bodies WHERE hash IN "
+                            f"(SELECT body_hash FROM main.sms WHERE rowid IN ({placeholders}))",
+                            rowids
+                        )
+                    moved += self.db.delete_rowids(table, rowids)
+
+                if len(rowids) < self.chunk_size:
+                    break
+                time.sleep(self.pause_ms / 1000)
+
+        if moved:
+            logger.info(f"📦 {table}: {moved} filas archivadas en {self.archive_path(month)}")
+        return moved
+
+    @contextmanager
+    def attached(self, month: str, create: bool = False):
+        """
+        Adjuntar el archivo de un mes a la conexión del hilo actual
+
+        Ejemplo:
+            with retention.attached("2026_09") as alias:
+                # El cuerpo deduplicado está en message_bodies del archivo
+                db.execute_query(
+                    f"SELECT s.id, COALESCE(b.content, s.content) AS content "
+                    f"FROM {alias}.sms s LEFT JOIN {alias}.message_bodies b ON b.hash = s.body_hash"
+                )
+
+        Args:
+            month: Mes 'AAAA_MM'
+            create: Crear el archivo si no existe
+
+        Returns:
+            Alias del esquema adjunto (sms_AAAA_MM)
+        """
+        datetime.strptime(month, "%Y_%m")  # valida el formato antes de armar SQL
+        path = self.archive_path(month)
+        if not path.exists():
+            if not create:
+                raise FileNotFoundError(f"Mes no archivado: {month}")
+            self.archive_dir.mkdir(parents=True, exist_ok=True)
+
+        alias = f"sms_{month}"
+        connection = self.db.connection
+        connection.execute("ATTACH DATABASE ? AS " + alias, (str(path),))
+        try:
+            yield alias
+        finally:
+            connection.execute(f"DETACH DATABASE {alias}")
+
+    def _columns(self, table: str, schema: str = "main") -> str:
+        """Columnas de una tabla separadas por comas"""
+        rows = self.db.connection.execute(f"PRAGMA {schema}.table_info({table})").fetchall()
+        return ", ".join(row[1] for row in rows)
+
+    def _ensure_archive_table(self, alias: str, table: str):
+        """Crear la tabla en el archivo con el esquema actual (o agregarle columnas nuevas)"""
+        connection = self.db.connection
+        sql = connection.execute(
+            "SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = ?", (table,)
+        ).fetchone()[0]
+        connection.execute(re.sub(
+            r"^CREATE TABLE (IF NOT EXISTS )?", f"CREATE TABLE IF NOT EXISTS {alias}.", sql
+        ))
+
+        # Un archivo viejo puede no tener columnas agregadas por migraciones posteriores
+        archived = {row[1] for row in connection.execute(f"PRAGMA {alias}.table_info({table})")}
+        for row in connection.execute(f"PRAGMA main.table_info({table})").fetchall():
+            if row[1] not in archived:
+                connection.execute(f"ALTER TABLE {alias}.{table} ADD COLUMN {row[1]} {row[2]}")
+
+    # ==================== VACUUM ====================
+
+    def incremental_vacuum(self, max_pages: Optional[int] = None) -> int:
+        """
+        Devolver al sistema páginas libres sin bloquear la base completa
+
+        Args:
+            max_pages: Páginas máximas a liberar (None = todas)
+
+        Returns:
+            Páginas liberadas
+        """
+        connection = self.db.connection
+        if connection.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            logger.warning("⚠️  auto_vacuum no es INCREMENTAL; ejecutar enable_incremental_vacuum()")
+            return 0
+
+        before = connection.execute("PRAGMA freelist_count").fetchone()[0]
+        pages = "" if max_pages is None else f"({int(max_pages)})"
+        connection.execute(f"PRAGMA incremental_vacuum{pages}").fetchall()
+        freed = before - connection.execute("PRAGMA freelist_count").fetchone()[0]
+        logger.info(f"🗜️  Vacuum incremental: {freed} páginas liberadas")
+        return freed
+
+    def enable_incremental_vacuum(self):
+        """Activar auto_vacuum=INCREMENTAL en una base creada antes (requiere un VACUUM completo)"""
+        connection = self.db.connection
+        if connection.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            return
+        logger.info("🗜️  Activando vacuum incremental (VACUUM completo, una sola vez)...")
+        connection.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        connection.execute("VACUUM")
+
+
+if __name__ == "__main__":
+    # python retention.py [días] [--archive]
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    days = int(args[0]) if args else RETENTION_DAYS
+
+    logging.basicConfig(level=logging.INFO)
+    manager = RetentionManager()
+    print(f"✅ Retención aplicada: {manager.purge(days, archive='--archive' in sys.argv)}")
+    print(f"📦 Meses archivados: {manager.list_archives()}")
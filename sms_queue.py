@@ -5,12 +5,15 @@ Procesa SMS de forma asincrónica y controlada
 import logging
 import time
 from typing import List, Dict, Optional, Callable
-from datetime import datetime
 from uuid import uuid4
 from dataclasses import dataclass, field
 from enum import Enum
 from queue import Queue, PriorityQueue
 import threading
+from cache import Cache
+from models import NumberBuffer, Timestamp, pack_numbers, unpack_numbers, epoch_to_iso
+from config import IDEMPOTENCY_TTL
+from idempotency import derive_idempotency_key
 
 logger = logging.getLogger(__name__)
 
@@ -23,22 +26,30 @@ class SMSPriority(Enum):
     URGENT = 0
 
 
-@dataclass
+@dataclass(slots=True)
 class SMSTask:
-    """Tarea de SMS en la cola"""
+    """Tarea de SMS en la cola (números en array('q'), fechas en epoch)"""
     id: str
-    numbers: List[str]
+    numbers: NumberBuffer
     content: str
     sender: Optional[str] = None
     sendtime: Optional[str] = None
     priority: SMSPriority = SMSPriority.NORMAL
-    created_at: datetime = field(default_factory=datetime.now)
-    started_at: Optional[datetime] = None
-    completed_at: Optional[datetime] = None
+    created_at: Timestamp = field(default_factory=time.time)
+    started_at: Timestamp = None
+    completed_at: Timestamp = None
     status: str = "pending"  # pending, processing, completed, failed, retry
     attempts: int = 0
     max_attempts: int = 3
     result: Optional[Dict] = None
+    idempotency_key: Optional[str] = None
+
+    def __post_init__(self):
+        self.numbers = pack_numbers(self.numbers)
+
+    def number_list(self) -> List[str]:
+        """Obtener los números como lista de str"""
+        return unpack_numbers(self.numbers)
 
     def __lt__(self, other):
         """Comparación para priority queue"""
@@ -72,6 +83,8 @@ class SMSQueue:
         self.send_callback: Optional[Callable] = None
         self.rate_limit = None  # SMS por segundo
         self.last_send_time = 0
+        # Claves de idempotencia recientes -> ID de tarea
+        self.recent_keys = Cache(max_size=max_queue_size, default_ttl=IDEMPOTENCY_TTL)
 
     def set_send_callback(self, callback: Callable):
         """
@@ -102,7 +115,8 @@ class SMSQueue:
             return False
 
     def enqueue_sms(self, numbers: List[str], content: str,
-                   sender: Optional[str] = None, priority: SMSPriority = SMSPriority.NORMAL) -> str:
+                   sender: Optional[str] = None, priority: SMSPriority = SMSPriority.NORMAL,
+                   idempotency_key: Optional[str] = None) -> str:
         """
         Crear y enqueuer tarea SMS
 
@@ -111,19 +125,29 @@ class SMSQueue:
             content: Contenido
             sender: Remitente
             priority: Prioridad
+            idempotency_key: Clave del envío (se deriva del contenido si es None)
 
         Returns:
-            ID de la tarea
+            ID de la tarea (el de la tarea original si es un duplicado)
         """
+        key = idempotency_key or derive_idempotency_key(numbers, content, sender)
+
+        existing_id = self.recent_keys.get(key)
+        if existing_id:
+            logger.info(f"♻️  Tarea duplicada, se reutiliza: {existing_id}")
+            return existing_id
+
         task = SMSTask(
             id=str(uuid4()),
             numbers=numbers,
             content=content,
             sender=sender,
-            priority=priority
+            priority=priority,
+            idempotency_key=idempotency_key
         )
 
         if self.enqueue(task):
+            self.recent_keys.set(key, task.id)
             return task.id
         return ""
 
@@ -189,7 +213,7 @@ class SMSQueue:
         logger.info(f"⚙️  Procesando: {task.id}")
 
         task.status = "processing"
-        task.started_at = datetime.now()
+        task.started_at = time.time()
         task.attempts += 1
 
         self.processing_queue[task.id] = task
@@ -198,12 +222,18 @@ class SMSQueue:
             if not self.send_callback:
                 raise Exception("Callback de envío no configurado")
 
-            # Llamar a la función de envío
+            # Llamar a la función de envío; la clave derivada la recalcula el
+            # propio sender, solo se propaga una clave explícita
+            kwargs = {}
+            if task.idempotency_key:
+                kwargs["idempotency_key"] = task.idempotency_key
+
             result = self.send_callback(
-                numbers=task.numbers,
+                numbers=task.number_list(),
                 content=task.content,
                 sender=task.sender,
-                sendtime=task.sendtime
+                sendtime=task.sendtime,
+                **kwargs
             )
 
             task.result = result
@@ -226,9 +256,14 @@ class SMSQueue:
             else:
                 task.status = "failed"
                 self.failed_queue.append(task)
+                # Permitir que un nuevo enqueue del mismo envío vuelva a intentarlo
+                self.recent_keys.delete(
+                    task.idempotency_key or
+                    derive_idempotency_key(task.number_list(), task.content, task.sender)
+                )
 
         finally:
-            task.completed_at = datetime.now()
+            task.completed_at = time.time()
             if task.id in self.processing_queue:
                 del self.processing_queue[task.id]
 
@@ -275,7 +310,7 @@ class SMSQueue:
                 "id": task.id,
                 "status": task.status,
                 "attempts": task.attempts,
-                "started_at": task.started_at.isoformat() if task.started_at else None
+                "started_at": epoch_to_iso(task.started_at)
             }
 
         # Buscar en completadas
@@ -285,7 +320,7 @@ class SMSQueue:
                     "id": task.id,
                     "status": task.status,
                     "attempts": task.attempts,
-                    "completed_at": task.completed_at.isoformat() if task.completed_at else None,
+                    "completed_at": epoch_to_iso(task.completed_at),
                     "result": task.result
                 }
 
@@ -296,7 +331,7 @@ class SMSQueue:
                     "id": task.id,
                     "status": task.status,
                     "attempts": task.attempts,
-                    "completed_at": task.completed_at.isoformat() if task.completed_at else None,
+                    "completed_at": epoch_to_iso(task.completed_at),
                     "result": task.result
                 }
 
@@ -318,7 +353,7 @@ class SMSQueue:
                 "status": t.status,
                 "numbers": len(t.numbers),
                 "attempts": t.attempts,
-                "completed_at": t.completed_at.isoformat() if t.completed_at else None
+                "completed_at": epoch_to_iso(t.completed_at)
             }
             for t in self.completed_queue[-limit:]
         ]
@@ -3,14 +3,16 @@ Gestor completo de envío de SMS
 Maneja validación, fragmentación, cola y reintentos
 """
 import logging
-from typing import List, Dict, Optional, Tuple
+from collections import deque
+from typing import List, Dict, Optional, Tuple, Iterable, Iterator
 from datetime import datetime
 from uuid import uuid4
 from traffilink_api import TrafficLinkAPI
 from utils import PhoneValidator, MessageValidator
-from database import Database
+from storage import StorageBackend, create_storage, get_storage_writer
 from cache import Cache
-from config import SMS_LIMIT_POST, MAX_MESSAGE_LENGTH
+from idempotency import IdempotencyStore, derive_idempotency_key
+from config import SMS_LIMIT_POST, SEND_DEDUPE_WINDOW, MAX_MESSAGE_LENGTH
 
 logger = logging.getLogger(__name__)
 
@@ -18,11 +20,18 @@ logger = logging.getLogger(__name__)
 class SMSSender:
     """Gestor principal de envío de SMS"""
 
-    def __init__(self):
-        """Inicializar gestor de envío"""
+    def __init__(self, storage: Optional[StorageBackend] = None):
+        """
+        Inicializar gestor de envío
+
+        Args:
+            storage: Motor de almacenamiento (por defecto el de STORAGE_BACKEND)
+        """
         self.api = TrafficLinkAPI()
-        self.db = Database()
+        self.db = storage or create_storage()
         self.cache = Cache(max_size=500, default_ttl=600)
+        self.idempotency = IdempotencyStore(self.db)
+        self.writer = get_storage_writer(self.db)
         self.sent_count = 0
         self.failed_count = 0
         self.duplicates_removed = 0
@@ -119,7 +128,8 @@ class SMSSender:
 
     def send_sms(self, numbers: List[str], content: str,
                 sender: Optional[str] = None, sendtime: Optional[str] = None,
-                use_fragmenting: bool = True) -> Dict:
+                use_fragmenting: bool = True,
+                idempotency_key: Optional[str] = None) -> Dict:
         """
         Enviar SMS con validación y fragmentación
 
@@ -129,10 +139,31 @@ class SMSSender:
             sender: Remitente opcional
             sendtime: Tiempo de envío opcional
             use_fragmenting: Fragmentar si es necesario
+            idempotency_key: Clave del envío (se deriva del contenido si es None)
 
         Returns:
             Dict con resultado de envío
         """
+        key = idempotency_key or derive_idempotency_key(numbers, content, sender, sendtime)
+
+        replay = self.idempotency.begin(key)
+        if replay is not None:
+            return replay
+
+        result = None
+        try:
+            result = self._send_sms(numbers, content, sender, sendtime, use_fragmenting)
+            return result
+        finally:
+            if result and result.get('code') == 0:
+                self.idempotency.complete(key, result)
+            else:
+                self.idempotency.release(key)
+
+    def _send_sms(self, numbers: List[str], content: str,
+                 sender: Optional[str], sendtime: Optional[str],
+                 use_fragmenting: bool) -> Dict:
+        """Validar, fragmentar y enviar por lotes al gateway"""
         logger.info(f"📤 Iniciando envío a {len(numbers)} números...")
 
         # Validar y preparar
@@ -168,37 +199,10 @@ class SMSSender:
             for i in range(0, len(optimized_numbers), SMS_LIMIT_POST):
                 batch = optimized_numbers[i:i + SMS_LIMIT_POST]
 
-                try:
-                    result = self.api.send_sms(
-                        numbers=batch,
-                        content=fragment,
-                        sender=sender,
-                        sendtime=sendtime,
-                        use_post=True if len(batch) > 100 else False
-                    )
-
-                    if result.get('code') == 0:
-                        sms_id = result.get('id')
-                        sent_ids.append(sms_id)
-                        total_sent += len(batch)
-                        self.sent_count += len(batch)
-
-                        # Guardar en base de datos
-                        self.db.save_sms(
-                            sms_id, "0152C274", batch,
-                            fragment, sender, sendtime
-                        )
-
-                        logger.info(f"✅ Lote enviado: {len(batch)} SMS - ID: {sms_id}")
-
-                    else:
-                        error_msg = result.get('error_message')
-                        logger.error(f"❌ Error en lote: {error_msg}")
-                        self.failed_count += len(batch)
-
-                except Exception as e:
-                    logger.error(f"❌ Excepción al enviar: {str(e)}")
-                    self.failed_count += len(batch)
+                sms_id = self._dispatch_batch(batch, fragment, sender, sendtime)
+                if sms_id:
+                    sent_ids.append(sms_id)
+                    total_sent += len(batch)
 
         return {
             "code": 0 if sent_ids else -101,
@@ -210,22 +214,213 @@ class SMSSender:
             "duplicates_removed": self.duplicates_removed
         }
 
-    def send_bulk(self, numbers: List[str], content: str,
+    def _dispatch_batch(self, batch: List[str], fragment: str,
+                        sender: Optional[str], sendtime: Optional[str]) -> Optional[str]:
+        """
+        Enviar un lote al gateway y guardarlo en base de datos
+
+        Args:
+            batch: Números del lote (máximo SMS_LIMIT_POST)
+            fragment: Contenido a enviar
+            sender: Remitente opcional
+            sendtime: Tiempo de envío opcional
+
+        Returns:
+            ID del SMS aceptado o None si el lote falló
+        """
+        try:
+            result = self.api.send_sms(
+                numbers=batch,
+                content=fragment,
+                sender=sender,
+                sendtime=sendtime,
+                use_post=True if len(batch) > 100 else False
+            )
+
+            if result.get('code') == 0:
+                sms_id = result.get('id')
+                self.sent_count += len(batch)
+
+                # Guardar en base de datos (escritura diferida, sin esperar commit)
+                self.writer.save_sms(
+                    sms_id, "0152C274", batch,
+                    fragment, sender, sendtime
+                )
+                self.writer.save_transaction(
+                    "send_sms", sms_count=len(batch), notes=sms_id
+                )
+
+                logger.info(f"✅ Lote enviado: {len(batch)} SMS - ID: {sms_id}")
+                return sms_id
+
+            error_msg = result.get('error_message')
+            logger.error(f"❌ Error en lote: {error_msg}")
+            self.failed_count += len(batch)
+
+        except Exception as e:
+            logger.error(f"❌ Excepción al enviar: {str(e)}")
+            self.failed_count += len(batch)
+
+        return None
+
+    def iter_number_batches(self, numbers: Iterable[str],
+                            batch_size: int = SMS_LIMIT_POST,
+                            dedupe_window: int = SEND_DEDUPE_WINDOW) -> Iterator[List[str]]:
+        """
+        Validar, normalizar y deduplicar números de forma incremental
+
+        La deduplicación es exacta dentro de los últimos dedupe_window
+        números únicos, así la memoria queda acotada sin importar el largo
+        de la entrada: un duplicado más lejano que la ventana se envía de
+        nuevo. Con dedupe_window=0 se recuerdan todos (exacto, memoria
+        proporcional a los números únicos).
+
+        Args:
+            numbers: Cualquier iterable de números (archivo, cursor, generador)
+            batch_size: Tamaño de cada lote
+            dedupe_window: Números únicos recientes que se recuerdan (0 = todos)
+
+        Yields:
+            Lotes de números formateados y únicos en cuanto se llenan
+        """
+        # Los números vistos se guardan como int ("1" + dígitos conserva los
+        # ceros a la izquierda) para que el conjunto ocupe menos que los str;
+        # la cola marca el orden en que salen de la ventana
+        seen = set()
+        window = deque()
+        batch = []
+        invalid = 0
+
+        for num in numbers:
+            if not PhoneValidator.validate_number(num):
+                invalid += 1
+                continue
+
+            formatted = PhoneValidator.format_number(num)
+            marker = int("1" + formatted)
+            if marker in seen:
+                self.duplicates_removed += 1
+                continue
+
+            seen.add(marker)
+            if dedupe_window:
+                window.append(marker)
+                if len(window) > dedupe_window:
+                    seen.discard(window.popleft())
+            batch.append(formatted)
+
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+
+        if batch:
+            yield batch
+
+        if invalid:
+            logger.warning(f"⚠️  {invalid} números inválidos ignorados")
+
+    def send_stream(self, numbers: Iterable[str], content: str,
+                    sender: Optional[str] = None, sendtime: Optional[str] = None,
+                    use_fragmenting: bool = True,
+                    batch_size: int = SMS_LIMIT_POST) -> Dict:
+        """
+        Enviar SMS leyendo los números de un iterable
+
+        Cada lote sale hacia el gateway en cuanto se completa, sin
+        materializar la lista completa de números. Cada lote tiene su propia
+        clave de idempotencia, así que repetir el envío solo despacha los
+        lotes que no fueron aceptados.
+
+        Args:
+            numbers: Iterable de números de teléfono
+            content: Contenido del mensaje
+            sender: Remitente opcional
+            sendtime: Tiempo de envío opcional
+            use_fragmenting: Fragmentar si es necesario
+            batch_size: Números por lote
+
+        Returns:
+            Dict con resultado de envío (mismo formato que send_sms)
+        """
+        logger.info("📤 Iniciando envío en streaming...")
+
+        is_valid, error_msg = MessageValidator.validate_content(content)
+        if not is_valid:
+            logger.error(f"❌ Validación fallida: {error_msg}")
+            return {
+                "code": -100,
+                "error_message": error_msg,
+                "sms_count": 0,
+                "sent_ids": []
+            }
+
+        processed_content = MessageValidator.sanitize_content(content)
+        fragments = [processed_content]
+        if use_fragmenting and len(processed_content) > MAX_MESSAGE_LENGTH:
+            fragments = self.fragment_message(processed_content)
+
+        sent_ids = []
+        total_sent = 0
+        batches = 0
+
+        for batch in self.iter_number_batches(numbers, batch_size):
+            batches += 1
+            logger.info(f"📦 Lote {batches}: {len(batch)} números")
+
+            for fragment in fragments:
+                key = derive_idempotency_key(batch, fragment, sender, sendtime)
+                replay = self.idempotency.begin(key)
+                if replay is not None:
+                    sent_ids.extend(replay.get('sent_ids', []))
+                    total_sent += replay.get('sms_count', 0)
+                    continue
+
+                sms_id = self._dispatch_batch(batch, fragment, sender, sendtime)
+                if sms_id:
+                    sent_ids.append(sms_id)
+                    total_sent += len(batch)
+                    self.idempotency.complete(key, {
+                        "code": 0,
+                        "sms_count": len(batch),
+                        "sent_ids": [sms_id]
+                    })
+                else:
+                    self.idempotency.release(key)
+
+        if not batches:
+            return {
+                "code": -100,
+                "error_message": "No hay números válidos para enviar",
+                "sms_count": 0,
+                "sent_ids": []
+            }
+
+        return {
+            "code": 0 if sent_ids else -101,
+            "message": "SMS enviados exitosamente" if sent_ids else "No se pudo enviar ningún SMS",
+            "sms_count": total_sent,
+            "fragments": len(fragments),
+            "batches": batches,
+            "sent_ids": sent_ids,
+            "duplicates_removed": self.duplicates_removed
+        }
+
+    def send_bulk(self, numbers: Iterable[str], content: str,
                  sender: Optional[str] = None) -> Dict:
         """
         Envío en masa con optimizaciones
 
         Args:
-            numbers: Números de teléfono
+            numbers: Números de teléfono (lista o cualquier iterable)
             content: Contenido
             sender: Remitente
 
         Returns:
             Resultado de envío
         """
-        logger.info(f"📦 Enviando en masa a {len(numbers)} contactos...")
+        logger.info("📦 Enviando en masa...")
 
-        result = self.send_sms(
+        result = self.send_stream(
             numbers=numbers,
             content=content,
             sender=sender,
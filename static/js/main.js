@@ -673,7 +673,8 @@ function getTimelineFromNow(date) {
 // ========================================
 
 let currentExcelImportId = null;
-let currentContactsData = [];
+let currentContactsData = [];  // Muestra de contactos; el archivo completo queda en el servidor
+let currentImportSummary = null;
 let currentCampaignId = null;
 let currentTemplate = '';
 
@@ -708,7 +709,8 @@ async function uploadExcelFile(event) {
 
         if (data.status === 'success') {
             currentExcelImportId = data.excel_import_id;
-            currentContactsData = data.contacts;
+            currentContactsData = data.preview || [];
+            currentImportSummary = data;
 
             showContactsPreview(data);
             showCampaignStep('step2Preview');
@@ -725,7 +727,7 @@ async function uploadExcelFile(event) {
 
 function showContactsPreview(data) {
     const previewDiv = document.getElementById('contactsPreview');
-    const contacts = data.contacts.slice(0, 5);
+    const contacts = (data.preview || []).slice(0, 5);
 
     let html = '<table><thead><tr><th>Número</th><th>Nombre</th><th>Email</th></tr></thead><tbody>';
 
@@ -737,8 +739,8 @@ function showContactsPreview(data) {
         </tr>`;
     });
 
-    if (data.contacts.length > 5) {
-        html += `<tr><td colspan="3" style="text-align: center; font-size: 12px; color: #999;">... y ${data.contacts.length - 5} más</td></tr>`;
+    if (data.valid_rows > contacts.length) {
+        html += `<tr><td colspan="3" style="text-align: center; font-size: 12px; color: #999;">... y ${data.valid_rows - contacts.length} más</td></tr>`;
     }
 
     html += '</tbody></table>';
@@ -758,17 +760,14 @@ function showContactsPreview(data) {
         }
     }
 
-    if (data.errors && data.errors.length > 0) {
-        showAlert(`⚠️ ${data.errors.length} contactos inválidos`, 'warning');
+    if (data.invalid_rows > 0) {
+        showAlert(`⚠️ ${data.invalid_rows} contactos inválidos`, 'warning');
     }
 }
 
 function updateCustomVariablesDisplay() {
     // Mostrar variables personalizadas detectadas en la sección de guía
-    const variables = new Set();
-    currentContactsData.forEach(c => {
-        Object.keys(c.variables || {}).forEach(v => variables.add(v));
-    });
+    const variables = new Set(currentImportSummary?.detected_variables || []);
 
     const customVarsList = document.getElementById('customVariablesList');
     if (customVarsList && variables.size > 0) {
@@ -781,10 +780,7 @@ function updateCustomVariablesDisplay() {
 
 function proceedToTemplate() {
     // Mostrar variables disponibles en la plantilla
-    const variables = new Set();
-    currentContactsData.forEach(c => {
-        Object.keys(c.variables || {}).forEach(v => variables.add(v));
-    });
+    const variables = new Set(currentImportSummary?.detected_variables || []);
 
     const variablesList = document.getElementById('variablesList');
     variablesList.innerHTML = Array.from(variables)
@@ -832,7 +828,7 @@ function proceedToSend() {
 
     // Mostrar resumen
     document.getElementById('summaryName').textContent = document.getElementById('campaignName').value || 'Sin nombre';
-    document.getElementById('summaryCount').textContent = currentContactsData.length;
+    document.getElementById('summaryCount').textContent = currentImportSummary?.valid_rows || 0;
     document.getElementById('summaryPreview').textContent = updateMessagePreview() || currentTemplate;
 
     showCampaignStep('step4Send');
@@ -857,7 +853,7 @@ async function sendCampaign() {
 
         // Procesar contactos
         await api.post(`/api/campaigns/${currentCampaignId}/process`, {
-            contacts: currentContactsData,
+            excel_import_id: currentExcelImportId,
             template: currentTemplate
         });
 
@@ -873,7 +869,52 @@ async function sendCampaign() {
     }
 }
 
-async function monitorCampaignProgress() {
+function monitorCampaignProgress() {
+    // Sin soporte de SSE se consulta el endpoint cada segundo
+    if (!window.EventSource) {
+        pollCampaignProgress();
+        return;
+    }
+
+    const progress = {};
+    const source = new EventSource(`/api/campaigns/${currentCampaignId}/progress/stream`);
+
+    // Cada evento trae solo los campos que cambiaron
+    source.onmessage = (event) => {
+        Object.assign(progress, JSON.parse(event.data));
+        renderCampaignProgress(progress);
+
+        if (progress.status === 'completed') {
+            source.close();
+            showResults(progress);
+        }
+    };
+
+    source.addEventListener('end', () => {
+        source.close();
+        showResults(progress);
+    });
+
+    source.onerror = () => {
+        // El navegador reconecta solo; si cerró la conexión, volver a consultar
+        if (source.readyState === EventSource.CLOSED) {
+            pollCampaignProgress();
+        }
+    };
+}
+
+function renderCampaignProgress(data) {
+    const percentage = data?.total > 0
+        ? Math.round((data.sent / data.total) * 100)
+        : 0;
+
+    document.getElementById('campaignProgressBar').style.width = percentage + '%';
+    document.getElementById('campaignProgressBar').textContent = percentage + '%';
+    document.getElementById('campaignProgressText').textContent =
+        `${data?.sent || 0} / ${data?.total || 0} enviados (${percentage}%)`;
+}
+
+async function pollCampaignProgress() {
     const maxAttempts = 120; // 2 minutos
     let attempts = 0;
 
@@ -883,14 +924,7 @@ async function monitorCampaignProgress() {
         try {
             const progress = await api.get(`/api/campaigns/${currentCampaignId}/progress`);
 
-            const percentage = progress.data?.total > 0
-                ? Math.round((progress.data.sent / progress.data.total) * 100)
-                : 0;
-
-            document.getElementById('campaignProgressBar').style.width = percentage + '%';
-            document.getElementById('campaignProgressBar').textContent = percentage + '%';
-            document.getElementById('campaignProgressText').textContent =
-                `${progress.data?.sent || 0} / ${progress.data?.total || 0} enviados (${percentage}%)`;
+            renderCampaignProgress(progress.data);
 
             if (progress.data?.status === 'completed') {
                 clearInterval(interval);
@@ -918,6 +952,7 @@ function newCampaign() {
     // Resetear estado
     currentExcelImportId = null;
     currentContactsData = [];
+    currentImportSummary = null;
     currentCampaignId = null;
     currentTemplate = '';
 
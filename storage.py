@@ -0,0 +1,838 @@
+"""
+Motores de almacenamiento intercambiables
+Define la interfaz común de persistencia (SMS, reportes, tareas,
+transacciones, balance e idempotencia), un motor en memoria sin disco
+y SQLite con un nivel en memoria para los SMS recientes
+"""
+import heapq
+import json
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from itertools import islice
+from typing import Any, Callable, Dict, Iterable, List, Optional
+from database import DB_PATH, Database, number_to_int
+from models import (
+    Account,
+    DataStorage,
+    Report,
+    SMS,
+    SMSRecord,
+    SMSStatus,
+    SMSTask,
+    TaskType,
+    TransactionLog,
+    _parse_status
+)
+from write_behind import DirectWriter, get_writer
+from config import (
+    STORAGE_BACKEND,
+    TRAFFILINK_ACCOUNT,
+    HOT_TIER_MAX_SMS,
+    HOT_TIER_MAX_AGE_SECONDS
+)
+
+logger = logging.getLogger(__name__)
+
+
+class StorageBackend(ABC):
+    """
+    Interfaz de persistencia usada por el pipeline de envío
+
+    Las lecturas devuelven dicts con las mismas columnas que las tablas
+    SQLite, así el código que consume filas no depende del motor. Solo
+    SMSSender elige el motor con STORAGE_BACKEND: reportes, analytics,
+    tareas, campañas y retención trabajan sobre Database.
+    """
+
+    # ==================== SMS ====================
+
+    @abstractmethod
+    def save_sms(self, sms_id: str, account: str, numbers: List[str],
+                 content: str, sender: Optional[str] = None,
+                 sendtime: Optional[str] = None) -> bool:
+        """Guardar SMS enviado"""
+
+    @abstractmethod
+    def save_sms_bulk(self, records: Iterable[Dict], ignore_existing: bool = False,
+                      chunk_size: int = 0) -> List[int]:
+        """Guardar muchos SMS"""
+
+    @abstractmethod
+    def get_sms(self, sms_id: str) -> Optional[Dict]:
+        """Obtener SMS por ID"""
+
+    @abstractmethod
+    def get_all_sms(self, limit: int = 100, offset: int = 0) -> List[Dict]:
+        """Obtener SMS del más reciente al más antiguo"""
+
+    @abstractmethod
+    def update_sms_status(self, sms_id: str, status: str,
+                          delivered: int = 0, failed: int = 0):
+        """Actualizar estado de SMS"""
+
+    @abstractmethod
+    def update_sms_status_bulk(self, updates: Iterable[Dict],
+                               chunk_size: int = 0) -> List[int]:
+        """Actualizar el estado de muchos SMS"""
+
+    # ==================== REPORTES ====================
+
+    @abstractmethod
+    def save_report(self, report_id: str, sms_id: str, number: str,
+                    status: str, error_code: Optional[int] = None,
+                    error_message: Optional[str] = None) -> bool:
+        """Guardar reporte de entrega"""
+
+    @abstractmethod
+    def save_reports_bulk(self, reports: Iterable[Dict], ignore_existing: bool = False,
+                          chunk_size: int = 0) -> List[int]:
+        """Guardar muchos reportes de entrega"""
+
+    @abstractmethod
+    def get_reports_by_sms(self, sms_id: str) -> List[Dict]:
+        """Obtener reportes de un SMS"""
+
+    # ==================== TAREAS ====================
+
+    @abstractmethod
+    def save_task(self, task_id: str, account: str, task_type: int,
+                  contacts: List[str], content: str, sender: Optional[str] = None,
+                  sendtime: Optional[str] = None, interval: Optional[int] = None,
+                  endtime: Optional[str] = None) -> bool:
+        """Guardar tarea programada"""
+
+    @abstractmethod
+    def save_tasks_bulk(self, tasks: Iterable[Dict], chunk_size: int = 0) -> List[int]:
+        """Guardar muchas tareas programadas"""
+
+    @abstractmethod
+    def get_active_tasks(self) -> List[Dict]:
+        """Obtener tareas activas"""
+
+    @abstractmethod
+    def update_task_status(self, task_id: str, status: str):
+        """Actualizar estado de tarea"""
+
+    # ==================== TRANSACCIONES ====================
+
+    @abstractmethod
+    def save_transaction(self, transaction_id: str, operation: str,
+                         sms_count: int = 0, balance_change: float = 0,
+                         status: str = "success", notes: Optional[str] = None) -> bool:
+        """Guardar transacción"""
+
+    @abstractmethod
+    def save_transactions_bulk(self, transactions: Iterable[Dict],
+                               ignore_existing: bool = False,
+                               chunk_size: int = 0) -> List[int]:
+        """Guardar muchas transacciones"""
+
+    @abstractmethod
+    def get_transactions(self, limit: int = 100, since: Optional[str] = None) -> List[Dict]:
+        """Obtener últimas transacciones"""
+
+    # ==================== BALANCE ====================
+
+    @abstractmethod
+    def save_balance(self, account: str, balance: float, gift_balance: float = 0):
+        """Guardar balance en histórico"""
+
+    @abstractmethod
+    def get_balance_history(self, account: str, limit: int = 100) -> List[Dict]:
+        """Obtener histórico de balance"""
+
+    # ==================== IDEMPOTENCIA ====================
+
+    @abstractmethod
+    def claim_idempotency_key(self, key: str, ttl: int) -> bool:
+        """Reservar una clave de idempotencia"""
+
+    @abstractmethod
+    def get_idempotency_record(self, key: str) -> Optional[Dict]:
+        """Obtener registro vigente de una clave"""
+
+    @abstractmethod
+    def complete_idempotency_key(self, key: str, result: Dict, ttl: int):
+        """Guardar el resultado de un envío aceptado"""
+
+    @abstractmethod
+    def release_idempotency_key(self, key: str):
+        """Liberar una clave cuyo envío no fue aceptado"""
+
+    @abstractmethod
+    def purge_idempotency_keys(self) -> int:
+        """Eliminar claves vencidas"""
+
+    # ==================== GENERAL ====================
+
+    @abstractmethod
+    def get_statistics(self) -> Dict[str, Any]:
+        """Obtener estadísticas generales"""
+
+    @abstractmethod
+    def transaction(self):
+        """Context manager que agrupa escrituras"""
+
+    @abstractmethod
+    def disconnect(self):
+        """Liberar recursos del motor"""
+
+
+# Database implementa la interfaz sin depender de este módulo
+StorageBackend.register(Database)
+
+
+def _timestamp(value: Optional[float]) -> Optional[str]:
+    """Formatear un epoch como CURRENT_TIMESTAMP de SQLite (UTC)"""
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(value)) if value is not None else None
+
+
+def _sms_from_record(record: Dict, sent_at: float) -> SMS:
+    """Crear un SMS enviado desde un dict de save_sms_bulk"""
+    return SMS(
+        id=record["sms_id"],
+        numbers=record["numbers"],
+        content=record["content"],
+        status=SMSStatus.SENT,
+        sender=record.get("sender"),
+        sendtime=record.get("sendtime"),
+        sent_at=sent_at,
+        account=record["account"]
+    )
+
+
+def sms_row(sms: SMS) -> Dict:
+    """
+    Convertir un SMS a fila de la tabla sms
+
+    Args:
+        sms: Modelo SMS
+
+    Returns:
+        Dict con las columnas de la tabla sms
+    """
+    numbers = sms.number_list()
+    return {
+        "id": sms.id,
+        "account": sms.account or TRAFFILINK_ACCOUNT,
+        "numbers": ",".join(numbers),
+        "content": sms.content,
+        "status": sms.status.value,
+        "sender": sms.sender,
+        "sendtime": sms.sendtime,
+        "sent_at": _timestamp(sms.sent_at),
+        "updated_at": _timestamp(sms.sent_at),
+        "delivered_count": sms.delivered_count,
+        "failed_count": sms.failed_count,
+        "recipient_count": sum(1 for n in numbers if number_to_int(n) is not None)
+    }
+
+
+def report_row(report: Report) -> Dict:
+    """
+    Convertir un Report a fila de la tabla reports
+
+    Args:
+        report: Modelo Report
+
+    Returns:
+        Dict con las columnas de la tabla reports
+    """
+    return {
+        "id": report.id,
+        "sms_id": report.sms_id,
+        "number": report.number,
+        "status": report.status.value,
+        "error_code": report.error_code,
+        "error_message": report.error_message,
+        "sent_at": _timestamp(report.sent_at),
+        "delivered_at": _timestamp(report.delivered_at),
+        "created_at": _timestamp(report.sent_at)
+    }
+
+
+class MemoryStorage(StorageBackend):
+    """Motor en memoria sobre models.DataStorage (sin disco)"""
+
+    def __init__(self, data: Optional[DataStorage] = None):
+        """
+        Inicializar motor
+
+        Args:
+            data: Almacenamiento a usar (uno nuevo si no se indica)
+        """
+        self.data = data or DataStorage()
+        self.lock = threading.RLock()
+        # Columnas e índices que los modelos no tienen
+        self.task_accounts: Dict[str, str] = {}
+        self.transaction_ids = set()
+        self.balance_history: List[Dict] = []
+        self.idempotency_keys: Dict[str, Dict] = {}
+
+    # ==================== SMS ====================
+
+    def save_sms(self, sms_id: str, account: str, numbers: List[str],
+                 content: str, sender: Optional[str] = None,
+                 sendtime: Optional[str] = None) -> bool:
+        """Guardar SMS enviado"""
+        try:
+            self.save_sms_bulk([{
+                "sms_id": sms_id, "account": account, "numbers": numbers,
+                "content": content, "sender": sender, "sendtime": sendtime
+            }])
+            return True
+        except Exception as e:
+            logger.error(f"❌ Error guardando SMS: {str(e)}")
+            return False
+
+    def save_sms_bulk(self, records: Iterable[Dict], ignore_existing: bool = False,
+                      chunk_size: int = 0) -> List[int]:
+        """
+        Guardar muchos SMS
+
+        Args:
+            records: Dicts con sms_id, account, numbers, content, sender y sendtime
+            ignore_existing: Omitir SMS cuyo ID ya existe en lugar de fallar
+            chunk_size: Ignorado (no hay bloques en memoria)
+
+        Returns:
+            Lista con la cantidad de SMS insertados
+        """
+        inserted = 0
+        with self.lock:
+            now = time.time()
+            for record in records:
+                sms_id = record["sms_id"]
+                if sms_id in self.data.sms_messages:
+                    if ignore_existing:
+                        continue
+                    raise ValueError(f"SMS duplicado: {sms_id}")
+
+                self.data.add_sms(_sms_from_record(record, now))
+                inserted += 1
+        return [inserted]
+
+    def get_sms(self, sms_id: str) -> Optional[Dict]:
+        """Obtener SMS por ID"""
+        with self.lock:
+            sms = self.data.get_sms(sms_id)
+            return sms_row(sms) if sms else None
+
+    def get_all_sms(self, limit: int = 100, offset: int = 0) -> List[Dict]:
+        """Obtener SMS del más reciente al más antiguo"""
+        with self.lock:
+            # El orden del dict es el LRU (get_sms lo altera): se ordena por
+            # (sent_at, id) como el índice de SQLite
+            recent = heapq.nlargest(offset + limit, self.data.sms_messages.values(),
+                                    key=lambda sms: (sms.sent_at, sms.id))
+            return [sms_row(sms) for sms in recent[offset:]]
+
+    def update_sms_status(self, sms_id: str, status: str,
+                          delivered: int = 0, failed: int = 0):
+        """Actualizar estado de SMS"""
+        self.update_sms_status_bulk([{
+            "sms_id": sms_id, "status": status, "delivered": delivered, "failed": failed
+        }])
+
+    def update_sms_status_bulk(self, updates: Iterable[Dict],
+                               chunk_size: int = 0) -> List[int]:
+        """Actualizar el estado de muchos SMS"""
+        updated = 0
+        with self.lock:
+            for update in updates:
+                updated += self.data.update_sms_status(
+                    update["sms_id"], _parse_status(update["status"]),
+                    update.get("delivered", 0), update.get("failed", 0)
+                )
+        return [updated]
+
+    # ==================== REPORTES ====================
+
+    def save_report(self, report_id: str, sms_id: str, number: str,
+                    status: str, error_code: Optional[int] = None,
+                    error_message: Optional[str] = None) -> bool:
+        """Guardar reporte de entrega"""
+        try:
+            self.save_reports_bulk([{
+                "report_id": report_id, "sms_id": sms_id, "number": number,
+                "status": status, "error_code": error_code, "error_message": error_message
+            }])
+            return True
+        except Exception as e:
+            logger.error(f"❌ Error guardando reporte: {str(e)}")
+            return False
+
+    def save_reports_bulk(self, reports: Iterable[Dict], ignore_existing: bool = False,
+                          chunk_size: int = 0) -> List[int]:
+        """Guardar muchos reportes de entrega"""
+        inserted = 0
+        with self.lock:
+            now = time.time()
+            for r in reports:
+                if r["report_id"] in self.data.reports:
+                    if ignore_existing:
+                        continue
+                    raise ValueError(f"Reporte duplicado: {r['report_id']}")
+
+                self.data.add_report(Report(
+                    id=r["report_id"],
+                    number=r["number"],
+                    status=_parse_status(r["status"]),
+                    error_code=r.get("error_code"),
+                    error_message=r.get("error_message"),
+                    sent_at=now,
+                    sms_id=r["sms_id"]
+                ))
+                inserted += 1
+        return [inserted]
+
+    def get_reports_by_sms(self, sms_id: str) -> List[Dict]:
+        """Obtener reportes de un SMS"""
+        with self.lock:
+            reports = self.data.get_reports_by_sms_id(sms_id)
+            return [report_row(report) for report in reversed(reports)]
+
+    # ==================== TAREAS ====================
+
+    def save_task(self, task_id: str, account: str, task_type: int,
+                  contacts: List[str], content: str, sender: Optional[str] = None,
+                  sendtime: Optional[str] = None, interval: Optional[int] = None,
+                  endtime: Optional[str] = None) -> bool:
+        """Guardar tarea programada"""
+        try:
+            self.save_tasks_bulk([{
+                "task_id": task_id, "account": account, "task_type": task_type,
+                "contacts": contacts, "content": content, "sender": sender,
+                "sendtime": sendtime, "interval": interval, "endtime": endtime
+            }])
+            return True
+        except Exception as e:
+            logger.error(f"❌ Error guardando tarea: {str(e)}")
+            return False
+
+    def save_tasks_bulk(self, tasks: Iterable[Dict], chunk_size: int = 0) -> List[int]:
+        """Guardar muchas tareas programadas"""
+        inserted = 0
+        with self.lock:
+            for t in tasks:
+                if t["task_id"] in self.data.tasks:
+                    raise ValueError(f"Tarea duplicada: {t['task_id']}")
+
+                self.data.add_task(SMSTask(
+                    id=t["task_id"],
+                    task_type=TaskType(t["task_type"]),
+                    contacts=t["contacts"],
+                    content=t["content"],
+                    sender=t.get("sender"),
+                    sendtime=t.get("sendtime"),
+                    interval=t.get("interval"),
+                    endtime=t.get("endtime"),
+                    created_at=time.time()
+                ))
+                self.task_accounts[t["task_id"]] = t["account"]
+                inserted += 1
+        return [inserted]
+
+    def get_active_tasks(self) -> List[Dict]:
+        """Obtener tareas activas"""
+        with self.lock:
+            return [self._task_row(task) for task in reversed(self.data.tasks.values())
+                    if task.status == "active"]
+
+    def update_task_status(self, task_id: str, status: str):
+        """Actualizar estado de tarea"""
+        with self.lock:
+            self.data.update_task_status(task_id, status)
+
+    def _task_row(self, task: SMSTask) -> Dict:
+        """Convertir un SMSTask a fila de la tabla tasks"""
+        return {
+            "id": task.id,
+            "account": self.task_accounts.get(task.id, TRAFFILINK_ACCOUNT),
+            "task_type": task.task_type.value,
+            "contacts": ",".join(task.contact_list()),
+            "content": task.content,
+            "sender": task.sender,
+            "sendtime": task.sendtime,
+            "interval": task.interval,
+            "endtime": task.endtime,
+            "status": task.status,
+            "created_at": _timestamp(task.created_at),
+            "executed_count": 0
+        }
+
+    # ==================== TRANSACCIONES ====================
+
+    def save_transaction(self, transaction_id: str, operation: str,
+                         sms_count: int = 0, balance_change: float = 0,
+                         status: str = "success", notes: Optional[str] = None) -> bool:
+        """Guardar transacción"""
+        try:
+            self.save_transactions_bulk([{
+                "transaction_id": transaction_id, "operation": operation,
+                "sms_count": sms_count, "balance_change": balance_change,
+                "status": status, "notes": notes
+            }])
+            return True
+        except Exception as e:
+            logger.error(f"❌ Error guardando transacción: {str(e)}")
+            return False
+
+    def save_transactions_bulk(self, transactions: Iterable[Dict],
+                               ignore_existing: bool = False,
+                               chunk_size: int = 0) -> List[int]:
+        """Guardar muchas transacciones"""
+        inserted = 0
+        with self.lock:
+            now = time.time()
+            for t in transactions:
+                if t["transaction_id"] in self.transaction_ids:
+                    if ignore_existing:
+                        continue
+                    raise ValueError(f"Transacción duplicada: {t['transaction_id']}")
+
+                self.data.log_transaction(TransactionLog(
+                    id=t["transaction_id"],
+                    operation=t["operation"],
+                    timestamp=now,
+                    sms_count=t.get("sms_count", 0),
+                    balance_change=t.get("balance_change", 0),
+                    status=t.get("status", "success"),
+                    notes=t.get("notes")
+                ))
+                self.transaction_ids.add(t["transaction_id"])
+                inserted += 1
+        return [inserted]
+
+    def get_transactions(self, limit: int = 100, since: Optional[str] = None) -> List[Dict]:
+        """Obtener últimas transacciones (opcionalmente desde una fecha UTC)"""
+        with self.lock:
+            rows = []
+            for log in reversed(self.data.transaction_logs):
+                created_at = _timestamp(log.timestamp)
+                if since is not None and created_at < since:
+                    break
+                rows.append({
+                    "id": log.id, "operation": log.operation, "sms_count": log.sms_count,
+                    "balance_change": log.balance_change, "status": log.status,
+                    "notes": log.notes, "created_at": created_at
+                })
+                if len(rows) >= limit:
+                    break
+            return rows
+
+    # ==================== BALANCE ====================
+
+    def save_balance(self, account: str, balance: float, gift_balance: float = 0):
+        """Guardar balance en histórico"""
+        with self.lock:
+            now = time.time()
+            self.data.set_account(Account(account, balance, gift_balance, now))
+            self.balance_history.append({
+                "id": len(self.balance_history) + 1, "account": account,
+                "balance": balance, "gift_balance": gift_balance,
+                "recorded_at": _timestamp(now)
+            })
+
+    def get_balance_history(self, account: str, limit: int = 100) -> List[Dict]:
+        """Obtener histórico de balance"""
+        with self.lock:
+            rows = (row for row in reversed(self.balance_history) if row["account"] == account)
+            return [dict(row) for row in islice(rows, limit)]
+
+    # ==================== IDEMPOTENCIA ====================
+
+    def claim_idempotency_key(self, key: str, ttl: int) -> bool:
+        """Reservar una clave de idempotencia (True si quedó reservada)"""
+        now = time.time()
+        with self.lock:
+            record = self.idempotency_keys.get(key)
+            if record and record["expires_at"] >= now:
+                return False
+            self.idempotency_keys[key] = {
+                "key": key, "status": "pending", "result": None,
+                "created_at": now, "expires_at": now + ttl
+            }
+            return True
+
+    def get_idempotency_record(self, key: str) -> Optional[Dict]:
+        """Obtener registro vigente de una clave de idempotencia"""
+        with self.lock:
+            record = self.idempotency_keys.get(key)
+            if record is None or record["expires_at"] < time.time():
+                return None
+            record = dict(record)
+
+        # Mismo ida y vuelta por JSON que en SQLite
+        record["result"] = json.loads(record["result"]) if record["result"] else None
+        return record
+
+    def complete_idempotency_key(self, key: str, result: Dict, ttl: int):
+        """Guardar el resultado de un envío aceptado bajo su clave"""
+        with self.lock:
+            record = self.idempotency_keys.get(key)
+            if record:
+                record.update(
+                    status="completed",
+                    result=json.dumps(result, default=str),
+                    expires_at=time.time() + ttl
+                )
+
+    def release_idempotency_key(self, key: str):
+        """Liberar una clave cuyo envío no fue aceptado"""
+        with self.lock:
+            record = self.idempotency_keys.get(key)
+            if record and record["status"] == "pending":
+                del self.idempotency_keys[key]
+
+    def purge_idempotency_keys(self) -> int:
+        """Eliminar claves de idempotencia vencidas"""
+        now = time.time()
+        with self.lock:
+            expired = [k for k, r in self.idempotency_keys.items() if r["expires_at"] < now]
+            for key in expired:
+                del self.idempotency_keys[key]
+        return len(expired)
+
+    # ==================== GENERAL ====================
+
+    def get_statistics(self) -> Dict[str, Any]:
+        """Obtener estadísticas generales (mismas claves que Database)"""
+        with self.lock:
+            stats = self.data.get_statistics()
+        return {
+            "total_sms": stats["total_sms_messages"],
+            "sent_sms": stats["sent_messages"],
+            "total_reports": stats["total_reports"],
+            "delivered_reports": stats["delivered_reports"],
+            "active_tasks": stats["active_tasks"],
+            "total_transactions": stats["total_transactions"]
+        }
+
+    @contextmanager
+    def transaction(self):
+        """Agrupar escrituras bajo el lock del motor"""
+        with self.lock:
+            yield self
+
+    def disconnect(self):
+        """Sin recursos que liberar"""
+
+
+class TieredStorage(Database):
+    """
+    SQLite con los SMS recientes en memoria
+
+    Las escrituras van primero a SQLite y, al confirmarse, al nivel en memoria
+    (DataStorage acotado por HOT_TIER_MAX_SMS y HOT_TIER_MAX_AGE_SECONDS).
+    get_sms responde desde memoria mientras el SMS sea reciente; el resto
+    de las lecturas usa SQLite. Los cambios hechos por otros procesos se
+    ven cuando el SMS sale del nivel en memoria.
+    """
+
+    def __init__(self, db_path: str = str(DB_PATH), max_sms: int = HOT_TIER_MAX_SMS,
+                 max_age_seconds: float = HOT_TIER_MAX_AGE_SECONDS):
+        """
+        Inicializar motor
+
+        Args:
+            db_path: Ruta del archivo de base de datos
+            max_sms: SMS máximos en memoria
+            max_age_seconds: Antigüedad máxima de un SMS en memoria
+        """
+        self.hot = DataStorage(max_sms, max_age_seconds)
+        self.hot_lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        super().__init__(db_path)
+
+    def cache_rows(self, kind: str, records: List[Dict]):
+        """
+        Reflejar en memoria SMS ya confirmados en SQLite
+
+        Args:
+            kind: Tipo de fila (solo "sms" se guarda en memoria)
+            records: Dicts con el formato de save_sms_bulk
+        """
+        if kind != "sms":
+            return
+
+        def apply():
+            now = time.time()
+            with self.hot_lock:
+                for record in records:
+                    self.hot.add_sms(_sms_from_record(record, now))
+
+        self._after_commit(apply)
+
+    def _after_commit(self, apply: Callable[[], None]):
+        """
+        Aplicar un cambio al nivel en memoria cuando SQLite lo confirme
+
+        Dentro de una transacción abierta el cambio espera al commit (y se
+        descarta si se revierte), así ningún lector ve en memoria un estado
+        que SQLite aún no confirmó.
+
+        Args:
+            apply: Función que modifica el nivel en memoria
+        """
+        pending = getattr(self.pool.local, "hot_pending", None)
+        if pending is not None and getattr(self.pool.local, "tx_depth", 0):
+            pending.append(apply)
+        else:
+            apply()
+
+    def save_sms_bulk(self, records: Iterable[Dict], ignore_existing: bool = False,
+                      **kwargs) -> List[int]:
+        """Guardar muchos SMS en SQLite y en memoria"""
+        saved: List[Dict] = []
+
+        def tap():
+            for record in records:
+                saved.append(record)
+                yield record
+
+        counts = super().save_sms_bulk(tap(), ignore_existing, **kwargs)
+        self.cache_rows("sms", saved)
+        return counts
+
+    def update_sms_status(self, sms_id: str, status: str,
+                          delivered: int = 0, failed: int = 0):
+        """Actualizar estado de SMS en SQLite y en memoria"""
+        super().update_sms_status(sms_id, status, delivered, failed)
+
+        def apply():
+            with self.hot_lock:
+                self.hot.update_sms_status(sms_id, _parse_status(status), delivered, failed)
+
+        self._after_commit(apply)
+
+    def update_sms_status_bulk(self, updates: Iterable[Dict], **kwargs) -> List[int]:
+        """Actualizar el estado de muchos SMS en SQLite y en memoria"""
+        updates = list(updates)
+        counts = super().update_sms_status_bulk(updates, **kwargs)
+
+        def apply():
+            with self.hot_lock:
+                for u in updates:
+                    self.hot.update_sms_status(
+                        u["sms_id"], _parse_status(u["status"]),
+                        u.get("delivered", 0), u.get("failed", 0)
+                    )
+
+        self._after_commit(apply)
+        return counts
+
+    def get_sms(self, sms_id: str) -> Optional[Dict]:
+        """Obtener SMS por ID (desde memoria si es reciente)"""
+        with self.hot_lock:
+            sms = self.hot.get_sms(sms_id)
+            if sms is not None:
+                self.hits += 1
+                return sms_row(sms)
+            self.misses += 1
+
+        row = super().get_sms(sms_id)
+        if row is not None:
+            with self.hot_lock:
+                # add_sms descarta los que ya no son recientes
+                self.hot.add_sms(SMSRecord(**row).to_model())
+        return row
+
+    @contextmanager
+    def transaction(self):
+        """Transacción de SQLite; los cambios al nivel en memoria se aplican al confirmar"""
+        local = self.pool.local
+        outermost = not getattr(local, "tx_depth", 0)
+        if outermost:
+            local.hot_pending = []
+        try:
+            with super().transaction() as connection:
+                yield connection
+        except BaseException:
+            if outermost:
+                local.hot_pending = None
+            raise
+
+        if outermost:
+            pending, local.hot_pending = local.hot_pending, None
+            for apply in pending:
+                apply()
+
+    def get_hot_stats(self) -> Dict[str, Any]:
+        """Obtener aciertos y ocupación del nivel en memoria"""
+        with self.hot_lock:
+            stats = self.hot.get_statistics()
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total * 100, 2) if total else 0,
+            "resident_sms": stats["total_sms_messages"],
+            "evicted_sms": stats["evicted_sms"]
+        }
+
+
+# Motor en memoria compartido por el proceso (como el pool por archivo de SQLite)
+_memory_storage: Optional[MemoryStorage] = None
+_memory_lock = threading.Lock()
+
+# Un motor por niveles por archivo y proceso: un solo nivel en memoria
+# al que llegan todas las escrituras y actualizaciones
+_tiered_storages: Dict[str, TieredStorage] = {}
+
+
+def create_storage(backend: str = STORAGE_BACKEND,
+                   db_path: Optional[str] = None) -> StorageBackend:
+    """
+    Crear el motor de almacenamiento configurado
+
+    Args:
+        backend: "sqlite", "tiered" o "memory" (por defecto STORAGE_BACKEND)
+        db_path: Archivo SQLite (solo para "sqlite" y "tiered")
+
+    Returns:
+        Motor de almacenamiento
+    """
+    global _memory_storage
+
+    if backend == "sqlite":
+        return Database(db_path) if db_path else Database()
+
+    if backend == "tiered":
+        db_path = db_path or str(DB_PATH)
+        with _memory_lock:
+            if db_path not in _tiered_storages:
+                _tiered_storages[db_path] = TieredStorage(db_path)
+            return _tiered_storages[db_path]
+
+    if backend == "memory":
+        with _memory_lock:
+            if _memory_storage is None:
+                _memory_storage = MemoryStorage()
+                logger.info("🧠 Almacenamiento en memoria activo (sin disco)")
+            return _memory_storage
+
+    raise ValueError(f"Motor de almacenamiento desconocido: {backend}")
+
+
+def get_storage_writer(storage: StorageBackend):
+    """
+    Obtener el escritor de filas de envío para un motor
+
+    Args:
+        storage: Motor de almacenamiento
+
+    Returns:
+        Escritor diferido compartido (SQLite) o escritor directo (otros motores)
+    """
+    if isinstance(storage, Database):
+        writer = get_writer(storage.db_path)
+        if isinstance(storage, TieredStorage):
+            # Los SMS confirmados por el hilo escritor pasan al nivel en memoria
+            writer.add_listener(storage.cache_rows)
+        return writer
+    return DirectWriter(storage)
@@ -0,0 +1,153 @@
+"""
+Motor de plantillas compiladas
+Analiza una plantilla con {{variables}} una sola vez (segmentos literales
+y huecos) y la renderiza con un único format por mensaje
+"""
+import logging
+import re
+from operator import itemgetter
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, Mapping
+
+logger = logging.getLogger(__name__)
+
+# {{nombre}}: cualquier texto sin llaves, tal como aparece en la columna del Excel
+PLACEHOLDER_PATTERN = re.compile(r"\{\{([^{}]+)\}\}")
+
+
+class CompiledTemplate:
+    """Plantilla analizada en literales y huecos"""
+
+    __slots__ = ("source", "literals", "slots", "variables", "literal_length", "_format", "_values")
+
+    def __init__(self, source: str):
+        """
+        Compilar plantilla
+
+        Args:
+            source: Texto con {{variables}}
+        """
+        self.source = source
+        self.literals: List[str] = []
+        self.slots: List[str] = []
+
+        position = 0
+        for match in PLACEHOLDER_PATTERN.finditer(source):
+            self.literals.append(source[position:match.start()])
+            self.slots.append(match.group(1))
+            position = match.end()
+        self.literals.append(source[position:])
+
+        # Variables distintas en orden de aparición
+        self.variables = list(dict.fromkeys(self.slots))
+        self.literal_length = sum(len(literal) for literal in self.literals)
+
+        # Formato posicional equivalente ("Hola {0}, ..."); las llaves
+        # literales se duplican para que format no las interprete
+        index = {name: i for i, name in enumerate(self.variables)}
+        parts = [self.literals[0].replace("{", "{{").replace("}", "}}")]
+        for name, literal in zip(self.slots, self.literals[1:]):
+            parts.append(f"{{{index[name]}}}")
+            parts.append(literal.replace("{", "{{").replace("}", "}}"))
+        self._format = "".join(parts).format
+
+        # Extrae todos los valores en una llamada (siempre devuelve tupla)
+        if len(self.variables) > 1:
+            self._values = itemgetter(*self.variables)
+        elif self.variables:
+            name = self.variables[0]
+            self._values = lambda variables: (variables[name],)
+        else:
+            self._values = lambda variables: ()
+
+    def render(self, variables: Mapping[str, object]) -> str:
+        """
+        Renderizar un mensaje
+
+        Args:
+            variables: Valores por nombre de variable
+
+        Returns:
+            Mensaje; las variables faltantes quedan como {{nombre}}
+        """
+        try:
+            return self._format(*self._values(variables))
+        except KeyError:
+            return self._format(*[
+                variables[name] if name in variables else f"{{{{{name}}}}}"
+                for name in self.variables
+            ])
+
+    def render_many(self, contacts: Iterable[Mapping[str, object]]) -> Iterator[str]:
+        """
+        Renderizar un mensaje por contacto
+
+        Args:
+            contacts: Dicts de variables (uno por contacto)
+
+        Returns:
+            Iterador de mensajes en el mismo orden
+        """
+        return map(self.render, contacts)
+
+    def missing(self, variables: Mapping[str, object]) -> List[str]:
+        """Variables de la plantilla que no vienen en el dict"""
+        return [name for name in self.variables if name not in variables]
+
+    def unused(self, variables: Mapping[str, object]) -> List[str]:
+        """Claves del dict que la plantilla no usa"""
+        return [name for name in variables if name not in self.variables]
+
+    def max_length(self, value_lengths: Mapping[str, int]) -> int:
+        """
+        Longitud máxima posible del mensaje
+
+        Args:
+            value_lengths: Longitud máxima de cada variable
+
+        Returns:
+            Cota superior (literales + máximos de cada hueco)
+        """
+        return self.literal_length + sum(value_lengths.get(name, len(name) + 4)
+                                         for name in self.slots)
+
+    def __repr__(self):
+        return f"CompiledTemplate(variables={self.variables}, literal_length={self.literal_length})"
+
+
+@lru_cache(maxsize=256)
+def compile_template(source: str) -> CompiledTemplate:
+    """
+    Compilar una plantilla (cacheado por texto)
+
+    Args:
+        source: Texto con {{variables}}
+
+    Returns:
+        Plantilla compilada
+    """
+    return CompiledTemplate(source)
+
+
+def check_variables(template: CompiledTemplate,
+                    contacts: Iterable[Mapping[str, object]]) -> Dict[str, List[str]]:
+    """
+    Reportar variables faltantes y no usadas en un conjunto de contactos
+
+    Args:
+        template: Plantilla compilada
+        contacts: Dicts de variables
+
+    Returns:
+        Dict con "missing" (faltan en algún contacto) y "unused" (sobran en alguno)
+    """
+    missing: Dict[str, None] = {}
+    unused: Dict[str, None] = {}
+    known = set(template.variables)
+    for variables in contacts:
+        for name in known.difference(variables):
+            missing[name] = None
+        for name in variables:
+            if name not in known:
+                unused[name] = None
+    return {"missing": sorted(missing), "unused": sorted(unused)}
@@ -0,0 +1,688 @@
+"""
+Tests para campañas dinámicas
+Verifica el pipeline en streaming desde el archivo de contactos
+"""
+import unittest
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
+
+# Agregar parent directory al path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import campaign_pipeline
+from campaign_pipeline import PipelineReport, buffered, batched, scan_file, run_campaign
+from campaign_processor import CampaignProcessor
+from concurrent.futures.process import BrokenProcessPool
+from campaign_shards import SenderPool, SharedRateLimiter, ShardTask
+from database import Database, number_shard_key
+from sms_sender import SMSSender
+from storage import MemoryStorage
+from excel_loader import excel_loader
+
+
+CSV_CONTACTS = (
+    "Numero,Nombre,Descuento\n"
+    "573001112233,Ana,10\n"
+    "573001112244,Luis,20\n"
+    ",,\n"
+    "abc,Mala,5\n"
+    "573001112233,Ana otra vez,30\n"
+    "573001112255,Eva,40\n"
+)
+
+
+class FakeSender:
+    """Emisor de prueba para los procesos del pool (se crea en cada proceso)"""
+
+    def send_sms(self, numbers, content, sender=None, idempotency_key=None):
+        if numbers[0].endswith("9"):
+            return {"code": -1, "error": "Número rechazado"}
+        return {"code": 0}
+
+
+class CampaignTestCase(unittest.TestCase):
+    """Base con un directorio temporal por test"""
+
+    def setUp(self):
+        """Configurar antes de cada test"""
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        """Limpiar después de cada test"""
+        self.tmp.cleanup()
+
+    def no_pacing(self):
+        """Quitar la pausa entre SMS del rate limit"""
+        return mock.patch("campaign_shards.time",
+                          SimpleNamespace(time=time.time, monotonic=time.monotonic,
+                                          sleep=lambda seconds: None))
+
+    def wait_for(self, campaign_id: str, status: str = "completed", timeout: float = 4):
+        """Esperar a que la campaña quede en un estado (según la BD)"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.processor.get_progress(campaign_id)["status"] == status:
+                return
+            time.sleep(0.02)
+        self.fail(f"La campaña no llegó a {status}")
+
+    def make_db(self) -> Database:
+        """Base de datos temporal"""
+        return Database(os.path.join(self.tmp.name, "test.db"))
+
+    def write_csv(self, content: str = CSV_CONTACTS) -> str:
+        """Escribir un CSV de contactos"""
+        path = os.path.join(self.tmp.name, "contactos.csv")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content)
+        return path
+
+
+class TestCampaignPipeline(CampaignTestCase):
+    """Tests para las etapas del pipeline"""
+
+    def test_scan_file(self):
+        """Probar resumen de importación sin contactos completos"""
+        report = scan_file(self.write_csv())
+        summary = report.to_dict()
+        print(f"\n✓ Resumen: {summary['valid_rows']} válidos, {summary['invalid_rows']} inválidos")
+        self.assertEqual(report.total_rows, 5)
+        self.assertEqual(report.valid_rows, 3)
+        self.assertEqual(report.duplicate_rows, 1)
+        self.assertEqual(report.errors.count, 1)
+        self.assertEqual(report.detected_variables, ["descuento", "nombre"])
+        self.assertEqual([c["numero"] for c in report.preview],
+                         ["573001112233", "573001112244", "573001112255"])
+        self.assertNotIn("contacts", summary)
+
+    def test_run_campaign_batches(self):
+        """Probar render y persistencia por lotes"""
+        batches = []
+        report = run_campaign(self.write_csv(), "camp-1", "Hola {{nombre}}, {{descuento}}% {{cupon}}",
+                              batches.append, batch_size=2)
+        self.assertEqual([len(b) for b in batches], [2, 1])
+        self.assertEqual(report.persisted, 3)
+        self.assertEqual(batches[0][0]["processed_message"], "Hola Ana, 10% {{cupon}}")
+        self.assertEqual(batches[0][0]["campaign_id"], "camp-1")
+        self.assertEqual(report.missing_variables, ["cupon"])
+
+    def test_xlsx_streaming(self):
+        """Probar lectura XLSX en modo read_only"""
+        from openpyxl import Workbook
+        wb = Workbook()
+        ws = wb.active
+        ws.title = "Contactos"
+        ws.append(["numero", "nombre"])
+        for i in range(50):
+            ws.append([573000000000 + i, f"Cliente {i}"])
+        path = os.path.join(self.tmp.name, "contactos.xlsx")
+        wb.save(path)
+
+        report = scan_file(path)
+        self.assertEqual(report.valid_rows, 50)
+        self.assertEqual(excel_loader.read_excel(path)["valid_rows"], 50)
+
+    def test_missing_phone_column(self):
+        """Probar archivo sin columna de teléfono"""
+        path = self.write_csv("nombre,email\nAna,a@x.co\n")
+        with self.assertRaises(ValueError):
+            scan_file(path)
+        self.assertEqual(excel_loader.read_excel(path)["status"], "error")
+
+    def test_error_log_is_bounded(self):
+        """Probar que los errores por fila se cuentan sin acumularse"""
+        report = PipelineReport()
+        report.errors.limit = 3
+        for i in range(10):
+            report.errors.append(f"Fila {i}")
+        self.assertEqual(report.errors.count, 10)
+        self.assertEqual(len(report.errors.sample), 3)
+
+    def test_buffered_preserves_order_and_errors(self):
+        """Probar la etapa con cola acotada"""
+        self.assertEqual(list(buffered(batched(range(10), 3), maxsize=1)),
+                         [[0, 1, 2], [3, 4, 5], [6, 7, 8], [9]])
+
+        def failing():
+            yield 1
+            raise RuntimeError("boom")
+
+        with self.assertRaises(RuntimeError):
+            list(buffered(failing()))
+
+    def test_upload_returns_summary(self):
+        """Probar que el endpoint de carga devuelve solo el resumen"""
+        from app import app
+        client = app.test_client()
+        with mock.patch.object(campaign_pipeline, "UPLOAD_DIR", self.tmp.name):
+            response = client.post("/api/campaigns/upload", data={
+                "file": (io.BytesIO(CSV_CONTACTS.encode("utf-8")), "contactos.csv")
+            }, content_type="multipart/form-data")
+            data = json.loads(response.data)
+            print(f"\n✓ Upload: {data['valid_rows']} válidos")
+            self.assertEqual(data["status"], "success")
+            self.assertEqual(data["valid_rows"], 3)
+            self.assertNotIn("contacts", data)
+            path = campaign_pipeline.find_upload(data["excel_import_id"])
+            self.assertTrue(path.endswith(".csv"))
+
+
+    def test_expired_uploads_are_purged(self):
+        """Probar que los archivos subidos viejos se borran al subir otro"""
+        old = campaign_pipeline.store_upload(mock.Mock(save=lambda path: open(path, "w").close()),
+                                             "viejo.csv", self.tmp.name)
+        os.utime(old["path"], (time.time() - 48 * 3600,) * 2)
+        other = os.path.join(self.tmp.name, "otro.txt")
+        open(other, "w").close()
+        os.utime(other, (time.time() - 48 * 3600,) * 2)
+
+        new = campaign_pipeline.store_upload(mock.Mock(save=lambda path: open(path, "w").close()),
+                                             "nuevo.csv", self.tmp.name)
+        self.assertFalse(os.path.exists(old["path"]))
+        self.assertTrue(os.path.exists(new["path"]))
+        self.assertTrue(os.path.exists(other))
+
+
+class TestCampaignStore(CampaignTestCase):
+    """Tests para la persistencia de campañas"""
+
+    def setUp(self):
+        """Configurar antes de cada test"""
+        super().setUp()
+        self.db = self.make_db()
+        self.db.save_campaign("camp-1", "Promo", None, "Hola {{nombre}}")
+        self.db.save_campaign_contacts_bulk(
+            {"id": f"c{i}", "campaign_id": "camp-1", "seq": i, "numero": f"57300{i:07d}",
+             "nombre": f"Cliente {i}", "processed_message": f"Hola Cliente {i}"}
+            for i in range(1, 11)
+        )
+
+    def tearDown(self):
+        """Limpiar después de cada test"""
+        self.db.disconnect()
+        super().tearDown()
+
+    def test_iter_contacts_by_seq(self):
+        """Probar recorrido por páginas en el orden del archivo"""
+        contacts = list(self.db.iter_campaign_contacts("camp-1", chunk_size=3))
+        self.assertEqual([c["seq"] for c in contacts], list(range(1, 11)))
+        self.assertEqual(contacts[0]["processed_message"], "Hola Cliente 1")
+        after = list(self.db.iter_campaign_contacts("camp-1", after_seq=8))
+        self.assertEqual([c["id"] for c in after], ["c9", "c10"])
+
+    def test_bulk_status_updates_are_coalesced(self):
+        """Probar actualización agrupada (gana la última por contacto)"""
+        self.db.update_campaign_contacts_bulk([
+            {"id": "c1", "status": "failed", "error": "timeout"},
+            {"id": "c1", "status": "sent", "sent_at": "2026-01-01T00:00:00"},
+            {"id": "c2", "status": "sent", "sent_at": "2026-01-01T00:00:00"},
+            {"id": "c3", "status": "failed", "error": "invalid"},
+            {"id": "c4", "status": "skipped"},
+            {"id": "c5", "status": "skipped"},
+        ])
+        counts = self.db.get_campaign_counts("camp-1")
+        print(f"\n✓ Conteos: {counts}")
+        self.assertEqual(counts, {"pending": 5, "sent": 2, "failed": 1, "skipped": 2})
+        pending = [c["id"] for c in self.db.iter_campaign_contacts("camp-1")]
+        self.assertEqual(pending, ["c6", "c7", "c8", "c9", "c10"])
+
+    def test_campaign_status(self):
+        """Probar estado y marcas de tiempo de la campaña"""
+        self.db.update_campaign_status("camp-1", "ready", total=10)
+        self.db.update_campaign_status("camp-1", "sending")
+        self.db.update_campaign_status("camp-1", "completed")
+        campaign = self.db.get_campaign("camp-1")
+        self.assertEqual(campaign["status"], "completed")
+        self.assertEqual(campaign["total"], 10)
+        self.assertIsNotNone(campaign["started_at"])
+        self.assertIsNotNone(campaign["completed_at"])
+
+    def test_counts_use_index(self):
+        """Probar que el conteo por estado usa el índice"""
+        plan = self.db.execute_query(
+            "EXPLAIN QUERY PLAN SELECT status, COUNT(*) FROM campaign_contacts "
+            "WHERE campaign_id = ? GROUP BY status", ("camp-1",)
+        )
+        self.assertIn("idx_campaign_contacts_status", " ".join(row["detail"] for row in plan))
+
+
+class TestCampaignProcessor(CampaignTestCase):
+    """Tests para el flujo completo de una campaña"""
+
+    def setUp(self):
+        """Configurar antes de cada test"""
+        super().setUp()
+        self.db = self.make_db()
+        self.sender = mock.Mock()
+        self.sender.send_sms.return_value = {"code": 0}
+        self.processor = CampaignProcessor(db=self.db, sms_sender=self.sender)
+
+    def tearDown(self):
+        """Limpiar después de cada test"""
+        self.processor.writer.stop()
+        super().tearDown()
+
+    def test_import_process_and_send(self):
+        """Probar importación, procesamiento y envío persistidos"""
+        path = self.write_csv()
+        self.processor.register_import("import-1", path, scan_file(path).to_dict(), "contactos.csv")
+        self.assertTrue(self.processor.create_campaign("camp-1", "Promo", "import-1", "Hola {{nombre}}")["success"])
+        self.assertFalse(self.processor.create_campaign("camp-2", "Promo", "no-existe", "x")["success"])
+
+        result = self.processor.process_import("camp-1")
+        self.assertTrue(result["success"])
+        self.assertEqual(result["total_contacts"], 3)
+        self.assertEqual(self.db.get_campaign("camp-1")["status"], "ready")
+
+        with self.no_pacing():
+            self.assertTrue(self.processor.send_campaign("camp-1")["success"])
+            self.wait_for("camp-1")
+
+        self.assertEqual(self.sender.send_sms.call_count, 3)
+        self.assertEqual(self.db.get_campaign_counts("camp-1"), {"sent": 3})
+        self.assertEqual(self.db.get_campaign("camp-1")["status"], "completed")
+
+    def test_no_reprocess_while_sending(self):
+        """Probar que no se reemplazan los contactos de una campaña en envío"""
+        path = self.write_csv()
+        self.processor.register_import("import-1", path, scan_file(path).to_dict(), "contactos.csv")
+        self.processor.create_campaign("camp-1", "Promo", "import-1", "Hola {{nombre}}")
+        self.processor.process_import("camp-1")
+
+        self.db.update_campaign_status("camp-1", "sending")
+        self.assertFalse(self.processor.process_import("camp-1")["success"])
+        self.assertFalse(self.processor.process_contacts("camp-1", [], "Hola")["success"])
+
+        self.db.update_campaign_status("camp-1", "ready")
+        self.db.acquire_campaign_lease("camp-1", "otro-proceso", 60)
+        self.assertFalse(self.processor.process_import("camp-1")["success"])
+        self.assertEqual(self.db.get_campaign_counts("camp-1"), {"pending": 3})
+
+
+    def test_send_only_once_per_campaign(self):
+        """Probar que dos envíos simultáneos de la misma campaña no duplican SMS"""
+        path = self.write_csv()
+        self.processor.register_import("import-1", path, scan_file(path).to_dict(), "contactos.csv")
+        self.processor.create_campaign("camp-1", "Promo", "import-1", "Hola {{nombre}}")
+        self.processor.process_import("camp-1")
+
+        release = threading.Event()
+        self.sender.send_sms.side_effect = lambda **kw: release.wait(5) and {"code": 0}
+        with self.no_pacing():
+            self.assertTrue(self.processor.send_campaign("camp-1")["success"])
+            # Otro hilo del mismo worker, con el envío aún en curso
+            self.assertFalse(self.processor.send_campaign("camp-1")["success"])
+            self.assertFalse(self.processor.resume_campaign("camp-1")["success"])
+            self.assertFalse(self.db.acquire_campaign_lease("camp-1", self.processor.owner, 60))
+            release.set()
+            self.wait_for("camp-1")
+
+        self.assertEqual(self.sender.send_sms.call_count, 3)
+        self.assertEqual(self.processor.active_campaigns, set())
+
+
+class TestCampaignResume(CampaignTestCase):
+    """Tests para reanudar campañas interrumpidas"""
+
+    def setUp(self):
+        """Configurar una campaña que se cayó a mitad del envío"""
+        super().setUp()
+        self.db = self.make_db()
+        self.sender = SMSSender(storage=MemoryStorage())
+        self.sender.api = mock.Mock()
+        self.sender.api.send_sms.side_effect = lambda **kw: {"code": 0, "id": f"SMS_{kw['numbers'][0]}"}
+        self.processor = CampaignProcessor(db=self.db, sms_sender=self.sender)
+
+        self.db.save_campaign("camp-1", "Promo", None, "Hola")
+        self.db.save_campaign_contacts_bulk(
+            {"id": f"c{i}", "campaign_id": "camp-1", "seq": i, "numero": f"57300{i:07d}",
+             "processed_message": f"Hola {i}"}
+            for i in range(1, 11)
+        )
+        self.db.update_campaign_status("camp-1", "sending", total=10)
+        self.db.acquire_campaign_lease("camp-1", "proceso-caido", 60)
+        self.db.execute_update("UPDATE dynamic_campaigns SET heartbeat_at = 0 WHERE id = 'camp-1'")
+
+        # Checkpoint en seq 3; el 4 quedó marcado después y el 5 llegó al
+        # gateway pero su estado se perdió con el proceso
+        self.db.update_campaign_contacts_bulk({"id": f"c{i}", "status": "sent"} for i in range(1, 5))
+        self.db.save_campaign_checkpoints_bulk([{"campaign_id": "camp-1", "last_seq": 3, "sent": 3}])
+        self.sender.idempotency.begin("campaign:camp-1:c5:1")
+        self.sender.idempotency.complete("campaign:camp-1:c5:1", {"code": 0, "sms_count": 1})
+
+    def tearDown(self):
+        """Limpiar después de cada test"""
+        self.processor.writer.stop()
+        super().tearDown()
+
+    def test_resume_without_duplicates(self):
+        """Probar que se continúa desde el checkpoint sin reenviar"""
+        with self.no_pacing():
+            result = self.processor.resume_interrupted_campaigns()
+            self.assertEqual(result["resumed"], ["camp-1"])
+            self.wait_for("camp-1")
+
+        sent_numbers = [call.kwargs["numbers"][0] for call in self.sender.api.send_sms.call_args_list]
+        print(f"\n✓ Reenviados tras reanudar: {len(sent_numbers)}")
+        self.assertEqual(sent_numbers, [f"57300{i:07d}" for i in range(6, 11)])
+        self.assertEqual(self.processor.campaign_status["camp-1"].sent, 10)
+        self.assertEqual(self.db.get_campaign_counts("camp-1"), {"sent": 10})
+        self.assertEqual(self.db.get_campaign_checkpoints("camp-1")[0]["last_seq"], 10)
+        campaign = self.db.get_campaign("camp-1")
+        self.assertEqual((campaign["status"], campaign["owner"]), ("completed", None))
+
+    def test_sent_state_is_durable_before_next_send(self):
+        """Probar que lo enviado se confirma con el checkpoint, sin depender de las claves"""
+        recorded = []
+
+        def send(**kw):
+            counts = self.db.get_campaign_counts("camp-1")
+            recorded.append((counts.get("sent", 0), self.db.get_campaign_checkpoints("camp-1")[0]["last_seq"]))
+            return {"code": 0, "id": f"SMS_{kw['numbers'][0]}"}
+
+        self.sender.api.send_sms.side_effect = send
+        # Las claves vencieron: solo cuenta el estado de cada contacto
+        self.sender.db.idempotency_keys.clear()
+        with self.no_pacing():
+            self.assertTrue(self.processor.resume_campaign("camp-1")["success"])
+            self.wait_for("camp-1")
+
+        # c4 ya estaba marcado: el cursor lo cruza con el envío de c5
+        self.assertEqual(recorded, [(4, 3)] + [(4 + i, 4 + i) for i in range(1, 6)])
+        self.assertEqual(self.db.get_campaign_counts("camp-1"), {"sent": 10})
+
+    def test_in_progress_send_is_retried(self):
+        """Probar que un envío en curso en otro intento no marca el contacto como fallido"""
+        self.sender.db.idempotency_keys.clear()
+        self.sender.idempotency.begin("campaign:camp-1:c5:1")
+        with self.no_pacing():
+            self.assertTrue(self.processor.resume_campaign("camp-1")["success"])
+            self.wait_for("camp-1", status="failed")
+
+        self.assertEqual(self.db.get_campaign_counts("camp-1"), {"sent": 4, "pending": 6})
+        self.assertEqual(self.db.get_campaign_checkpoints("camp-1")[0]["last_seq"], 4)
+
+        self.sender.idempotency.release("campaign:camp-1:c5:1")
+        with self.no_pacing():
+            self.assertTrue(self.processor.resume_campaign("camp-1")["success"])
+            self.wait_for("camp-1")
+        self.assertEqual(self.db.get_campaign_counts("camp-1"), {"sent": 10})
+
+    def test_live_lease_blocks_resume(self):
+        """Probar que no se reanuda una campaña con dueño vivo"""
+        self.db.execute_update("UPDATE dynamic_campaigns SET heartbeat_at = ? WHERE id = 'camp-1'",
+                               (time.time(),))
+        result = self.processor.resume_interrupted_campaigns()
+        self.assertEqual(result, {"resumed": [], "skipped": ["camp-1"]})
+        self.sender.api.send_sms.assert_not_called()
+
+
+class TestCampaignProgress(CampaignTestCase):
+    """Tests para el progreso compartido y el stream SSE"""
+
+    def setUp(self):
+        """Configurar una campaña a mitad del envío"""
+        super().setUp()
+        self.db = self.make_db()
+        self.processor = CampaignProcessor(db=self.db, sms_sender=mock.Mock())
+        self.db.save_campaign("camp-1", "Promo", None, "Hola")
+        self.db.update_campaign_status("camp-1", "sending", total=10)
+        self.db.save_campaign_checkpoints_bulk([
+            {"campaign_id": "camp-1", "shard": 0, "last_seq": 4, "sent": 3, "failed": 1},
+            {"campaign_id": "camp-1", "shard": 1, "last_seq": 6, "sent": 2, "failed": 0}
+        ])
+
+    def tearDown(self):
+        """Limpiar después de cada test"""
+        self.processor.writer.stop()
+        super().tearDown()
+
+    def test_progress_shared_between_processes(self):
+        """Probar que otra instancia (otro worker) ve el mismo progreso"""
+        other = CampaignProcessor(db=Database(self.db.db_path), sms_sender=mock.Mock())
+        try:
+            progress = other.get_progress("camp-1")
+        finally:
+            other.writer.stop()
+
+        self.assertEqual(progress, self.processor.get_progress("camp-1"))
+        self.assertEqual((progress["status"], progress["sent"], progress["failed"]), ("sending", 5, 1))
+        self.assertEqual(progress["percentage"], 60)
+        self.assertEqual(self.processor.get_progress("no-existe")["status"], "unknown")
+
+    def test_watch_progress_yields_deltas(self):
+        """Probar que solo se entregan los campos que cambiaron"""
+        # Cada pausa del seguimiento aplica el siguiente cambio
+        steps = [
+            lambda: self.db.save_campaign_checkpoints_bulk([
+                {"campaign_id": "camp-1", "shard": 0, "last_seq": 5, "sent": 4, "failed": 1}
+            ]),
+            lambda: None,
+            lambda: self.db.update_campaign_status("camp-1", "completed")
+        ]
+
+        with mock.patch("campaign_processor.time",
+                        SimpleNamespace(monotonic=time.monotonic, sleep=lambda seconds: steps.pop(0)())):
+            deltas = list(self.processor.watch_progress("camp-1", interval=0, max_seconds=10))
+
+        self.assertEqual(deltas[0]["sent"], 5)
+        self.assertIn("completed_at", deltas[0])
+        self.assertEqual(deltas[1], {"sent": 6, "percentage": 70})
+        self.assertEqual(deltas[2], {})
+        self.assertEqual(deltas[3]["status"], "completed")
+        self.assertEqual(len(deltas), 4)
+
+    def test_watch_progress_is_bounded(self):
+        """Probar que el seguimiento termina al cumplirse max_seconds"""
+        deltas = list(self.processor.watch_progress("camp-1", interval=0, max_seconds=0))
+        self.assertEqual(len(deltas), 1)
+
+    def test_progress_stream_endpoint(self):
+        """Probar el endpoint SSE"""
+        from app import app
+        self.db.update_campaign_status("camp-1", "completed")
+        with mock.patch("campaign_processor.campaign_processor", self.processor):
+            response = app.test_client().get("/api/campaigns/camp-1/progress/stream")
+            body = response.get_data(as_text=True)
+
+        self.assertEqual(response.mimetype, "text/event-stream")
+        self.assertEqual(response.headers["Cache-Control"], "no-cache")
+        self.assertTrue(body.startswith("retry: 2000\n\n"))
+        data = json.loads(body.split("data: ", 1)[1].split("\n\n", 1)[0])
+        self.assertEqual((data["status"], data["sent"]), ("completed", 5))
+        self.assertTrue(body.endswith("event: end\ndata: {}\n\n"))
+
+
+class TestCampaignShards(CampaignTestCase):
+    """Tests para el envío repartido por hash del número"""
+
+    def setUp(self):
+        """Configurar una campaña lista para enviar"""
+        super().setUp()
+        self.db = self.make_db()
+        self.numbers = [f"57300{i:07d}" for i in range(1, 31)]
+        self.db.save_campaign("camp-1", "Promo", None, "Hola")
+        self.db.save_campaign_contacts_bulk(
+            {"id": f"c{seq}", "campaign_id": "camp-1", "seq": seq, "numero": numero,
+             "processed_message": f"Hola {seq}"}
+            for seq, numero in enumerate(self.numbers, start=1)
+        )
+        self.db.update_campaign_status("camp-1", "ready", total=len(self.numbers))
+        self.processor = None
+
+    def tearDown(self):
+        """Limpiar después de cada test"""
+        if self.processor:
+            self.processor.writer.stop()
+            if self.processor.sender_pool:
+                self.processor.sender_pool.shutdown()
+        super().tearDown()
+
+    def test_shards_partition_by_number(self):
+        """Probar que cada número cae en un solo shard y en orden"""
+        self.assertEqual(number_shard_key("+57 300 0000001"), number_shard_key("573000000001"))
+
+        seen = []
+        for shard in range(3):
+            contacts = list(self.db.iter_campaign_contacts("camp-1", status=None, shard=shard,
+                                                           shards=3, chunk_size=4))
+            seqs = [c["seq"] for c in contacts]
+            self.assertEqual(seqs, sorted(seqs))
+            self.assertTrue(all(number_shard_key(c["numero"]) % 3 == shard for c in contacts))
+            seen.extend(seqs)
+
+        self.assertEqual(sorted(seen), list(range(1, 31)))
+
+    def test_rate_limiter_spaces_sends(self):
+        """Probar que los limitadores de una misma base comparten los turnos"""
+        sleeps = []
+        fake_time = SimpleNamespace(time=lambda: 100.0, sleep=sleeps.append)
+        # Uno por worker del servidor, misma base de campañas
+        limiters = [SharedRateLimiter(self.db.db_path, rate=4, block=1),
+                    SharedRateLimiter(self.db.db_path, rate=4, block=1)]
+        with mock.patch("campaign_shards.time", fake_time):
+            for limiter in limiters * 2:
+                limiter.acquire()
+        self.assertEqual(sleeps, [0.25, 0.5, 0.75])
+
+    def test_rate_limiter_reserves_blocks(self):
+        """Probar que los turnos se reservan por bloques y un lote ocupa un turno por número"""
+        sleeps = []
+        fake_time = SimpleNamespace(time=lambda: 100.0, sleep=sleeps.append)
+        limiter = SharedRateLimiter(self.db.db_path, rate=4, block=4)
+        with mock.patch("campaign_shards.time", fake_time), \
+                mock.patch.object(Database, "reserve_rate_slot", autospec=True,
+                                  side_effect=Database.reserve_rate_slot) as reserve:
+            for count in (1, 2, 1, 3):
+                limiter.acquire(count)
+            self.assertEqual(reserve.call_count, 2)
+            # Otro limitador toma sus turnos después de los ya reservados
+            SharedRateLimiter(self.db.db_path, rate=4, block=1).acquire()
+        self.assertEqual(sleeps, [0.25, 0.75, 1.0, 2.0])
+
+    def test_resume_keeps_shard_count(self):
+        """Probar que una campaña con checkpoints por shard se envía en esos shards"""
+        self.db.save_campaign_checkpoints_bulk(
+            {"campaign_id": "camp-1", "shard": shard, "last_seq": 0} for shard in range(3)
+        )
+        sender = mock.Mock()
+        sender.send_sms.return_value = {"code": 0}
+        self.processor = CampaignProcessor(db=self.db, sms_sender=sender)
+
+        with self.no_pacing():
+            result = self.processor.send_campaign("camp-1")
+            self.assertEqual(result["shards"], 3)
+            self.wait_for("camp-1")
+
+        sent = [call.kwargs["numbers"][0] for call in sender.send_sms.call_args_list]
+        self.assertEqual(sorted(sent), self.numbers)
+        self.assertEqual(self.processor.campaign_status["camp-1"].sent, 30)
+        checkpoints = self.db.get_campaign_checkpoints("camp-1")
+        self.assertEqual(sum(c["sent"] for c in checkpoints), 30)
+        for checkpoint in checkpoints:
+            last = max(seq for seq, numero in enumerate(self.numbers, start=1)
+                       if number_shard_key(numero) % 3 == checkpoint["shard"])
+            self.assertEqual(checkpoint["last_seq"], last)
+
+    def test_identical_messages_share_a_request(self):
+        """Probar que los mensajes idénticos de una ventana salen en un solo envío"""
+        self.db.execute_update(
+            "UPDATE campaign_contacts SET message = CASE WHEN seq % 2 THEN 'Hola' ELSE 'Chao' END"
+        )
+        sender = mock.Mock()
+        sender.send_sms.return_value = {"code": 0}
+        self.db.save_campaign_checkpoints_bulk([{"campaign_id": "camp-1", "shard": 0, "last_seq": 0}])
+        self.processor = CampaignProcessor(db=self.db, sms_sender=sender)
+
+        with self.no_pacing(), mock.patch("campaign_shards.CAMPAIGN_SEND_WINDOW", 10):
+            self.assertTrue(self.processor.send_campaign("camp-1")["success"])
+            self.wait_for("camp-1")
+
+        calls = [call.kwargs for call in sender.send_sms.call_args_list]
+        print(f"\n✓ 30 contactos en {len(calls)} envíos")
+        self.assertEqual([(c["content"], len(c["numbers"])) for c in calls], [("Hola", 5), ("Chao", 5)] * 3)
+        self.assertEqual(calls[0]["idempotency_key"], "campaign:camp-1:c1:5")
+        self.assertEqual(sorted(n for c in calls for n in c["numbers"]), self.numbers)
+        self.assertEqual(self.db.get_campaign_counts("camp-1"), {"sent": 30})
+        checkpoint = self.db.get_campaign_checkpoints("camp-1")[0]
+        self.assertEqual((checkpoint["last_seq"], checkpoint["sent"]), (30, 30))
+
+    def test_send_with_process_pool(self):
+        """Probar el envío en procesos emisores con resultados agregados"""
+        pool = SenderPool(self.db.db_path, processes=2, rate_limit=0, sender_factory=FakeSender)
+        self.processor = CampaignProcessor(db=self.db, sms_sender=mock.Mock(), sender_pool=pool)
+
+        self.assertEqual(self.processor.send_campaign("camp-1")["shards"], 2)
+        self.wait_for("camp-1", timeout=60)
+
+        rejected = sum(1 for numero in self.numbers if numero.endswith("9"))
+        print(f"\n✓ Pool de 2 procesos: {30 - rejected} enviados, {rejected} rechazados")
+        status = self.processor.campaign_status["camp-1"]
+        self.assertEqual((status.sent, status.failed), (30 - rejected, rejected))
+        self.assertEqual(self.db.get_campaign_counts("camp-1"), {"sent": 30 - rejected, "failed": rejected})
+        self.assertEqual([c["shard"] for c in self.db.get_campaign_checkpoints("camp-1")], [0, 1])
+        progress = self.processor.get_progress("camp-1")
+        self.assertEqual((progress["status"], progress["sent"]), ("completed", 30 - rejected))
+        self.processor.sms_sender.send_sms.assert_not_called()
+
+    def test_broken_pool_is_rebuilt(self):
+        """Probar que el pool se recrea si muere un proceso emisor"""
+        pool = SenderPool(self.db.db_path, processes=1, rate_limit=0, sender_factory=FakeSender)
+        self.addCleanup(pool.shutdown)
+        task = ShardTask("camp-1", 0, 1, "Hola")
+        self.assertEqual(pool.submit(task).result(timeout=60).sent, 27)
+
+        for process in list(pool.executor._processes.values()):
+            process.kill()
+
+        # El primer envío puede fallar si el pool aún no detectó la caída
+        for attempt in range(3):
+            try:
+                result = pool.submit(task).result(timeout=60)
+                break
+            except BrokenProcessPool:
+                continue
+        else:
+            self.fail("El pool no se recreó")
+        self.assertEqual(result.sent, 27)
+
+
+def run_tests():
+    """Ejecutar todos los tests"""
+    loader = unittest.TestLoader()
+    suite = unittest.TestSuite()
+
+    suite.addTests(loader.loadTestsFromTestCase(TestCampaignPipeline))
+    suite.addTests(loader.loadTestsFromTestCase(TestCampaignStore))
+    suite.addTests(loader.loadTestsFromTestCase(TestCampaignProcessor))
+    suite.addTests(loader.loadTestsFromTestCase(TestCampaignResume))
+    suite.addTests(loader.loadTestsFromTestCase(TestCampaignProgress))
+    suite.addTests(loader.loadTestsFromTestCase(TestCampaignShards))
+
+    runner = unittest.TextTestRunner(verbosity=2)
+    result = runner.run(suite)
+
+    return result.wasSuccessful()
+
+
+if __name__ == "__main__":
+    print("\n" + "="*60)
+    print("🧪 TESTS DE CAMPAÑAS")
+    print("="*60)
+
+    success = run_tests()
+
+    print("\n" + "="*60)
+    if success:
+        print("✅ TODOS LOS TESTS PASARON")
+    else:
+        print("❌ ALGUNOS TESTS FALLARON")
+    print("="*60 + "\n")
@@ -0,0 +1,911 @@
+"""
+Tests unitarios para la capa de persistencia
+Verifica conexiones, esquema y consultas de Database
+"""
+import unittest
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+# Agregar parent directory al path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from database import Database, MIGRATIONS, COUNTERS, AggregateQuery, _backfill_message_bodies, _backfill_report_numbers
+from retention import RetentionManager, month_bounds
+import storage
+from storage import StorageBackend, MemoryStorage, TieredStorage, create_storage
+from analytics import Analytics
+from query_profiler import profiler, fingerprint
+from models import (
+    SMS, Report, DataStorage, SMSRecord, ReportRecord, TransactionRecord, SMSStatus,
+    pack_numbers, unpack_numbers, to_epoch
+)
+from report_generator import ReportGenerator, ErrorAnalyzer
+
+
+class DatabaseTestCase(unittest.TestCase):
+    """Base con una base de datos temporal por test"""
+
+    def setUp(self):
+        """Configurar antes de cada test"""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_path = str(Path(self.tmpdir.name) / "test.db")
+        self.db = Database(self.db_path)
+
+    def tearDown(self):
+        """Limpiar después de cada test"""
+        self.db.disconnect()
+        self.tmpdir.cleanup()
+
+
+class TestConnectionPool(DatabaseTestCase):
+    """Tests para el pool de conexiones"""
+
+    def test_wal_mode(self):
+        """Probar que las conexiones usan WAL"""
+        mode = self.db.connection.execute("PRAGMA journal_mode").fetchone()[0]
+        print(f"\n✓ journal_mode: {mode}")
+        self.assertEqual(mode.lower(), "wal")
+
+    def test_connection_per_thread(self):
+        """Probar que cada hilo recibe su propia conexión"""
+        connections = []
+        thread = threading.Thread(target=lambda: connections.append(self.db.connection))
+        thread.start()
+        thread.join()
+        self.assertIsNot(connections[0], self.db.connection)
+
+    def test_concurrent_writers(self):
+        """Probar escrituras y lecturas concurrentes desde varios hilos"""
+        errors = []
+
+        def worker(n):
+            try:
+                db = Database(self.db_path)
+                for i in range(20):
+                    db.save_sms(f"SMS_{n}_{i}", "0152C274", ["3001234567"], "Test")
+                    db.get_statistics()
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        total = self.db.execute_query("SELECT COUNT(*) AS c FROM sms")[0]["c"]
+        print(f"\n✓ SMS concurrentes: {total}, errores: {len(errors)}")
+        self.assertEqual(errors, [])
+        self.assertEqual(total, 160)
+
+
+class TestMigrations(DatabaseTestCase):
+    """Tests para migraciones versionadas"""
+
+    def test_schema_version_recorded(self):
+        """Probar que se registra la última versión"""
+        version = self.db.get_schema_version()
+        print(f"\n✓ Versión de esquema: {version}")
+        self.assertEqual(version, MIGRATIONS[-1][0])
+
+    def test_upgrade_existing_database(self):
+        """Probar migración de un archivo creado sin índices"""
+        legacy_path = str(Path(self.tmpdir.name) / "legacy.db")
+        conn = sqlite3.connect(legacy_path)
+        conn.execute("""
+            CREATE TABLE reports (
+                id TEXT PRIMARY KEY, sms_id TEXT NOT NULL, number TEXT NOT NULL,
+                status TEXT NOT NULL, error_code INTEGER, error_message TEXT,
+                sent_at TIMESTAMP, delivered_at TIMESTAMP,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        conn.execute("INSERT INTO reports (id, sms_id, number, status) VALUES ('R1', 'S1', '300', 'delivered')")
+        conn.commit()
+        conn.close()
+
+        db = Database(legacy_path)
+        self.assertEqual(db.get_schema_version(), MIGRATIONS[-1][0])
+        self.assertEqual(len(db.get_reports_by_sms("S1")), 1)
+        db.disconnect()
+
+    def test_reports_by_sms_uses_index(self):
+        """Probar que get_reports_by_sms no recorre toda la tabla"""
+        plan = self.db.execute_query(
+            "EXPLAIN QUERY PLAN SELECT * FROM reports WHERE sms_id = ? ORDER BY created_at DESC",
+            ("S1",)
+        )
+        details = " ".join(row["detail"] for row in plan)
+        print(f"\n✓ Plan: {details}")
+        self.assertIn("idx_reports_sms_id", details)
+
+
+class TestRecipients(DatabaseTestCase):
+    """Tests para la tabla normalizada de destinatarios"""
+
+    def test_save_sms_stores_recipients(self):
+        """Probar que save_sms guarda destinatarios y su conteo"""
+        self.db.save_sms("SMS_R1", "0152C274", ["3001234567", "3007654321"], "Hola")
+        sms = self.db.get_sms("SMS_R1")
+        recipients = self.db.get_recipients("SMS_R1")
+        print(f"\n✓ Destinatarios: {len(recipients)}")
+        self.assertEqual(sms["recipient_count"], 2)
+        self.assertEqual({r["number"] for r in recipients}, {3001234567, 3007654321})
+
+    def test_lookup_by_number(self):
+        """Probar búsqueda indexada por número"""
+        self.db.save_sms("SMS_A", "0152C274", ["3001234567"], "Uno")
+        self.db.save_sms("SMS_B", "0152C274", ["3001234567", "3007654321"], "Dos")
+        sent = self.db.get_sms_by_number("300-123-4567")
+        self.assertEqual({s["id"] for s in sent}, {"SMS_A", "SMS_B"})
+
+        plan = self.db.execute_query(
+            "EXPLAIN QUERY PLAN SELECT sms_id FROM sms_recipients WHERE number = ?", (1,)
+        )
+        self.assertIn("idx_sms_recipients_number", " ".join(r["detail"] for r in plan))
+
+    def test_report_updates_recipient(self):
+        """Probar que un reporte se refleja en el destinatario"""
+        self.db.save_sms("SMS_C", "0152C274", ["3001234567", "3007654321"], "Tres")
+        self.db.save_report("REP_C", "SMS_C", "3001234567", "delivered")
+        rows = {r["number"]: r for r in self.db.get_recipient_reports("SMS_C")}
+        self.assertEqual(rows[3001234567]["recipient_status"], "delivered")
+        self.assertEqual(rows[3001234567]["report_id"], "REP_C")
+        self.assertIsNone(rows[3007654321]["report_id"])
+
+    def test_report_matches_formatted_numbers(self):
+        """Probar que reportes con '+' o ceros a la izquierda encuentran su destinatario"""
+        self.db.save_sms("SMS_D", "0152C274", ["+573001234567", "03007654321"], "Cuatro")
+        self.db.save_report("REP_1", "SMS_D", "+573001234567", "delivered")
+        self.db.save_report("REP_2", "SMS_D", "03007654321", "failed", error_code=3)
+        rows = {r["number"]: r for r in self.db.get_recipient_reports("SMS_D")}
+        self.assertEqual(rows[573001234567]["report_id"], "REP_1")
+        self.assertEqual((rows[3007654321]["report_id"], rows[3007654321]["error_code"]), ("REP_2", 3))
+
+    def test_latest_report_wins(self):
+        """Probar que con varios reportes del mismo número se usa el más reciente"""
+        self.db.save_sms("SMS_E", "0152C274", ["3001234567"], "Cinco")
+        self.db.save_report("REP_OLD", "SMS_E", "3001234567", "failed")
+        self.db.save_report("REP_NEW", "SMS_E", "+3001234567", "delivered")
+        rows = self.db.get_recipient_reports("SMS_E")
+        self.assertEqual([(r["report_id"], r["report_status"]) for r in rows], [("REP_NEW", "delivered")])
+
+    def test_recipient_reports_use_index(self):
+        """Probar que el cruce de reportes usa el índice por número entero"""
+        plan = self.db.execute_query(
+            "EXPLAIN QUERY PLAN SELECT rowid FROM reports WHERE sms_id = ? AND number_int = ? "
+            "ORDER BY created_at DESC, rowid DESC LIMIT 1", ("SMS", 1)
+        )
+        self.assertTrue(any("idx_reports_sms_number_int" in row["detail"] for row in plan))
+
+    def test_backfill_report_numbers(self):
+        """Probar que la migración calcula number_int de reportes antiguos"""
+        self.db.execute_update("INSERT INTO reports (id, sms_id, number, status) VALUES ('OLD', 'S', '+0300123', 'ok')")
+        with self.db.transaction() as connection:
+            _backfill_report_numbers(connection, chunk_size=1)
+        self.assertEqual(self.db.execute_query("SELECT number_int FROM reports")[0]["number_int"], 300123)
+
+    def test_backfill_from_legacy_numbers(self):
+        """Probar que la migración puebla destinatarios de filas antiguas"""
+        legacy_path = str(Path(self.tmpdir.name) / "legacy_sms.db")
+        conn = sqlite3.connect(legacy_path)
+        conn.execute("""
+            CREATE TABLE sms (
+                id TEXT PRIMARY KEY, account TEXT NOT NULL, numbers TEXT NOT NULL,
+                content TEXT NOT NULL, status TEXT DEFAULT 'pending', sender TEXT,
+                sendtime TEXT, sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                delivered_count INTEGER DEFAULT 0, failed_count INTEGER DEFAULT 0
+            )
+        """)
+        conn.execute("INSERT INTO sms (id, account, numbers, content) "
+                     "VALUES ('OLD', '0152C274', '3001234567,3007654321,3009999999', 'x')")
+        conn.commit()
+        conn.close()
+
+        db = Database(legacy_path)
+        self.assertEqual(db.get_sms("OLD")["recipient_count"], 3)
+        self.assertEqual(len(db.get_recipients("OLD")), 3)
+        db.disconnect()
+
+
+class TestBulkOperations(DatabaseTestCase):
+    """Tests para las operaciones masivas"""
+
+    def test_save_sms_bulk_from_generator(self):
+        """Probar que un generador se guarda en bloques con sus destinatarios"""
+        records = (
+            {"sms_id": f"SMS_{i}", "account": "0152C274",
+             "numbers": [f"300{i:07d}", f"301{i:07d}"], "content": "Masivo"}
+            for i in range(25)
+        )
+        counts = self.db.save_sms_bulk(records, chunk_size=10)
+        self.assertEqual(counts, [10, 10, 5])
+        recipients = self.db.execute_query("SELECT COUNT(*) AS c FROM sms_recipients")[0]["c"]
+        self.assertEqual(recipients, 50)
+        self.assertEqual(self.db.get_sms("SMS_3")["recipient_count"], 2)
+
+    def test_reports_bulk_updates_recipients(self):
+        """Probar reportes masivos y su reflejo en los destinatarios"""
+        self.db.save_sms("SMS_R", "0152C274", ["3001234567", "3007654321"], "Hola")
+        counts = self.db.save_reports_bulk([
+            {"report_id": "R1", "sms_id": "SMS_R", "number": "3001234567", "status": "delivered"},
+            {"report_id": "R2", "sms_id": "SMS_R", "number": "3007654321", "status": "failed",
+             "error_code": 5}
+        ])
+        self.assertEqual(counts, [2])
+        statuses = {r["number"]: r["status"] for r in self.db.get_recipients("SMS_R")}
+        self.assertEqual(statuses, {3001234567: "delivered", 3007654321: "failed"})
+
+    def test_ignore_existing(self):
+        """Probar que ignore_existing omite IDs repetidos"""
+        tx = [{"transaction_id": "TX_1", "operation": "send_sms", "sms_count": 1}]
+        self.db.save_transactions_bulk(tx)
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.db.save_transactions_bulk(tx)
+        self.assertEqual(self.db.save_transactions_bulk(tx, ignore_existing=True), [0])
+
+    def test_failed_bulk_rolls_back(self):
+        """Probar que un error revierte todos los bloques"""
+        records = [
+            {"sms_id": "DUP", "account": "0152C274", "numbers": ["3001234567"], "content": "x"},
+            {"sms_id": "DUP", "account": "0152C274", "numbers": ["3001234567"], "content": "x"}
+        ]
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.db.save_sms_bulk(records, chunk_size=1)
+        self.assertIsNone(self.db.get_sms("DUP"))
+
+    def test_nested_transaction_commits_once(self):
+        """Probar que execute_update no confirma dentro de transaction()"""
+        with self.assertRaises(RuntimeError):
+            with self.db.transaction():
+                self.db.save_balance("0152C274", 10.0)
+                self.db.update_sms_status_bulk([{"sms_id": "NADA", "status": "sent"}])
+                raise RuntimeError("abortar")
+        self.assertEqual(self.db.get_balance_history("0152C274"), [])
+
+
+class TestCounters(DatabaseTestCase):
+    """Tests para los contadores de estadísticas"""
+
+    def test_triggers_track_inserts_updates_deletes(self):
+        """Probar que los triggers mantienen los contadores"""
+        self.db.save_sms("SMS_1", "0152C274", ["3001234567"], "Uno")
+        self.db.save_sms("SMS_2", "0152C274", ["3007654321"], "Dos")
+        self.db.update_sms_status("SMS_1", "failed")
+        self.db.save_report("REP_1", "SMS_2", "3007654321", "delivered")
+        self.db.save_task("TASK_1", "0152C274", 1, ["3001234567"], "Tarea")
+        self.db.save_transaction("TX_1", "send_sms", sms_count=1)
+        self.db.execute_update("DELETE FROM sms WHERE id = ?", ("SMS_2",))
+
+        self.assertEqual(self.db.get_statistics(), {
+            "total_sms": 1, "sent_sms": 0, "total_reports": 1,
+            "delivered_reports": 1, "active_tasks": 1, "total_transactions": 1
+        })
+
+    def test_rebuild_repairs_drift(self):
+        """Probar que rebuild_counters corrige contadores desviados"""
+        self.db.save_sms("SMS_1", "0152C274", ["3001234567"], "Uno")
+        self.db.execute_update("UPDATE counters SET value = 99 WHERE name = 'total_sms'")
+        self.assertEqual(self.db.get_statistics()["total_sms"], 99)
+        self.assertEqual(self.db.rebuild_counters()["total_sms"], 1)
+
+
+class TestPagination(DatabaseTestCase):
+    """Tests para paginación por clave y lectura en bloques"""
+
+    def setUp(self):
+        """Configurar historial de prueba"""
+        super().setUp()
+        # Mismo sent_at para todos: el orden lo desempata el id
+        self.db.save_sms_bulk(
+            {"sms_id": f"SMS_{i:03d}", "account": "0152C274",
+             "numbers": ["3001234567"], "content": "Historial"}
+            for i in range(25)
+        )
+
+    def test_pages_cover_history_once(self):
+        """Probar que recorrer los cursores devuelve cada SMS una vez"""
+        seen = []
+        cursor = None
+        pages = 0
+        while True:
+            page, cursor = self.db.get_sms_page(limit=10, cursor=cursor)
+            seen.extend(s["id"] for s in page)
+            pages += 1
+            if cursor is None:
+                break
+
+        self.assertEqual(pages, 3)
+        self.assertEqual(seen, [f"SMS_{i:03d}" for i in reversed(range(25))])
+
+    def test_non_positive_limit(self):
+        """Probar que un límite de 0 o negativo devuelve una página de un SMS"""
+        for limit in (0, -5):
+            page, cursor = self.db.get_sms_page(limit=limit)
+            self.assertEqual([s["id"] for s in page], ["SMS_024"])
+            self.assertIsNotNone(cursor)
+
+    def test_invalid_cursor(self):
+        """Probar que un cursor inválido se rechaza"""
+        with self.assertRaises(ValueError):
+            self.db.get_sms_page(cursor="no-es-un-cursor")
+
+    def test_page_uses_index(self):
+        """Probar que la página siguiente busca en el índice (sin OFFSET)"""
+        plan = self.db.execute_query(
+            "EXPLAIN QUERY PLAN SELECT * FROM sms WHERE (sent_at, id) < (?, ?) "
+            "ORDER BY sent_at DESC, id DESC LIMIT 10", ("2030-01-01", "X")
+        )
+        self.assertTrue(any("idx_sms_sent_at" in row["detail"] for row in plan))
+
+    def test_iter_query_streams_all_rows(self):
+        """Probar que iter_query entrega todas las filas en bloques"""
+        rows = self.db.iter_query("SELECT id FROM sms", chunk_size=7)
+        self.assertFalse(isinstance(rows, list))
+        self.assertEqual(sum(1 for _ in rows), 25)
+
+
+class TestRetention(DatabaseTestCase):
+    """Tests para la retención por bloques y el archivo mensual"""
+
+    def setUp(self):
+        """Configurar historial con meses antiguos"""
+        super().setUp()
+        self.db.save_sms_bulk(
+            {"sms_id": f"OLD_{i}", "account": "0152C274",
+             "numbers": [f"300{i:07d}"], "content": "Viejo"}
+            for i in range(12)
+        )
+        for i in range(12):
+            self.db.execute_update(
+                "UPDATE sms SET sent_at = ? WHERE id = ?",
+                (f"2020-{1 + i % 2:02d}-15 10:00:00", f"OLD_{i}")
+            )
+        self.db.save_sms("NEW", "0152C274", ["3001234567"], "Nuevo")
+        self.retention = RetentionManager(
+            self.db, archive_dir=str(Path(self.tmpdir.name) / "archive"),
+            chunk_size=5, pause_ms=0
+        )
+
+    def test_month_bounds_rolls_over_year(self):
+        """Probar el cambio de año al calcular el mes siguiente"""
+        self.assertEqual(month_bounds("2025-12-31 23:59:59"),
+                         ("2025-12-01 00:00:00", "2026-01-01 00:00:00"))
+
+    def test_cleanup_deletes_in_chunks(self):
+        """Probar que cleanup_old_data borra SMS antiguos y sus destinatarios"""
+        self.assertEqual(self.db.cleanup_old_data(days=30), 12)
+        self.assertIsNotNone(self.db.get_sms("NEW"))
+        recipients = self.db.execute_query("SELECT COUNT(*) AS c FROM sms_recipients")[0]["c"]
+        self.assertEqual(recipients, 1)
+
+    def test_archive_by_month(self):
+        """Probar que archivar mueve cada mes a su archivo consultable"""
+        removed = self.retention.purge(days=30, archive=True)
+        self.assertEqual(removed["sms"], 12)
+        self.assertEqual(self.retention.list_archives(), ["2020_01", "2020_02"])
+
+        with self.retention.attached("2020_01") as alias:
+            archived = self.db.execute_query(f"SELECT COUNT(*) AS c FROM {alias}.sms")[0]["c"]
+            recipients = self.db.execute_query(
+                f"SELECT COUNT(*) AS c FROM {alias}.sms_recipients"
+            )[0]["c"]
+        self.assertEqual((archived, recipients), (6, 6))
+        self.assertEqual(self.db.get_statistics()["total_sms"], 1)
+
+    def test_incremental_vacuum_enabled(self):
+        """Probar que las bases nuevas admiten vacuum incremental"""
+        self.db.cleanup_old_data(days=30)
+        self.assertEqual(self.db.execute_query("PRAGMA auto_vacuum")[0]["auto_vacuum"], 2)
+        self.assertGreaterEqual(self.retention.incremental_vacuum(), 0)
+
+
+class TestRollups(DatabaseTestCase):
+    """Tests para los rollups de transacciones"""
+
+    def setUp(self):
+        """Configurar transacciones en dos días"""
+        super().setUp()
+        self.db.save_transactions_bulk([
+            {"transaction_id": "TX_1", "operation": "send_sms", "sms_count": 10},
+            {"transaction_id": "TX_2", "operation": "send_sms", "sms_count": 5},
+            {"transaction_id": "TX_3", "operation": "task", "sms_count": 1},
+        ])
+        self.db.execute_update(
+            "INSERT INTO transactions (id, operation, sms_count, created_at) "
+            "VALUES ('TX_OLD', 'send_sms', 7, '2020-01-02 08:30:00')"
+        )
+
+    def test_trigger_maintains_rollups(self):
+        """Probar que cada inserción actualiza los buckets"""
+        daily = {row["day"]: row["sms"] for row in self.db.get_daily_sms(10)}
+        self.assertEqual(daily["2020-01-02"], 7)
+        self.assertEqual(sum(daily.values()), 23)
+        # Las otras tres transacciones caen en la hora actual (UTC)
+        now_hour = int(self.db.execute_query("SELECT strftime('%H', 'now') AS h")[0]["h"])
+        self.assertEqual(self.db.get_hourly_sms()[8], 7 + (16 if now_hour == 8 else 0))
+
+    def test_rebuild_matches_trigger(self):
+        """Probar que reconstruir produce los mismos totales"""
+        before = self.db.get_operation_totals()
+        self.db.rebuild_rollups()
+        self.assertEqual(self.db.get_operation_totals(), before)
+        self.assertEqual(before[0], {"operation": "send_sms", "count": 3, "total_sms": 22})
+
+    def test_rebuild_keeps_purged_history(self):
+        """Probar que reconstruir no borra los buckets ya purgados"""
+        self.db.execute_update(
+            "INSERT INTO transactions (id, operation, sms_count, created_at) "
+            "VALUES ('TX_OLD2', 'send_sms', 3, '2020-01-03 09:00:00')"
+        )
+        self.db.execute_update("DELETE FROM transactions WHERE id = 'TX_OLD'")
+        self.db.rebuild_rollups()
+        daily = {row["day"]: row["sms"] for row in self.db.get_daily_sms(10)}
+        self.assertEqual(daily["2020-01-02"], 7)
+        self.assertEqual(daily["2020-01-03"], 3)
+        self.assertEqual(sum(daily.values()), 26)
+
+    def test_analytics_reads_rollups(self):
+        """Probar que Analytics conserva el formato de sus resultados"""
+        analytics = Analytics()
+        analytics.db = self.db
+        top = analytics.get_top_operations(limit=1)
+        self.assertEqual(top[0]["operation"], "send_sms")
+        self.assertAlmostEqual(top[0]["avg_sms_per_operation"], 22 / 3)
+        daily = analytics.get_daily_distribution(days=1)
+        self.assertEqual(len(daily), 1)
+        self.assertGreater(next(iter(daily)).year, 2020)
+
+
+class TestAggregateQuery(DatabaseTestCase):
+    """Tests para las agregaciones resueltas en SQLite"""
+
+    def setUp(self):
+        """Configurar reportes de entrega"""
+        super().setUp()
+        self.db.save_sms("SMS_A", "0152C274", ["3001234567", "3007654321", "3009999999"], "Hola")
+        self.db.save_reports_bulk([
+            {"report_id": "R1", "sms_id": "SMS_A", "number": "3001234567", "status": "delivered"},
+            {"report_id": "R2", "sms_id": "SMS_A", "number": "3007654321", "status": "failed",
+             "error_code": -1},
+            {"report_id": "R3", "sms_id": "SMS_A", "number": "3009999999", "status": "failed",
+             "error_code": -1},
+        ])
+
+    def test_totals_and_groups(self):
+        """Probar conteos condicionales y agrupación"""
+        totals = self.db.aggregate(
+            AggregateQuery("reports").count("total")
+            .count_where("delivered", "status = ?", "delivered")
+            .where("sms_id = ?", "SMS_A")
+        )
+        self.assertEqual(totals, {"total": 3, "delivered": 1})
+
+        groups = self.db.aggregate(
+            AggregateQuery("reports").count("n").group_by("status")
+        )
+        self.assertEqual({g["status"]: g["n"] for g in groups}, {"delivered": 1, "failed": 2})
+
+    def test_empty_sum_is_zero(self):
+        """Probar que SUM sin filas devuelve 0"""
+        totals = self.db.aggregate(AggregateQuery("transactions").count().sum("sms", "sms_count"))
+        self.assertEqual(totals, {"total": 0, "sms": 0})
+
+    def test_reports_keep_shape(self):
+        """Probar que los reportes conservan su formato"""
+        generator = ReportGenerator()
+        generator.db = self.db
+        delivery = generator.generate_delivery_report("SMS_A")
+        self.assertEqual(delivery["summary"]["total_reports"], 3)
+        self.assertEqual(len(delivery["details"]), 3)
+        self.assertEqual(generator.generate_sms_report()["summary"]["total_numbers"], 3)
+
+        analyzer = ErrorAnalyzer()
+        analyzer.db = self.db
+        analysis = analyzer.analyze_failures()
+        self.assertEqual(analysis["summary"]["total_failures"], 2)
+        self.assertEqual(analysis["error_distribution"]["-1"]["percentage"], 100)
+
+    def test_report_details_are_paged(self):
+        """Probar que el detalle es una página y los totales cubren toda la ventana"""
+        generator = ReportGenerator()
+        generator.db = self.db
+        first = generator.generate_delivery_report("SMS_A", details_limit=2)
+        self.assertEqual(first["summary"]["total_reports"], 3)
+        self.assertEqual((len(first["details"]), first["page"]["next_offset"]), (2, 2))
+
+        rest = generator.generate_delivery_report("SMS_A", details_limit=2, offset=2)
+        self.assertEqual((len(rest["details"]), rest["page"]["next_offset"]), (1, None))
+        ids = {r["id"] for r in first["details"] + rest["details"]}
+        self.assertEqual(ids, {"R1", "R2", "R3"})
+
+        totals_only = generator.generate_delivery_report(details_limit=0)
+        self.assertEqual((totals_only["summary"]["total_reports"], totals_only["details"]), (3, []))
+        sms = generator.generate_sms_report(details_limit=0)
+        self.assertEqual((sms["summary"]["total_sms"], sms["details"]), (1, []))
+
+
+class TestQueryProfiler(DatabaseTestCase):
+    """Tests para el perfilador de consultas"""
+
+    def setUp(self):
+        """Activar el perfilador con umbral cero"""
+        super().setUp()
+        self.previous = (profiler.enabled, profiler.slow_query_ms)
+        profiler.enabled, profiler.slow_query_ms = True, 0
+        profiler.reset()
+
+    def tearDown(self):
+        """Restaurar el perfilador"""
+        profiler.enabled, profiler.slow_query_ms = self.previous
+        profiler.reset()
+        super().tearDown()
+
+    def test_fingerprint_groups_literals(self):
+        """Probar que literales y listas IN no separan huellas"""
+        self.assertEqual(
+            fingerprint("SELECT * FROM sms WHERE id IN (?, ?, ?) AND status = 'sent'"),
+            fingerprint("SELECT  *  FROM sms WHERE id IN (?) AND status = 'failed'")
+        )
+
+    def test_stats_and_plan(self):
+        """Probar que se acumulan ejecuciones y se captura el plan"""
+        self.db.get_reports_by_sms("SMS_1")
+        self.db.get_reports_by_sms("SMS_2")
+        report = profiler.get_report()
+        stats = next(q for q in report["queries"] if q["query"].startswith("SELECT * FROM reports"))
+        self.assertEqual(stats["count"], 2)
+        self.assertTrue(any("idx_reports_sms_id" in line for line in stats["plan"]))
+
+    def test_dump(self):
+        """Probar que el perfil se guarda en un archivo"""
+        self.db.get_statistics()
+        path = profiler.dump(str(Path(self.tmpdir.name) / "profile.json"))
+        self.assertTrue(Path(path).exists())
+
+
+class TestRecords(DatabaseTestCase):
+    """Tests para los registros con __slots__"""
+
+    def test_query_records(self):
+        """Probar que las filas se leen como atributos sin dict por fila"""
+        self.db.save_sms("SMS_1", "0152C274", ["3001234567", "3007654321"], "Hola")
+        record = self.db.query_records("SELECT * FROM sms_full", (), SMSRecord)[0]
+        self.assertFalse(hasattr(record, "__dict__"))
+        self.assertEqual(record.recipient_count, 2)
+        self.assertEqual(record["status"], "sent")
+        # El cuerpo deduplicado llega resuelto desde message_bodies
+        self.assertEqual(record.content, "Hola")
+
+        sms = record.to_model()
+        self.assertIsInstance(sms, SMS)
+        self.assertEqual(sms.number_list(), ["3001234567", "3007654321"])
+        self.assertEqual(sms.status, SMSStatus.SENT)
+
+    def test_partial_columns(self):
+        """Probar que las columnas no seleccionadas quedan en None"""
+        self.db.save_report("REP_1", "SMS_1", "3001234567", "delivered")
+        record = self.db.query_records("SELECT status, id FROM reports", (), ReportRecord)[0]
+        self.assertEqual((record.id, record.status, record.sms_id), ("REP_1", "delivered", None))
+        self.assertEqual(record.to_model().status, SMSStatus.DELIVERED)
+
+    def test_extra_trailing_columns(self):
+        """Probar que las columnas de más al final del cursor se ignoran"""
+        self.db.save_report("REP_1", "SMS_1", "3001234567", "delivered")
+        record = self.db.query_records("SELECT *, 1 AS extra FROM reports", (), ReportRecord)[0]
+        self.assertEqual((record.id, record.status), ("REP_1", "delivered"))
+        self.assertFalse(hasattr(record, "extra"))
+
+    def test_compact_models(self):
+        """Probar modelos con __slots__, números en array('q') y fechas epoch"""
+        sms = SMS("SMS_1", ["3001234567", "3007654321"], "Hola", sent_at="2026-01-01 00:00:00")
+        self.assertFalse(hasattr(sms, "__dict__"))
+        self.assertEqual(sms.numbers.typecode, "q")
+        self.assertEqual(sms.sent_at, 1767225600.0)
+        self.assertEqual(sms.to_dict()["numbers"], ["3001234567", "3007654321"])
+
+        # Formatos que no sobreviven como entero se guardan como texto
+        self.assertEqual(pack_numbers(["+573001234567", "0300"]), ("+573001234567", "0300"))
+        self.assertEqual(unpack_numbers(pack_numbers("300,301")), ["300", "301"])
+        self.assertIsNone(to_epoch(""))
+
+    def test_transaction_records(self):
+        """Probar transacciones como registros y su modelo"""
+        self.db.save_transaction("TX_1", "send_sms", sms_count=3)
+        log = self.db.get_transaction_records()[0].to_model()
+        self.assertEqual((log.id, log.sms_count), ("TX_1", 3))
+        self.assertIsNotNone(log.timestamp)
+
+
+class TestReadOnlyPool(DatabaseTestCase):
+    """Tests para el pool de solo lectura"""
+
+    def setUp(self):
+        """Abrir una vista de solo lectura sobre la misma base"""
+        super().setUp()
+        self.reader = Database(self.db_path, read_only=True)
+
+    def tearDown(self):
+        """Cerrar la conexión de lectura"""
+        self.reader.disconnect()
+        super().tearDown()
+
+    def test_reads_see_committed_writes(self):
+        """Probar que el lector ve lo confirmado por el escritor"""
+        self.db.save_sms("SMS_1", "0152C274", ["3001234567"], "Hola")
+        self.assertIsNot(self.reader.connection, self.db.connection)
+        self.assertEqual(self.reader.get_sms("SMS_1")["id"], "SMS_1")
+
+    def test_writes_rejected(self):
+        """Probar que el lector no puede escribir"""
+        with self.assertRaises(sqlite3.OperationalError):
+            self.reader.execute_update("DELETE FROM sms")
+
+    def test_open_read_does_not_block_writer(self):
+        """Probar que una lectura en curso no frena al escritor"""
+        self.db.save_sms_bulk(
+            {"sms_id": f"SMS_{i}", "account": "0152C274", "numbers": ["3001234567"],
+             "content": "x"}
+            for i in range(10)
+        )
+        rows = self.reader.iter_query("SELECT id FROM sms", chunk_size=2)
+        next(rows)  # instantánea abierta
+
+        self.assertTrue(self.db.save_sms("SMS_NEW", "0152C274", ["3001234567"], "Nuevo"))
+        self.assertEqual(1 + sum(1 for _ in rows), 10)
+        self.assertIsNotNone(self.reader.get_sms("SMS_NEW"))
+
+
+class TestMessageBodies(DatabaseTestCase):
+    """Tests para los cuerpos de mensaje deduplicados"""
+
+    def test_same_body_stored_once(self):
+        """Probar que un texto repetido se guarda una sola vez"""
+        self.db.save_sms_bulk(
+            {"sms_id": f"SMS_{i}", "account": "0152C274", "numbers": ["3001234567"],
+             "content": "Promo de fin de mes" if i % 2 else "Recordatorio"}
+            for i in range(20)
+        )
+        bodies = self.db.execute_query("SELECT COUNT(*) AS c FROM message_bodies")[0]["c"]
+        self.assertEqual(bodies, 2)
+        self.assertEqual(self.db.get_sms("SMS_1")["content"], "Promo de fin de mes")
+        page, _ = self.db.get_sms_page(limit=5)
+        self.assertTrue(all(row["content"] for row in page))
+        contents = {row["content"] for row in self.db.get_sms_by_number("3001234567")}
+        self.assertEqual(contents, {"Promo de fin de mes", "Recordatorio"})
+
+    def test_backfill_legacy_rows(self):
+        """Probar que las filas con content propio se mueven a message_bodies"""
+        for sms_id in ("OLD_1", "OLD_2"):
+            self.db.execute_update(
+                "INSERT INTO sms (id, account, numbers, content) VALUES (?, '0152C274', '300', 'Hola')",
+                (sms_id,)
+            )
+        self.assertEqual(self.db.get_sms("OLD_1")["content"], "Hola")
+
+        with self.db.transaction() as connection:
+            _backfill_message_bodies(connection)
+        rows = self.db.execute_query("SELECT content, body_hash FROM sms")
+        self.assertTrue(all(r["content"] == "" and r["body_hash"] for r in rows))
+        self.assertEqual(self.db.get_sms("OLD_2")["content"], "Hola")
+
+    def test_orphan_bodies_purged(self):
+        """Probar que la retención borra los cuerpos que ya nadie usa"""
+        self.db.save_sms("SMS_OLD", "0152C274", ["3001234567"], "Viejo")
+        self.db.save_sms("SMS_NEW", "0152C274", ["3001234567"], "Nuevo")
+        self.db.execute_update(
+            "UPDATE sms SET sent_at = '2020-01-15 10:00:00' WHERE id = 'SMS_OLD'"
+        )
+        self.db.cleanup_old_data(days=30)
+        bodies = self.db.execute_query("SELECT content FROM message_bodies")
+        self.assertEqual([b["content"] for b in bodies], ["Nuevo"])
+
+
+class TestMemoryStorage(unittest.TestCase):
+    """Tests para el motor de almacenamiento en memoria"""
+
+    def setUp(self):
+        """Configurar antes de cada test"""
+        self.storage = MemoryStorage()
+
+    def test_backends_share_interface(self):
+        """Probar que ambos motores cumplen la interfaz"""
+        self.assertIsInstance(self.storage, StorageBackend)
+        self.assertTrue(issubclass(Database, StorageBackend))
+        self.assertIs(create_storage("memory"), create_storage("memory"))
+        with self.assertRaises(ValueError):
+            create_storage("redis")
+
+    def test_history_order_ignores_reads(self):
+        """Probar que leer un SMS no cambia el orden del historial"""
+        for i in range(3):
+            self.storage.save_sms(f"S{i}", "0152C274", ["3001234567"], "Hola")
+        self.storage.get_sms("S0")
+        self.assertEqual([s["id"] for s in self.storage.get_all_sms()], ["S2", "S1", "S0"])
+        self.assertEqual([s["id"] for s in self.storage.get_all_sms(limit=1, offset=1)], ["S1"])
+
+    def test_rows_match_sqlite_columns(self):
+        """Probar que las filas tienen las columnas de las tablas SQLite"""
+        self.storage.save_sms("SMS_1", "0152C274", ["3001234567", "3007654321"], "Hola")
+        self.storage.save_report("REP_1", "SMS_1", "3001234567", "delivered")
+        self.storage.update_sms_status("SMS_1", "delivered", delivered=1)
+
+        sms = self.storage.get_sms("SMS_1")
+        self.assertEqual((sms["status"], sms["recipient_count"]), ("delivered", 2))
+        self.assertEqual(self.storage.get_reports_by_sms("SMS_1")[0]["sms_id"], "SMS_1")
+        self.assertFalse(self.storage.save_sms("SMS_1", "0152C274", ["300"], "Otra"))
+
+        stats = self.storage.get_statistics()
+        self.assertEqual(set(stats), set(COUNTERS))
+        self.assertEqual((stats["total_sms"], stats["delivered_reports"]), (1, 1))
+
+    def test_idempotency_keys(self):
+        """Probar reserva, resultado y liberación de claves"""
+        self.assertTrue(self.storage.claim_idempotency_key("k1", ttl=60))
+        self.assertFalse(self.storage.claim_idempotency_key("k1", ttl=60))
+        self.storage.complete_idempotency_key("k1", {"sent_ids": ["A"]}, ttl=60)
+        self.assertEqual(self.storage.get_idempotency_record("k1")["result"], {"sent_ids": ["A"]})
+
+        self.storage.claim_idempotency_key("k2", ttl=60)
+        self.storage.release_idempotency_key("k2")
+        self.assertIsNone(self.storage.get_idempotency_record("k2"))
+
+
+class TestDataStorage(unittest.TestCase):
+    """Tests para los índices y la capacidad de DataStorage"""
+
+    def test_indexes_and_statistics(self):
+        """Probar índices secundarios y estadísticas incrementales"""
+        data = DataStorage()
+        for i in range(4):
+            data.add_sms(SMS(f"SMS_{i}", ["3001234567"], "Hola", status=SMSStatus.SENT))
+        data.add_report(Report("REP_1", "3001234567", SMSStatus.DELIVERED, sms_id="SMS_1"))
+        data.update_sms_status("SMS_1", SMSStatus.DELIVERED, delivered=1)
+
+        self.assertEqual([r.id for r in data.get_reports_by_sms_id("SMS_1")], ["REP_1"])
+        self.assertEqual([s.id for s in data.get_sms_by_status(SMSStatus.DELIVERED)], ["SMS_1"])
+        self.assertEqual(len(data.get_sms_by_day(datetime.utcnow().date())), 4)
+
+        stats = data.get_statistics()
+        self.assertEqual((stats["sent_messages"], stats["total_delivered"]), (3, 1))
+        self.assertEqual(stats["delivered_reports"], 1)
+
+    def test_lru_eviction(self):
+        """Probar que al superar la capacidad sale el menos usado con sus reportes"""
+        data = DataStorage(max_sms=2)
+        data.add_sms(SMS("A", ["1"], "x"))
+        data.add_sms(SMS("B", ["1"], "x"))
+        data.add_report(Report("REP_B", "1", SMSStatus.DELIVERED, sms_id="B"))
+        data.get_sms("A")
+        data.add_sms(SMS("C", ["1"], "x"))
+
+        self.assertEqual(list(data.sms_messages), ["A", "C"])
+        self.assertEqual(data.reports, {})
+        self.assertEqual(data.get_statistics()["evicted_sms"], 1)
+
+    def test_age_eviction(self):
+        """Probar que los SMS vencidos no se admiten y se descartan"""
+        data = DataStorage(max_age_seconds=3600)
+        old = time.time() - 2 * 86400
+        self.assertFalse(data.add_sms(SMS("OLD", ["1"], "x", sent_at=old)))
+
+        data.add_sms(SMS("AGING", ["1"], "x"))
+        data.sms_messages["AGING"].sent_at = old
+        self.assertIsNone(data.get_sms("AGING"))
+        self.assertEqual(data.get_statistics()["total_sms_messages"], 0)
+
+
+class TestTieredStorage(DatabaseTestCase):
+    """Tests para SQLite con nivel en memoria"""
+
+    def setUp(self):
+        """Configurar motor con capacidad pequeña"""
+        super().setUp()
+        self.tiered = TieredStorage(self.db_path, max_sms=2)
+
+    def test_recent_sms_served_from_memory(self):
+        """Probar que los SMS recientes se leen sin consultar SQLite"""
+        for i in range(3):
+            self.tiered.save_sms(f"SMS_{i}", "0152C274", ["3001234567"], "Hola")
+        self.assertEqual(self.tiered.get_sms("SMS_2")["content"], "Hola")
+        self.assertEqual(self.tiered.get_sms("SMS_0")["content"], "Hola")
+        self.assertEqual(self.tiered.get_hot_stats()["hits"], 1)
+        self.assertEqual(self.tiered.get_hot_stats()["misses"], 1)
+
+    def test_status_updates_reach_memory(self):
+        """Probar que los cambios de estado se reflejan en ambos niveles"""
+        self.tiered.save_sms("SMS_1", "0152C274", ["3001234567"], "Hola")
+        self.tiered.update_sms_status("SMS_1", "delivered", delivered=1)
+        self.assertEqual(self.tiered.get_sms("SMS_1")["status"], "delivered")
+        self.assertEqual(self.db.get_sms("SMS_1")["status"], "delivered")
+
+    def test_tiered_storage_shared_per_file(self):
+        """Probar que create_storage comparte el nivel en memoria por archivo"""
+        first = create_storage("tiered", self.db_path)
+        self.addCleanup(storage._tiered_storages.pop, self.db_path, None)
+        self.assertIs(create_storage("tiered", self.db_path), first)
+        first.save_sms("SMS_1", "0152C274", ["3001234567"], "Hola")
+        create_storage("tiered", self.db_path).update_sms_status("SMS_1", "delivered", delivered=1)
+        self.assertEqual(first.get_sms("SMS_1")["status"], "delivered")
+
+    def test_rollback_discards_memory_changes(self):
+        """Probar que una transacción revertida no deja SMS fantasmas en memoria"""
+        with self.assertRaises(RuntimeError):
+            with self.tiered.transaction():
+                self.tiered.save_sms_bulk([{"sms_id": "SMS_X", "account": "0152C274",
+                                            "numbers": ["3001234567"], "content": "x"}])
+                raise RuntimeError("falla")
+        self.assertIsNone(self.tiered.get_sms("SMS_X"))
+
+    def test_status_applied_to_memory_on_commit(self):
+        """Probar que otro hilo no ve en memoria un estado aún sin confirmar"""
+        self.tiered.save_sms("SMS_1", "0152C274", ["3001234567"], "Hola")
+        seen = []
+
+        def read():
+            seen.append(self.tiered.get_sms("SMS_1")["status"])
+
+        with self.assertRaises(RuntimeError):
+            with self.tiered.transaction():
+                self.tiered.update_sms_status("SMS_1", "delivered", delivered=1)
+                self.tiered.update_sms_status_bulk([{"sms_id": "SMS_1", "status": "failed", "failed": 1}])
+                reader = threading.Thread(target=read)
+                reader.start()
+                reader.join()
+                raise RuntimeError("falla")
+
+        read()
+        with self.tiered.transaction():
+            self.tiered.update_sms_status("SMS_1", "delivered", delivered=1)
+        read()
+        self.assertEqual(seen, ["sent", "sent", "delivered"])
+        self.assertEqual(self.tiered.get_hot_stats()["misses"], 0)
+
+
+def run_tests():
+    """Ejecutar todos los tests"""
+    loader = unittest.TestLoader()
+    suite = unittest.TestSuite()
+
+    suite.addTests(loader.loadTestsFromTestCase(TestConnectionPool))
+    suite.addTests(loader.loadTestsFromTestCase(TestMigrations))
+    suite.addTests(loader.loadTestsFromTestCase(TestRecipients))
+    suite.addTests(loader.loadTestsFromTestCase(TestBulkOperations))
+    suite.addTests(loader.loadTestsFromTestCase(TestCounters))
+    suite.addTests(loader.loadTestsFromTestCase(TestPagination))
+    suite.addTests(loader.loadTestsFromTestCase(TestRetention))
+    suite.addTests(loader.loadTestsFromTestCase(TestRollups))
+    suite.addTests(loader.loadTestsFromTestCase(TestAggregateQuery))
+    suite.addTests(loader.loadTestsFromTestCase(TestQueryProfiler))
+    suite.addTests(loader.loadTestsFromTestCase(TestRecords))
+    suite.addTests(loader.loadTestsFromTestCase(TestReadOnlyPool))
+    suite.addTests(loader.loadTestsFromTestCase(TestMessageBodies))
+    suite.addTests(loader.loadTestsFromTestCase(TestMemoryStorage))
+    suite.addTests(loader.loadTestsFromTestCase(TestDataStorage))
+    suite.addTests(loader.loadTestsFromTestCase(TestTieredStorage))
+
+    runner = unittest.TextTestRunner(verbosity=2)
+    result = runner.run(suite)
+
+    return result.wasSuccessful()
+
+
+if __name__ == "__main__":
+    print("\n" + "="*60)
+    print("🧪 TESTS DE BASE DE DATOS")
+    print("="*60)
+
+    success = run_tests()
+
+    print("\n" + "="*60)
+    if success:
+        print("✅ TODOS LOS TESTS PASARON")
+    else:
+        print("❌ ALGUNOS TESTS FALLARON")
+    print("="*60 + "\n")
@@ -3,8 +3,11 @@ Tests unitarios para el módulo de envío de SMS
 Verifica validación, fragmentación y procesamiento
 """
 import unittest
+import sqlite3
 import sys
+import tempfile
 from pathlib import Path
+from unittest import mock
 
 # Agregar parent directory al path
 sys.path.insert(0, str(Path(__file__).parent.parent))
@@ -12,6 +15,11 @@ sys.path.insert(0, str(Path(__file__).parent.parent))
 from sms_sender import SMSSender, SMSRetry
 from message_processor import MessageProcessor, MessageTemplate
 from sms_queue import SMSQueue, SMSPriority, SMSTask
+from database import Database
+from idempotency import IdempotencyStore, derive_idempotency_key
+from write_behind import RowWriter, WriteBehindWriter, WriteBehindError, DirectWriter
+from storage import MemoryStorage
+from template_engine import compile_template, check_variables
 
 
 class TestSMSSender(unittest.TestCase):
@@ -137,6 +145,51 @@ class TestMessageTemplate(unittest.TestCase):
         self.assertIn("María", result["message"])
 
 
+    def test_render_reports_variables(self):
+        """Probar reporte de variables faltantes y sobrantes"""
+        self.template.register_template("promo", "Hola {{name}}, aprovecha {{discount}}% off")
+        result = self.template.render("promo", {"name": "María", "extra": "x"})
+        self.assertEqual(result["message"], "Hola María, aprovecha {{discount}}% off")
+        self.assertEqual(result["missing_variables"], ["discount"])
+        self.assertEqual(result["unused_variables"], ["extra"])
+
+    def test_render_many(self):
+        """Probar renderización en lote"""
+        self.template.register_template("welcome", "Bienvenido {{name}}")
+        messages = self.template.render_many("welcome", [{"name": "Ana"}, {"name": "Luis"}])
+        self.assertEqual(messages, ["Bienvenido Ana", "Bienvenido Luis"])
+
+
+class TestTemplateEngine(unittest.TestCase):
+    """Tests para el motor de plantillas compiladas"""
+
+    def test_segments(self):
+        """Probar análisis en literales y huecos"""
+        compiled = compile_template("Hola {{name}}, {{name}} tiene {{saldo}}")
+        self.assertEqual(compiled.slots, ["name", "name", "saldo"])
+        self.assertEqual(compiled.variables, ["name", "saldo"])
+        self.assertEqual(compiled.literal_length, len("Hola ,  tiene "))
+        self.assertIs(compiled, compile_template("Hola {{name}}, {{name}} tiene {{saldo}}"))
+
+    def test_render_literal_braces_and_values(self):
+        """Probar llaves literales, valores no texto y sin re-sustitución"""
+        compiled = compile_template("{json} {{nombre cliente}}: {{monto}} {{otro}}")
+        message = compiled.render({"nombre cliente": "{{monto}}", "monto": 150, "otro": None})
+        self.assertEqual(message, "{json} {{monto}}: 150 None")
+
+    def test_length_bounds(self):
+        """Probar cota de longitud precalculada"""
+        compiled = compile_template("Hola {{name}}!")
+        self.assertEqual(compiled.max_length({"name": 10}), len("Hola !") + 10)
+        self.assertLessEqual(len(compiled.render({"name": "x" * 10})), compiled.max_length({"name": 10}))
+
+    def test_check_variables(self):
+        """Probar reporte agregado de variables"""
+        compiled = compile_template("{{a}} {{b}}")
+        report = check_variables(compiled, [{"a": 1, "b": 2}, {"a": 1, "c": 3}])
+        self.assertEqual(report, {"missing": ["b"], "unused": ["c"]})
+
+
 class TestSMSQueue(unittest.TestCase):
     """Tests para SMSQueue"""
 
@@ -183,6 +236,8 @@ class TestSMSQueue(unittest.TestCase):
             content="Test2",
             priority=SMSPriority.URGENT
         )
+        self.assertFalse(hasattr(task1, "__dict__"))
+        self.assertEqual(task1.number_list(), ["3001234567"])
         print(f"\n✓ Prioridades")
         print(f"  Task1 (LOW): {task1.priority.value}")
         print(f"  Task2 (URGENT): {task2.priority.value}")
@@ -209,6 +264,239 @@ class TestSMSRetry(unittest.TestCase):
         self.assertEqual(status["queue_size"], 1)
 
 
+class TestIdempotency(unittest.TestCase):
+    """Tests para envíos idempotentes"""
+
+    def setUp(self):
+        """Configurar antes de cada test"""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.sender = SMSSender()
+        self.sender.db = Database(str(Path(self.tmpdir.name) / "test.db"))
+        self.sender.idempotency = IdempotencyStore(self.sender.db)
+        self.sender.writer = WriteBehindWriter(self.sender.db.db_path)
+        self.sender.api = mock.Mock()
+        self.sender.api.send_sms.return_value = {"code": 0, "id": "SMS_IDEM"}
+
+    def tearDown(self):
+        """Limpiar después de cada test"""
+        self.sender.writer.stop()
+        self.sender.db.disconnect()
+        self.tmpdir.cleanup()
+
+    def test_derived_key_ignores_order(self):
+        """Probar que la clave derivada no depende del orden"""
+        key1 = derive_idempotency_key(["3001234567", "3007654321"], "Hola")
+        key2 = derive_idempotency_key(["3007654321", "3001234567"], "Hola")
+        key3 = derive_idempotency_key(["3007654321", "3001234567"], "Chao")
+        self.assertEqual(key1, key2)
+        self.assertNotEqual(key1, key3)
+
+    def test_replay_skips_gateway(self):
+        """Probar que un envío repetido no vuelve a llamar al gateway"""
+        first = self.sender.send_sms(["3001234567"], "Test idempotente")
+        second = self.sender.send_sms(["3001234567"], "Test idempotente")
+        print(f"\n✓ Replay: {second.get('idempotent_replay')}")
+        self.assertEqual(self.sender.api.send_sms.call_count, 1)
+        self.assertEqual(second["sent_ids"], first["sent_ids"])
+        self.assertTrue(second["idempotent_replay"])
+
+    def test_failed_send_releases_key(self):
+        """Probar que un envío fallido permite reintentar"""
+        self.sender.api.send_sms.return_value = {"code": -10, "error_message": "Saldo"}
+        self.sender.send_sms(["3001234567"], "Test", idempotency_key="k1")
+        self.sender.api.send_sms.return_value = {"code": 0, "id": "SMS_OK"}
+        result = self.sender.send_sms(["3001234567"], "Test", idempotency_key="k1")
+        self.assertEqual(self.sender.api.send_sms.call_count, 2)
+        self.assertEqual(result["sent_ids"], ["SMS_OK"])
+
+    def test_queue_deduplicates(self):
+        """Probar que la cola no encola dos veces el mismo envío"""
+        queue = SMSQueue(worker_count=1)
+        task1 = queue.enqueue_sms(["3001234567"], "Test")
+        task2 = queue.enqueue_sms(["3001234567"], "Test")
+        self.assertEqual(task1, task2)
+        self.assertEqual(queue.get_status()["queue_size"], 1)
+
+
+class TestStreamingSend(unittest.TestCase):
+    """Tests para envío en streaming"""
+
+    def setUp(self):
+        """Configurar antes de cada test"""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.sender = SMSSender()
+        self.sender.db = Database(str(Path(self.tmpdir.name) / "test.db"))
+        self.sender.idempotency = IdempotencyStore(self.sender.db)
+        self.sender.writer = WriteBehindWriter(self.sender.db.db_path)
+        self.sender.api = mock.Mock()
+        self.sender.api.send_sms.side_effect = lambda **kw: {
+            "code": 0, "id": f"SMS_{kw['numbers'][0]}"
+        }
+
+    def tearDown(self):
+        """Limpiar después de cada test"""
+        self.sender.writer.stop()
+        self.sender.db.disconnect()
+        self.tmpdir.cleanup()
+
+    def test_iter_number_batches(self):
+        """Probar lotes incrementales con deduplicación"""
+        numbers = iter(["3001234567", "300-123-4567", "bad", "3007654321", "3009999999"])
+        batches = list(self.sender.iter_number_batches(numbers, batch_size=2))
+        print(f"\n✓ Lotes: {batches}")
+        self.assertEqual(batches, [["3001234567", "3007654321"], ["3009999999"]])
+
+    def test_dedupe_window_bounds_memory(self):
+        """Probar que solo se recuerdan los últimos números de la ventana"""
+        numbers = ["3000000001", "3000000002", "3000000001", "3000000003", "3000000001"]
+        batches = list(self.sender.iter_number_batches(numbers, batch_size=10, dedupe_window=2))
+        # El tercer "...0001" ya salió de la ventana (0002, 0003)
+        self.assertEqual(batches, [["3000000001", "3000000002", "3000000003", "3000000001"]])
+        batches = list(self.sender.iter_number_batches(numbers, batch_size=10, dedupe_window=0))
+        self.assertEqual(batches, [["3000000001", "3000000002", "3000000003"]])
+
+    def test_first_batch_before_input_consumed(self):
+        """Probar que el primer lote sale antes de leer toda la entrada"""
+        consumed = []
+
+        def numbers():
+            for i in range(5):
+                consumed.append(i)
+                yield f"300000000{i}"
+
+        calls_at_send = []
+        self.sender.api.send_sms.side_effect = lambda **kw: (
+            calls_at_send.append(len(consumed)) or {"code": 0, "id": f"SMS_{len(calls_at_send)}"}
+        )
+
+        result = self.sender.send_stream(numbers(), "Test", batch_size=2)
+        self.assertEqual(result["batches"], 3)
+        self.assertEqual(result["sms_count"], 5)
+        self.assertEqual(calls_at_send[0], 2)
+
+    def test_stream_replays_accepted_batches(self):
+        """Probar que repetir el envío no reenvía lotes aceptados"""
+        numbers = ["3001234567", "3007654321", "3009999999"]
+        self.sender.send_stream(iter(numbers), "Test", batch_size=2)
+        result = self.sender.send_stream(iter(numbers), "Test", batch_size=2)
+        self.assertEqual(self.sender.api.send_sms.call_count, 2)
+        self.assertEqual(result["sms_count"], 3)
+
+
+class TestWriteBehind(unittest.TestCase):
+    """Tests para escritura diferida"""
+
+    def setUp(self):
+        """Configurar antes de cada test"""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_path = str(Path(self.tmpdir.name) / "test.db")
+        self.db = Database(self.db_path)
+        self.writer = WriteBehindWriter(self.db_path, batch_size=3, flush_interval_ms=50)
+
+    def tearDown(self):
+        """Limpiar después de cada test"""
+        self.writer.stop()
+        self.db.disconnect()
+        self.tmpdir.cleanup()
+
+    def test_row_writer_is_abstract(self):
+        """Probar que los escritores deben implementar _enqueue"""
+        with self.assertRaises(TypeError):
+            RowWriter()
+        self.assertIsInstance(self.writer, RowWriter)
+
+    def test_flush_persists_rows(self):
+        """Probar que flush confirma SMS y transacciones encolados"""
+        for i in range(5):
+            self.writer.save_sms(f"SMS_{i}", "0152C274", ["3001234567"], "Test")
+            self.writer.save_transaction("send_sms", sms_count=1, notes=f"SMS_{i}")
+        self.assertTrue(self.writer.flush(timeout=5))
+
+        sms = self.db.execute_query("SELECT COUNT(*) AS c FROM sms")[0]["c"]
+        tx = self.db.execute_query("SELECT COUNT(*) AS c FROM transactions")[0]["c"]
+        recipients = self.db.execute_query("SELECT COUNT(*) AS c FROM sms_recipients")[0]["c"]
+        print(f"\n✓ Filas escritas: {self.writer.get_stats()}")
+        self.assertEqual(sms, 5)
+        self.assertEqual(tx, 5)
+        self.assertEqual(recipients, 5)
+        self.assertGreaterEqual(self.writer.commits, 2)
+
+    def test_stop_flushes_pending(self):
+        """Probar que detener el escritor vacía el buffer"""
+        self.writer.save_report("REP_1", "SMS_1", "3001234567", "delivered")
+        self.writer.stop()
+        reports = self.db.execute_query("SELECT * FROM reports")
+        self.assertEqual(len(reports), 1)
+
+
+    def test_bad_row_is_isolated(self):
+        """Probar que una fila inválida no descarta el resto del commit y se informa en flush"""
+        self.writer.save_sms("SMS_1", "0152C274", ["3001234567"], "Test")
+        self.writer.save_transaction("send_sms", sms_count=1, notes="SMS_1")
+        # Un valor que SQLite no puede guardar
+        self.writer.save_report("REP_1", "SMS_1", "3001234567", "failed", error_code={"code": 5})
+        self.writer.save_transaction("send_sms", sms_count=1, notes="SMS_2")
+
+        with self.assertRaises(WriteBehindError) as raised:
+            self.writer.flush(timeout=5)
+        self.assertEqual(raised.exception.dropped, 1)
+        self.assertEqual(raised.exception.failures[0][0], "report")
+        self.assertTrue(self.writer.flush(timeout=5))
+
+        tx = self.db.execute_query("SELECT COUNT(*) AS c FROM transactions")[0]["c"]
+        sms = self.db.execute_query("SELECT COUNT(*) AS c FROM sms")[0]["c"]
+        self.assertEqual((sms, tx), (1, 2))
+        self.assertEqual(self.writer.get_stats()["failed_rows"], 1)
+
+    def test_busy_database_is_retried(self):
+        """Probar que un commit con la base ocupada se reintenta sin perder filas"""
+        real_bulk = Database.save_transactions_bulk
+        calls = []
+
+        def busy_once(db, *args, **kwargs):
+            calls.append(1)
+            if len(calls) == 1:
+                raise sqlite3.OperationalError("database is locked")
+            return real_bulk(db, *args, **kwargs)
+
+        with mock.patch.object(Database, "save_transactions_bulk", busy_once):
+            self.writer.save_transaction("send_sms", sms_count=1)
+            self.assertTrue(self.writer.flush(timeout=5))
+
+        tx = self.db.execute_query("SELECT COUNT(*) AS c FROM transactions")[0]["c"]
+        self.assertEqual((tx, len(calls)), (1, 2))
+
+
+class TestMemoryPipeline(unittest.TestCase):
+    """Tests para el envío completo sobre el motor en memoria"""
+
+    def setUp(self):
+        """Configurar antes de cada test"""
+        self.storage = MemoryStorage()
+        self.sender = SMSSender(storage=self.storage)
+        self.sender.api = mock.Mock()
+        self.sender.api.send_sms.side_effect = lambda **kw: {
+            "code": 0, "id": f"SMS_{kw['numbers'][0]}"
+        }
+
+    def test_send_writes_to_memory(self):
+        """Probar que el envío guarda SMS y transacciones sin disco"""
+        self.assertIsInstance(self.sender.writer, DirectWriter)
+        result = self.sender.send_stream(
+            iter(["3001234567", "3007654321", "3009999999"]), "Test", batch_size=2
+        )
+        self.assertEqual(result["sms_count"], 3)
+        stats = self.storage.get_statistics()
+        self.assertEqual((stats["total_sms"], stats["total_transactions"]), (2, 2))
+
+    def test_replay_uses_memory_keys(self):
+        """Probar que la idempotencia funciona sobre el motor en memoria"""
+        self.sender.send_sms(["3001234567"], "Test idempotente")
+        second = self.sender.send_sms(["3001234567"], "Test idempotente")
+        self.assertEqual(self.sender.api.send_sms.call_count, 1)
+        self.assertTrue(second["idempotent_replay"])
+
+
 def run_tests():
     """Ejecutar todos los tests"""
     # Crear suite
@@ -218,8 +506,13 @@ def run_tests():
     suite.addTests(loader.loadTestsFromTestCase(TestSMSSender))
     suite.addTests(loader.loadTestsFromTestCase(TestMessageProcessor))
     suite.addTests(loader.loadTestsFromTestCase(TestMessageTemplate))
+    suite.addTests(loader.loadTestsFromTestCase(TestTemplateEngine))
     suite.addTests(loader.loadTestsFromTestCase(TestSMSQueue))
     suite.addTests(loader.loadTestsFromTestCase(TestSMSRetry))
+    suite.addTests(loader.loadTestsFromTestCase(TestIdempotency))
+    suite.addTests(loader.loadTestsFromTestCase(TestStreamingSend))
+    suite.addTests(loader.loadTestsFromTestCase(TestWriteBehind))
+    suite.addTests(loader.loadTestsFromTestCase(TestMemoryPipeline))
 
     # Ejecutar
     runner = unittest.TextTestRunner(verbosity=2)
@@ -6,6 +6,7 @@ import unittest
 import sys
 import json
 from pathlib import Path
+from unittest.mock import patch
 
 # Agregar parent directory al path
 sys.path.insert(0, str(Path(__file__).parent.parent))
@@ -153,6 +154,23 @@ class TestWebRoutes(unittest.TestCase):
         print(f"✓ 404 Not Found: {response.status_code}")
         self.assertEqual(response.status_code, 404)
 
+    def test_debug_queries_get_is_read_only(self):
+        """Probar que GET no reinicia el perfilador y que volcar/reiniciar son POST"""
+        from query_profiler import profiler
+
+        with patch.object(profiler, "enabled", True):
+            profiler.record("SELECT 1", 1.0)
+            response = self.client.get('/api/debug/queries?dump=1&reset=1')
+            print(f"✓ Debug queries GET: {response.status_code}")
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('dump', response.get_json()['data'])
+            self.assertTrue(profiler.stats)
+
+            self.assertEqual(self.client.get('/api/debug/queries/reset').status_code, 405)
+            response = self.client.post('/api/debug/queries/reset')
+            self.assertEqual(response.get_json()['code'], 0)
+            self.assertFalse(profiler.stats)
+
     def test_logout(self):
         """Probar logout"""
         response = self.client.get('/logout', follow_redirects=True)
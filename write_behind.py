@@ -0,0 +1,446 @@
+"""
+Escritura diferida de SMS, transacciones, reportes y estados de campaña
+Un único hilo agrupa los INSERT en commits periódicos para que
+los hilos de envío nunca esperen por la durabilidad de SQLite
+"""
+import atexit
+import logging
+import sqlite3
+from abc import ABC, abstractmethod
+import threading
+import time
+from queue import Queue, Empty
+from typing import Callable, Dict, List, Optional, Tuple
+from uuid import uuid4
+from database import Database
+from config import (
+    WRITE_BEHIND_BATCH_SIZE,
+    WRITE_BEHIND_FLUSH_MS,
+    WRITE_BEHIND_MAX_PENDING,
+    WRITE_BEHIND_RETRIES,
+    WRITE_BEHIND_RETRY_MS
+)
+
+logger = logging.getLogger(__name__)
+
+# Método masivo de Database para cada tipo de fila
+BULK_WRITERS = {
+    "sms": "save_sms_bulk",
+    "transaction": "save_transactions_bulk",
+    "report": "save_reports_bulk",
+    "campaign_contact": "update_campaign_contacts_bulk",
+    "campaign_checkpoint": "save_campaign_checkpoints_bulk"
+}
+
+# Tipos que se insertan: los reintentos pueden repetir IDs ya escritos
+INSERT_KINDS = {"sms", "transaction", "report"}
+
+_STOP = object()
+
+# Filas descartadas que se conservan para informar en flush (el resto solo se cuenta)
+MAX_REPORTED_FAILURES = 100
+
+
+class WriteBehindError(Exception):
+    """Filas que no se pudieron escribir (ni reintentando ni por separado)"""
+
+    def __init__(self, failures: List[Tuple[str, Dict, str]], dropped: int):
+        """
+        Inicializar error
+
+        Args:
+            failures: (tipo, fila, error) de las primeras filas descartadas
+            dropped: Total de filas descartadas
+        """
+        super().__init__(f"{dropped} filas descartadas por el escritor diferido: "
+                         f"{failures[0][2] if failures else ''}")
+        self.failures = failures
+        self.dropped = dropped
+
+
+def _write_rows(target, kind: str, records: List[Dict]):
+    """
+    Aplicar filas de un tipo con su método masivo
+
+    Args:
+        target: Database o motor con los métodos de BULK_WRITERS
+        kind: Tipo de fila
+        records: Filas a escribir
+    """
+    method = getattr(target, BULK_WRITERS[kind])
+    if kind in INSERT_KINDS:
+        return method(records, ignore_existing=True)
+    return method(records)
+
+
+class RowWriter(ABC):
+    """Productores comunes: cada fila se entrega a _enqueue como (tipo, dict)"""
+
+    def save_sms(self, sms_id: str, account: str, numbers: List[str],
+                 content: str, sender: Optional[str] = None,
+                 sendtime: Optional[str] = None):
+        """Encolar SMS enviado junto con sus destinatarios"""
+        self._enqueue("sms", {
+            "sms_id": sms_id, "account": account, "numbers": numbers,
+            "content": content, "sender": sender, "sendtime": sendtime
+        })
+
+    def save_transaction(self, operation: str, sms_count: int = 0,
+                         balance_change: float = 0, status: str = "success",
+                         notes: Optional[str] = None,
+                         transaction_id: Optional[str] = None):
+        """Encolar transacción"""
+        self._enqueue("transaction", {
+            "transaction_id": transaction_id or str(uuid4()), "operation": operation,
+            "sms_count": sms_count, "balance_change": balance_change,
+            "status": status, "notes": notes
+        })
+
+    def save_report(self, report_id: str, sms_id: str, number: str,
+                    status: str, error_code: Optional[int] = None,
+                    error_message: Optional[str] = None):
+        """Encolar reporte de entrega"""
+        self._enqueue("report", {
+            "report_id": report_id, "sms_id": sms_id, "number": number,
+            "status": status, "error_code": error_code, "error_message": error_message
+        })
+
+    def update_campaign_contact(self, contact_id: str, status: str,
+                                sent_at: Optional[str] = None,
+                                error: Optional[str] = None):
+        """Encolar cambio de estado de un contacto de campaña"""
+        self._enqueue("campaign_contact", {
+            "id": contact_id, "status": status, "sent_at": sent_at, "error": error
+        })
+
+    def save_campaign_checkpoint(self, campaign_id: str, last_seq: int,
+                                 sent: int = 0, failed: int = 0, shard: int = 0,
+                                 owner: Optional[str] = None):
+        """Encolar el cursor de envío de una campaña (va tras los estados ya encolados)"""
+        self._enqueue("campaign_checkpoint", {
+            "campaign_id": campaign_id, "shard": shard, "last_seq": last_seq,
+            "sent": sent, "failed": failed, "owner": owner
+        })
+
+    @abstractmethod
+    def _enqueue(self, kind: str, record: Dict):
+        """Entregar una fila (tipo de BULK_WRITERS, dict) al escritor"""
+
+    def _drop(self, kind: str, record: Dict, error: Exception):
+        """Registrar una fila descartada para informarla en el próximo flush"""
+        with self.failures_lock:
+            self.failed_rows += 1
+            self.dropped_since_flush += 1
+            if len(self.failures) < MAX_REPORTED_FAILURES:
+                self.failures.append((kind, record, str(error)))
+        logger.error(f"❌ Fila descartada por el escritor ({kind}): {str(error)}")
+
+    def _raise_failures(self):
+        """Lanzar WriteBehindError con lo descartado desde el último flush"""
+        with self.failures_lock:
+            failures, dropped = self.failures, self.dropped_since_flush
+            self.failures, self.dropped_since_flush = [], 0
+        if dropped:
+            raise WriteBehindError(failures, dropped)
+
+
+class DirectWriter(RowWriter):
+    """Escritor sin buffer para motores sin disco: aplica cada fila en el momento"""
+
+    def __init__(self, storage):
+        """
+        Inicializar escritor
+
+        Args:
+            storage: Motor con los métodos de BULK_WRITERS
+        """
+        self.storage = storage
+        self.written_rows = 0
+        self.failed_rows = 0
+        self.failures: List[Tuple[str, Dict, str]] = []
+        self.dropped_since_flush = 0
+        self.failures_lock = threading.Lock()
+
+    def _enqueue(self, kind: str, record: Dict):
+        """Escribir la fila directamente"""
+        try:
+            _write_rows(self.storage, kind, [record])
+            self.written_rows += 1
+        except Exception as e:
+            self._drop(kind, record, e)
+
+    def start(self):
+        """Sin hilo que iniciar"""
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Todo queda escrito al encolar
+
+        Raises:
+            WriteBehindError: Si se descartaron filas desde el último flush
+        """
+        self._raise_failures()
+        return True
+
+    def stop(self, timeout: float = 10):
+        """Sin hilo que detener"""
+
+    def get_stats(self) -> Dict:
+        """Obtener estadísticas del escritor"""
+        return {
+            "pending": 0,
+            "written_rows": self.written_rows,
+            "failed_rows": self.failed_rows,
+            "commits": self.written_rows,
+            "is_running": False
+        }
+
+
+class WriteBehindWriter(RowWriter):
+    """Escritor en segundo plano con commits agrupados"""
+
+    def __init__(self, db_path: str, batch_size: int = WRITE_BEHIND_BATCH_SIZE,
+                 flush_interval_ms: int = WRITE_BEHIND_FLUSH_MS,
+                 max_pending: int = WRITE_BEHIND_MAX_PENDING,
+                 retries: int = WRITE_BEHIND_RETRIES,
+                 retry_ms: int = WRITE_BEHIND_RETRY_MS):
+        """
+        Inicializar escritor
+
+        Args:
+            db_path: Ruta del archivo de base de datos
+            batch_size: Filas que disparan un commit
+            flush_interval_ms: Espera máxima de una fila antes del commit
+            max_pending: Filas en buffer antes de bloquear a los productores
+            retries: Reintentos de un commit con la base ocupada
+            retry_ms: Espera antes del primer reintento (se duplica en cada uno)
+        """
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.retries = retries
+        self.retry_delay = retry_ms / 1000
+        self.queue: Queue = Queue(maxsize=max_pending)
+        self.worker: Optional[threading.Thread] = None
+        self.lock = threading.Lock()
+        self.written_rows = 0
+        self.failed_rows = 0
+        self.failures: List[Tuple[str, Dict, str]] = []
+        self.dropped_since_flush = 0
+        self.failures_lock = threading.Lock()
+        self.commits = 0
+        self.listeners: List[Callable[[str, List[Dict]], None]] = []
+
+    # ==================== PRODUCTORES ====================
+
+    def _enqueue(self, kind: str, record: Dict):
+        """Agregar fila al buffer (bloquea solo si el buffer está lleno)"""
+        self.start()
+        if self.queue.full():
+            logger.warning("⚠️  Buffer de escritura lleno, aplicando contrapresión")
+        self.queue.put((kind, record))
+
+    # ==================== CICLO DE VIDA ====================
+
+    def start(self):
+        """Iniciar hilo escritor si no está corriendo"""
+        with self.lock:
+            if self.worker and self.worker.is_alive():
+                return
+
+            self.worker = threading.Thread(
+                target=self._writer_loop,
+                name="WriteBehindWriter",
+                daemon=True
+            )
+            self.worker.start()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Esperar a que todo lo encolado quede confirmado
+
+        Args:
+            timeout: Segundos máximos de espera
+
+        Returns:
+            True si el buffer quedó vacío
+
+        Raises:
+            WriteBehindError: Si se descartaron filas desde el último flush
+        """
+        if not self.worker or not self.worker.is_alive():
+            done = self.queue.empty()
+        else:
+            event = threading.Event()
+            self.queue.put(event)
+            done = event.wait(timeout)
+
+        self._raise_failures()
+        return done
+
+    def stop(self, timeout: float = 10):
+        """Vaciar el buffer y detener el hilo"""
+        with self.lock:
+            worker = self.worker
+            if not worker or not worker.is_alive():
+                return
+            self.queue.put(_STOP)
+
+        worker.join(timeout=timeout)
+        logger.info(f"✅ Escritor diferido detenido ({self.written_rows} filas escritas)")
+
+    def add_listener(self, listener: Callable[[str, List[Dict]], None]):
+        """
+        Registrar una función que recibe las filas ya confirmadas
+
+        Args:
+            listener: Función (tipo, filas) llamada desde el hilo escritor
+        """
+        with self.lock:
+            if listener not in self.listeners:
+                self.listeners.append(listener)
+
+    def get_stats(self) -> Dict:
+        """Obtener estadísticas del escritor"""
+        return {
+            "pending": self.queue.qsize(),
+            "written_rows": self.written_rows,
+            "failed_rows": self.failed_rows,
+            "commits": self.commits,
+            "is_running": bool(self.worker and self.worker.is_alive())
+        }
+
+    # ==================== HILO ESCRITOR ====================
+
+    def _writer_loop(self):
+        """Agrupar filas y confirmarlas cada N filas o M milisegundos"""
+        db = Database(self.db_path)
+        pending: List[Tuple[str, Dict]] = []
+        deadline = 0.0
+
+        while True:
+            timeout = max(0.0, deadline - time.monotonic()) if pending else None
+            try:
+                item = self.queue.get(timeout=timeout)
+            except Empty:
+                item = None
+
+            if item is _STOP:
+                self._commit(db, pending)
+                break
+
+            if isinstance(item, threading.Event):
+                self._commit(db, pending)
+                pending = []
+                item.set()
+                continue
+
+            if item is not None:
+                if not pending:
+                    deadline = time.monotonic() + self.flush_interval
+                pending.append(item)
+
+            if pending and (len(pending) >= self.batch_size or time.monotonic() >= deadline):
+                self._commit(db, pending)
+                pending = []
+
+        db.disconnect()
+
+    def _commit(self, db, rows: List[Tuple[str, Dict]]):
+        """
+        Escribir un grupo de filas en una sola transacción
+
+        Si la base está ocupada se reintenta con espera creciente; si aun
+        así falla, el grupo se escribe por tipo y luego fila por fila, de
+        modo que solo se descartan las filas que fallan por sí mismas.
+        """
+        if not rows:
+            return
+
+        grouped: Dict[str, List[Dict]] = {}
+        for kind, record in rows:
+            grouped.setdefault(kind, []).append(record)
+
+        error = self._write(db, grouped, self.retries)
+        if error is None:
+            written = grouped
+        else:
+            logger.warning(f"⚠️  Commit agrupado fallido ({len(rows)} filas), escribiendo por partes: {str(error)}")
+            written = {}
+            for kind, records in grouped.items():
+                if self._write(db, {kind: records}) is None:
+                    written[kind] = records
+                    continue
+                for record in records:
+                    error = self._write(db, {kind: [record]})
+                    if error is None:
+                        written.setdefault(kind, []).append(record)
+                    else:
+                        self._drop(kind, record, error)
+
+        self.written_rows += sum(len(records) for records in written.values())
+        self.commits += bool(written)
+        logger.debug(f"💾 Commit agrupado: {len(rows)} filas")
+
+        for listener in self.listeners:
+            for kind, records in written.items():
+                try:
+                    listener(kind, records)
+                except Exception as e:
+                    logger.warning(f"⚠️  Error en listener de escritura: {str(e)}")
+
+    def _write(self, db, grouped: Dict[str, List[Dict]], retries: int = 0) -> Optional[Exception]:
+        """
+        Escribir filas agrupadas por tipo en una transacción
+
+        Args:
+            db: Base de datos del hilo escritor
+            grouped: Filas por tipo de BULK_WRITERS
+            retries: Reintentos si la base está ocupada (bloqueo de otro escritor)
+
+        Returns:
+            None si quedaron confirmadas, o el último error
+        """
+        delay = self.retry_delay
+        for attempt in range(retries + 1):
+            try:
+                with db.transaction():
+                    for kind, records in grouped.items():
+                        _write_rows(db, kind, records)
+                return None
+            except sqlite3.OperationalError as e:
+                error = e
+                if attempt < retries:
+                    time.sleep(delay)
+                    delay *= 2
+            except Exception as e:
+                return e
+        return error
+
+
+# Un escritor por archivo de base de datos y proceso
+_writers: Dict[str, WriteBehindWriter] = {}
+_writers_lock = threading.Lock()
+
+
+def get_writer(db_path: str) -> WriteBehindWriter:
+    """
+    Obtener el escritor compartido de una base de datos
+
+    Args:
+        db_path: Ruta del archivo de base de datos
+
+    Returns:
+        Escritor diferido del proceso para esa ruta
+    """
+    with _writers_lock:
+        if db_path not in _writers:
+            _writers[db_path] = WriteBehindWriter(db_path)
+        return _writers[db_path]
+
+
+@atexit.register
+def shutdown_writers():
+    """Vaciar todos los escritores al terminar el proceso"""
+    for writer in list(_writers.values()):
+        writer.stop()